@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""Benchmarks for the depositor fee calculator's hot loops on synthetic histories."""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import calc_depositor_fees as calc  # noqa: E402
+
+DEFAULT_SIZES = (10, 1_000, 100_000, 1_000_000)
+DEFAULT_TRANSFER_MIXES = (0.0, 0.3)
+DEFAULT_REPEAT = 3
+DEFAULT_DECIMALS = 18
+DEFAULT_SEED = 1
+# Timing regressions smaller than this are treated as noise by --compare.
+COMPARE_NOISE_FLOOR_MS = 1.0
+BENCH_VAULT = '0x' + 'be' * 20
+BENCH_DEPOSITOR = '0x' + 'd0' * 20
+BENCH_COUNTERPARTY = '0x' + 'c0' * 20
+GENESIS_TIMESTAMP = 1_600_000_000
+BLOCK_TIME_SECONDS = 12
+PERFORMANCE_FEE_BPS = 1000
+
+
+@dataclass
+class StageResult:
+    events: int
+    transfer_mix: float
+    stage: str
+    best_ms: float
+    peak_bytes: int
+
+
+class PpsOracle:
+    # Deterministic pricePerShare: slow growth plus a hashed wobble, so the
+    # history has both gains and small losses. Also answers the only RPC
+    # reads the benchmarked stages make.
+    def __init__(self, decimals: int, head_block: int) -> None:
+        self.scale = 10 ** decimals
+        self.head_block = head_block
+
+    def price(self, block_number: int) -> int:
+        growth = self.scale * block_number // 20_000_000
+        wobble = (block_number * 2_654_435_761) % 1_009 * self.scale // 10_000_000
+        return self.scale + growth - wobble
+
+    def rpc_call(self, rpc_url: str, method: str, params: List[Any]) -> Any:
+        if method == 'eth_blockNumber':
+            return hex(self.head_block)
+        if method == 'eth_call':
+            return f'0x{self.price(int(params[1], 16)):064x}'
+        raise RuntimeError(f'Benchmark oracle does not serve {method}')
+
+
+def generate_history(
+    events: int,
+    transfer_mix: float,
+    decimals: int,
+    seed: int,
+) -> Tuple[List[calc.DepositEvent], List[calc.WithdrawEvent], List[calc.TransferEvent], PpsOracle]:
+    # One depositor's history in (block, log) order. The balance never goes
+    # negative; a withdrawal or outgoing transfer moves part of what is held.
+    rng = random.Random(seed)
+    scale = 10 ** decimals
+    oracle = PpsOracle(decimals, 0)
+    deposits: List[calc.DepositEvent] = []
+    withdrawals: List[calc.WithdrawEvent] = []
+    transfers: List[calc.TransferEvent] = []
+    block_number = 1_000
+    balance = 0
+    for _ in range(events):
+        block_number += rng.randint(1, 50)
+        log_index = rng.randint(0, 5)
+        timestamp = GENESIS_TIMESTAMP + block_number * BLOCK_TIME_SECONDS
+        pps = oracle.price(block_number)
+        event_id = f'{block_number}_{log_index}'
+        if balance > 0 and rng.random() < transfer_mix:
+            if rng.random() < 0.5:
+                shares = rng.randint(1, balance)
+                sender, receiver = BENCH_DEPOSITOR, BENCH_COUNTERPARTY
+                balance -= shares
+            else:
+                shares = rng.randint(1, 1_000 * scale)
+                sender, receiver = BENCH_COUNTERPARTY, BENCH_DEPOSITOR
+                balance += shares
+            transfers.append(calc.TransferEvent(
+                id=event_id,
+                sender=sender,
+                receiver=receiver,
+                value=str(shares),
+                block_number=block_number,
+                log_index=log_index,
+                block_timestamp=timestamp,
+            ))
+        elif balance > 0 and rng.random() < 0.4:
+            shares = rng.randint(1, balance)
+            balance -= shares
+            withdrawals.append(calc.WithdrawEvent(
+                id=event_id,
+                sender=BENCH_DEPOSITOR,
+                receiver=BENCH_DEPOSITOR,
+                owner=BENCH_DEPOSITOR,
+                assets=str(shares * pps // scale),
+                shares=str(shares),
+                block_number=block_number,
+                log_index=log_index,
+                block_timestamp=timestamp,
+            ))
+        else:
+            shares = rng.randint(1, 1_000 * scale)
+            balance += shares
+            deposits.append(calc.DepositEvent(
+                id=event_id,
+                sender=BENCH_DEPOSITOR,
+                owner=BENCH_DEPOSITOR,
+                assets=str(shares * pps // scale),
+                shares=str(shares),
+                block_number=block_number,
+                log_index=log_index,
+                block_timestamp=timestamp,
+            ))
+    oracle.head_block = block_number + 1_000
+    return deposits, withdrawals, transfers, oracle
+
+
+def bench_context(oracle: PpsOracle, decimals: int, index: calc.PpsSeriesIndex) -> calc.VaultContext:
+    # A fresh context per run, so every run starts from the same warm PPS index.
+    ctx = calc.VaultContext(
+        address=BENCH_VAULT,
+        chain_id=calc.DEFAULT_CHAIN_ID,
+        rpc_url='bench://oracle',
+        decimals=decimals,
+        symbol='BENCH',
+        asset_address=BENCH_VAULT,
+    )
+    ctx.pps_index = index
+    return ctx
+
+
+def measure(run: Callable[[], Any], repeat: int) -> Tuple[float, int, Any]:
+    # Best wall time over repeat untraced runs, then one traced run for the
+    # peak of memory allocated while the stage ran.
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = run()
+        best = min(best, time.perf_counter() - start)
+    result = None
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = run()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return best * 1000, peak, result
+
+
+def bench_history(events: int, transfer_mix: float, decimals: int, seed: int, repeat: int) -> List[StageResult]:
+    deposits, withdrawals, transfers, oracle = generate_history(events, transfer_mix, decimals, seed)
+    calc.rpc_call = oracle.rpc_call
+    results: List[StageResult] = []
+
+    def record(stage: str, run: Callable[[], Any]) -> Any:
+        best_ms, peak, value = measure(run, repeat)
+        results.append(StageResult(events, transfer_mix, stage, best_ms, peak))
+        return value
+
+    timeline = record(
+        'build_event_timeline',
+        lambda: calc.build_event_timeline(deposits, withdrawals, transfers, BENCH_DEPOSITOR),
+    )
+    index = calc.PpsSeriesIndex(calc.DEFAULT_CHAIN_ID, BENCH_VAULT)
+    index.extend(((block, oracle.price(block)) for block in timeline.blocks), timeline.blocks[-1])
+    current_pps = oracle.price(oracle.head_block)
+    ctx = bench_context(oracle, decimals, index)
+    # The weighted entry PPS is computed inside calculate_position, which
+    # replaced calculate_weighted_average_entry_pps, so it has no stage of its own.
+    position = record(
+        'calculate_position',
+        lambda: calc.calculate_position(bench_context(oracle, decimals, index), timeline, current_pps, decimals),
+    )
+    record(
+        'calculate_incremental_profit_and_fees',
+        lambda: calc.calculate_incremental_profit_and_fees(position, PERFORMANCE_FEE_BPS),
+    )
+    series = record('prepare_balance_profit_series', lambda: calc.prepare_balance_profit_series(ctx, position))
+    record('sample_series', lambda: calc.sample_series(series, 300))
+    record('position_event_rows', lambda: calc.position_event_rows(position, decimals))
+    return results
+
+
+def compare_results(results: List[StageResult], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, encoding='utf-8') as handle:
+        baseline = {
+            (item['events'], item['transfer_mix'], item['stage']): item
+            for item in json.load(handle)['results']
+        }
+    regressions: List[str] = []
+    for result in results:
+        previous = baseline.get((result.events, result.transfer_mix, result.stage))
+        if previous is None:
+            continue
+        slower = result.best_ms - previous['best_ms']
+        if slower > COMPARE_NOISE_FLOOR_MS and result.best_ms > previous['best_ms'] * (1 + tolerance):
+            regressions.append(
+                f'{result.stage} ({result.events} events, {result.transfer_mix:.0%} transfers): '
+                f"{previous['best_ms']:.2f} ms -> {result.best_ms:.2f} ms"
+            )
+        if result.peak_bytes > previous['peak_bytes'] * (1 + tolerance) + 1024 * 1024:
+            regressions.append(
+                f'{result.stage} ({result.events} events, {result.transfer_mix:.0%} transfers): '
+                f"peak {previous['peak_bytes'] / 2**20:.1f} MiB -> {result.peak_bytes / 2**20:.1f} MiB"
+            )
+    return regressions
+
+
+def parse_list(raw: str, convert: Callable[[str], Any]) -> List[Any]:
+    return [convert(item) for item in raw.split(',') if item.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark calc_depositor_fees hot loops on synthetic depositor histories'
+    )
+    parser.add_argument(
+        '--sizes',
+        default=','.join(str(size) for size in DEFAULT_SIZES),
+        help=f"Comma-separated event counts per history (default: {','.join(str(size) for size in DEFAULT_SIZES)})"
+    )
+    parser.add_argument(
+        '--transfer-mix',
+        default=','.join(str(mix) for mix in DEFAULT_TRANSFER_MIXES),
+        help='Comma-separated share of events that are holder-to-holder transfers '
+             f"(default: {','.join(str(mix) for mix in DEFAULT_TRANSFER_MIXES)})"
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f'Timed runs per stage; the best is reported (default: {DEFAULT_REPEAT})'
+    )
+    parser.add_argument(
+        '--decimals',
+        type=int,
+        default=DEFAULT_DECIMALS,
+        help=f'Vault share decimals; 18 exercises amounts wider than 64 bits (default: {DEFAULT_DECIMALS})'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=DEFAULT_SEED,
+        help=f'Seed of the synthetic history generator (default: {DEFAULT_SEED})'
+    )
+    parser.add_argument(
+        '--no-numpy',
+        action='store_true',
+        help='Benchmark the plain Python loops even when NumPy is installed'
+    )
+    parser.add_argument(
+        '--json',
+        help='Also write the results to this JSON file (usable as a --compare baseline)'
+    )
+    parser.add_argument(
+        '--compare',
+        help='Baseline JSON from an earlier --json run; exit with status 1 on regressions'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.2,
+        help='Relative slowdown or memory growth tolerated by --compare (default: 0.2)'
+    )
+    args = parser.parse_args()
+    if args.repeat <= 0:
+        parser.error('--repeat must be positive')
+
+    sizes = parse_list(args.sizes, int)
+    mixes = parse_list(args.transfer_mix, float)
+    if args.no_numpy:
+        calc.HAS_NUMPY = False
+
+    print(f"NumPy: {'on' if calc.HAS_NUMPY else 'off'}, decimals: {args.decimals}, repeat: {args.repeat}")
+    print(f"{'events':>9} {'transfers':>9}  {'stage':<38} {'best ms':>10} {'us/event':>9} {'peak MiB':>9}")
+    results: List[StageResult] = []
+    for size in sizes:
+        for mix in mixes:
+            for result in bench_history(size, mix, args.decimals, args.seed, args.repeat):
+                results.append(result)
+                print(
+                    f'{result.events:>9} {result.transfer_mix:>9.0%}  {result.stage:<38} '
+                    f'{result.best_ms:>10.2f} {result.best_ms * 1000 / result.events:>9.2f} '
+                    f'{result.peak_bytes / 2**20:>9.2f}',
+                    flush=True,
+                )
+
+    if args.json:
+        payload: Dict[str, Any] = {
+            'python': sys.version.split()[0],
+            'numpy': calc.HAS_NUMPY,
+            'decimals': args.decimals,
+            'seed': args.seed,
+            'results': [asdict(result) for result in results],
+        }
+        with open(args.json, 'w', encoding='utf-8') as handle:
+            json.dump(payload, handle, indent=2)
+
+    if args.compare:
+        regressions = compare_results(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
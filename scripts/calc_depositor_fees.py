@@ -2,33 +2,72 @@
 """Python port of the Yearn V3 depositor fee calculator."""
 
 import argparse
+import array
+import asyncio
+import atexit
 import bisect
+import csv
 import datetime
+import functools
+import gzip
+import heapq
+import http.client
+import importlib
+import importlib.util
 import json
 import logging
 import os
+import queue
+import random
+import sqlite3
+import ssl
 import sys
 import textwrap
+import threading
+import time
 import urllib.error
+import urllib.parse
 import urllib.request
-from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional, Tuple
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(message)s',
-)
 logger = logging.getLogger(__name__)
 
-try:
-    import matplotlib.pyplot as plt
-except ImportError:  # pragma: no cover
-    plt = None
 
-HAS_MATPLOTLIB = plt is not None
+class _LazyModule:
+    # Imports the named module on first attribute access, so importing this
+    # script stays cheap when plotting, bulk math or Parquet output are unused.
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(importlib.import_module(self._name), attr)
+
+
+# Optional dependencies are only located here; they are imported on first use.
+HAS_MATPLOTLIB = importlib.util.find_spec('matplotlib') is not None
+plt: Any = _LazyModule('matplotlib.pyplot') if HAS_MATPLOTLIB else None
+
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+np: Any = _LazyModule('numpy') if HAS_NUMPY else None
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+pa: Any = _LazyModule('pyarrow') if HAS_PYARROW else None
+pq: Any = _LazyModule('pyarrow.parquet') if HAS_PYARROW else None
+
+T = TypeVar('T')
 
-_CHAINLIST_RPCS: Optional[Dict[int, List[str]]] = None
 _CHAIN_BLOCK_TIME_CACHE: Dict[int, float] = {}
+_CHAINLIST_REFRESH: Optional[threading.Thread] = None
+_CHAINLIST_REFRESH_LOCK = threading.Lock()
+_CHAIN_CLIENTS: Dict[int, 'AsyncChainClient'] = {}
+_HTTP_POOLS: Dict[Tuple[str, str, int], 'HTTPConnectionPool'] = {}
+_HTTP_POOLS_LOCK = threading.Lock()
+_RPC_POOLS: Dict[str, 'RpcEndpointPool'] = {}
+# Highest block per chain at which Multicall3 was found missing (inf: not deployed at all).
+_MULTICALL_MISSING_AT: Dict[int, float] = {}
 
 
 
@@ -58,17 +97,27 @@ def load_local_env(file_path: str) -> None:
             os.environ[key] = value
 
 
-DOTENV_FILE = os.path.join(os.getcwd(), '.env')
-load_local_env(DOTENV_FILE)
+DOTENV_FILE = '.env'
+_LOCAL_ENV_LOADED = False
+
 
-ENVIO_GRAPHQL_URL = os.environ.get('ENVIO_GRAPHQL_URL', 'https://indexer.hyperindex.xyz/3fec0a4/v1/graphql')
-ENVIO_TOKEN = os.environ.get('ENVIO_PASSWORD', '')
+def _ensure_local_env() -> None:
+    # Loads ./.env once, on the first read of a setting it may hold.
+    global _LOCAL_ENV_LOADED
+    if not _LOCAL_ENV_LOADED:
+        _LOCAL_ENV_LOADED = True
+        load_local_env(os.path.join(os.getcwd(), DOTENV_FILE))
+
+
+DEFAULT_ENVIO_GRAPHQL_URL = 'https://indexer.hyperindex.xyz/3fec0a4/v1/graphql'
 DEFAULT_VAULT_ADDRESS = '0xBe53A109B494E5c9f97b9Cd39Fe969BE68BF6204'
 DEFAULT_CHAIN_ID = 1
 CHAIN_CONFIG = {
     1: {
         'name': 'Ethereum',
         'rpc_env': 'RPC_URL_ETHEREUM',
+        'finality_blocks': 64,
+        'block_time': 12.0,
         'fallback_rpcs': [
             'https://mainnet.gateway.tenderly.co/3V34wr9LQ5X3HupEWCw8kg',
             'https://eth.llamarpc.com',
@@ -80,6 +129,8 @@ CHAIN_CONFIG = {
     8453: {
         'name': 'Base',
         'rpc_env': 'RPC_URL_BASE',
+        'finality_blocks': 1800,
+        'block_time': 2.0,
         'fallback_rpcs': [
             'https://base.llamarpc.com',
             'https://rpc.ankr.com/base',
@@ -90,6 +141,8 @@ CHAIN_CONFIG = {
     42161: {
         'name': 'Arbitrum',
         'rpc_env': 'RPC_URL_ARBITRUM',
+        'finality_blocks': 14400,
+        'block_time': 0.25,
         'fallback_rpcs': [
             'https://arbitrum.llamarpc.com',
             'https://rpc.ankr.com/arbitrum',
@@ -100,6 +153,8 @@ CHAIN_CONFIG = {
     137: {
         'name': 'Polygon',
         'rpc_env': 'RPC_URL_POLYGON',
+        'finality_blocks': 512,
+        'block_time': 2.0,
         'fallback_rpcs': [
             'https://polygon.llamarpc.com',
             'https://rpc.ankr.com/polygon',
@@ -112,6 +167,321 @@ PRICE_PER_SHARE_SELECTOR = '0x99530b06'
 DECIMALS_SELECTOR = '0x313ce567'
 ASSET_SELECTOR = '0x38d52e0f'
 SYMBOL_SELECTOR = '0x95d89b41'
+ACCOUNTANT_SELECTOR = '0x4fb3ccc5'
+GET_VAULT_CONFIG_SELECTOR = '0xde1eb9a3'
+# Multicall3 is deployed at the same address on every supported chain.
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+AGGREGATE3_SELECTOR = '0x82ad56cb'
+TOTAL_ASSETS_SELECTOR = '0x01e1d114'
+TOTAL_SUPPLY_SELECTOR = '0x18160ddd'
+PROFIT_MAX_UNLOCK_TIME_SELECTOR = '0x0952864e'
+# Precision of VaultV3.profitUnlockingRate.
+MAX_BPS_EXTENDED = 1_000_000_000_000
+# Where historical pricePerShare comes from: archive eth_calls, the indexed
+# vault events, or the events when they reproduce on-chain state.
+PPS_SOURCES = ('rpc', 'events', 'auto')
+DEFAULT_PPS_SOURCE = 'rpc'
+PPS_VALIDATION_SAMPLES = 3
+OUTPUT_FORMATS = ('text', 'json', 'jsonl', 'csv', 'parquet')
+# Flat per-depositor columns for CSV and Parquet; token amounts stay decimal strings.
+SUMMARY_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ('depositor', 'string'),
+    ('vault', 'string'),
+    ('chain_id', 'int64'),
+    ('symbol', 'string'),
+    ('decimals', 'int64'),
+    ('current_shares', 'string'),
+    ('current_value', 'string'),
+    ('total_deposited', 'string'),
+    ('total_withdrawn', 'string'),
+    ('net_deposited', 'string'),
+    ('transfer_adjusted_net', 'string'),
+    ('weighted_avg_entry_pps', 'string'),
+    ('current_pps', 'string'),
+    ('net_profit', 'string'),
+    ('gross_profit', 'string'),
+    ('total_fees', 'string'),
+    ('performance_fee_bps', 'int64'),
+    ('peak_shares', 'string'),
+    ('peak_shares_block', 'int64'),
+    ('peak_value', 'string'),
+    ('first_interaction_block', 'int64'),
+    ('first_interaction_timestamp', 'int64'),
+    ('deposits', 'int64'),
+    ('withdrawals', 'int64'),
+    ('transfers', 'int64'),
+    ('events', 'int64'),
+    ('error', 'string'),
+)
+PARQUET_ROW_GROUP_SIZE = 1000
+PPS_INDEX_DIR = 'pps_index'
+PPS_INDEX_VERSION = 1
+CHECKPOINT_DIR = 'checkpoints'
+CHECKPOINT_VERSION = 1
+BLOCK_TIME_INDEX_DIR = 'block_time_index'
+BLOCK_TIME_INDEX_VERSION = 1
+# Interpolated block timestamps are trusted when they are within this many seconds.
+BLOCK_TIME_MAX_ERROR_SECONDS = 600
+# Blocks priced per step while building a PPS index.
+PPS_INDEX_BUILD_CHUNK = 5000
+# GraphQL Int is 32-bit; a cursor past every log of a block.
+MAX_LOG_INDEX = 2 ** 31 - 1
+# Number of eth_call requests packed into one JSON-RPC batch; 0 or 1 disables batching.
+DEFAULT_RPC_BATCH_SIZE = 100
+# Rows requested per page from the Envio GraphQL API.
+DEFAULT_GRAPHQL_PAGE_SIZE = 1000
+DEFAULT_GRAPHQL_RETRIES = 3
+# Error codes (Hasura and GraphQL spec) for a query the indexer's schema rejects.
+GRAPHQL_VALIDATION_ERROR_CODES = ('validation-failed', 'parse-failed', 'GRAPHQL_VALIDATION_FAILED', 'GRAPHQL_PARSE_FAILED')
+# In-flight requests allowed per RPC or GraphQL endpoint.
+DEFAULT_ENDPOINT_CONCURRENCY = 8
+ZERO_ADDRESS = '0x' + '0' * 40
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'yearn-fee-calc')
+DEFAULT_CHAIN_CACHE_MAX_MB = 256
+# Buffered chain cache rows written per transaction (and eviction check).
+CHAIN_CACHE_FLUSH_ROWS = 1000
+# Performance fee assumed when the accountant's config cannot be read.
+DEFAULT_PERFORMANCE_FEE_BPS = 1000
+# Interior blocks whose fee config is read in each span between accountant changes.
+FEE_HISTORY_SAMPLES = 8
+DEFAULT_HTTP_TIMEOUT = 30
+HTTP_POOL_MAX_IDLE = 32
+HTTP_USER_AGENT = 'Python-urllib/%d.%d' % sys.version_info[:2]
+RPC_PROBE_TIMEOUT = 3
+RPC_RANKING_TTL_SECONDS = 6 * 60 * 60
+RPC_RANKING_FILE = 'rpc_ranking.json'
+CHAINLIST_URL = 'https://chainlist.org/rpcs.json'
+CHAINLIST_FETCH_TIMEOUT = 10
+# Compact per-chain RPC list and measured block time, refreshed in the background.
+CHAINLIST_SNAPSHOT_FILE = 'chainlist_snapshot.json'
+CHAINLIST_SNAPSHOT_VERSION = 1
+CHAINLIST_SNAPSHOT_TTL_SECONDS = 7 * 24 * 60 * 60
+CHAINLIST_SNAPSHOT_MAX_RPCS = 8
+# Endpoints probed concurrently per chain when measuring block time.
+BLOCK_TIME_PROBE_ENDPOINTS = 3
+# How long an exiting process waits for a running snapshot refresh to be
+# saved; a slower refresh is abandoned and retried by the next run.
+CHAINLIST_REFRESH_EXIT_TIMEOUT = 2
+# Old enough that only archive nodes still have the state.
+ARCHIVE_PROBE_BLOCK = 1
+DEFAULT_RPC_RETRIES = 4
+RPC_BACKOFF_BASE_SECONDS = 0.5
+RPC_BACKOFF_MAX_SECONDS = 30.0
+# JSON-RPC error messages that mean "try again / try elsewhere" rather than a real revert.
+RPC_RETRYABLE_ERROR_HINTS = (
+    'rate limit',
+    'too many requests',
+    'limit exceeded',
+    'capacity',
+    'timeout',
+    'timed out',
+    'unavailable',
+    'header not found',
+    'internal error',
+)
+# Methods that read state at a block; for old blocks only archive nodes have it.
+STATE_READ_METHODS = ('eth_call', 'eth_getBalance', 'eth_getCode', 'eth_getStorageAt')
+
+
+class ChainReadCache:
+    # SQLite-backed store for historical chain reads that can no longer change.
+    # Contract reads are keyed by (chain_id, address, selector, block) and
+    # block timestamps by (chain_id, block); both are only written for blocks
+    # at or below the caller's finalized block. Writes are buffered and go to
+    # disk in one transaction per flush.
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_CHAIN_CACHE_MAX_MB * 1024 * 1024) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[int, str, str, int], str] = {}
+        self._pending_timestamps: Dict[Tuple[int, int], int] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS chain_reads ('
+            ' chain_id INTEGER NOT NULL,'
+            ' address TEXT NOT NULL,'
+            ' selector TEXT NOT NULL,'
+            ' block INTEGER NOT NULL,'
+            ' value TEXT NOT NULL,'
+            ' PRIMARY KEY (chain_id, address, selector, block))'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS block_timestamps ('
+            ' chain_id INTEGER NOT NULL,'
+            ' block INTEGER NOT NULL,'
+            ' timestamp INTEGER NOT NULL,'
+            ' PRIMARY KEY (chain_id, block))'
+        )
+        self._conn.commit()
+
+    def get_many(self, chain_id: int, address: str, selector: str, blocks: Iterable[int]) -> Dict[int, str]:
+        wanted = sorted(set(blocks))
+        found: Dict[int, str] = {}
+        address = address.lower()
+        with self._lock:
+            if self._pending:
+                for block in wanted:
+                    value = self._pending.get((chain_id, address, selector, block))
+                    if value is not None:
+                        found[block] = value
+                wanted = [block for block in wanted if block not in found]
+            # Stay well below SQLite's bound-parameter limit.
+            for start in range(0, len(wanted), 500):
+                chunk = wanted[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    'SELECT block, value FROM chain_reads'
+                    ' WHERE chain_id = ? AND address = ? AND selector = ?'
+                    f' AND block IN ({placeholders})',
+                    [chain_id, address, selector, *chunk],
+                ).fetchall()
+                found.update({block: value for block, value in rows})
+        return found
+
+    def get(self, chain_id: int, address: str, selector: str, block: int) -> Optional[str]:
+        return self.get_many(chain_id, address, selector, [block]).get(block)
+
+    def put_many(
+        self,
+        chain_id: int,
+        address: str,
+        selector: str,
+        values: Dict[int, str],
+        safe_block: Optional[int],
+    ) -> int:
+        if safe_block is None:
+            return 0
+        address = address.lower()
+        stored = 0
+        with self._lock:
+            for block, value in values.items():
+                if block <= safe_block:
+                    self._pending[(chain_id, address, selector, block)] = value
+                    stored += 1
+            if len(self._pending) + len(self._pending_timestamps) >= CHAIN_CACHE_FLUSH_ROWS:
+                self._flush_locked()
+        return stored
+
+    def put(
+        self,
+        chain_id: int,
+        address: str,
+        selector: str,
+        block: int,
+        value: str,
+        safe_block: Optional[int],
+    ) -> bool:
+        return self.put_many(chain_id, address, selector, {block: value}, safe_block) == 1
+
+    def get_block_timestamps(self, chain_id: int, blocks: Iterable[int]) -> Dict[int, int]:
+        wanted = sorted(set(blocks))
+        found: Dict[int, int] = {}
+        with self._lock:
+            if self._pending_timestamps:
+                for block in wanted:
+                    timestamp = self._pending_timestamps.get((chain_id, block))
+                    if timestamp is not None:
+                        found[block] = timestamp
+                wanted = [block for block in wanted if block not in found]
+            for start in range(0, len(wanted), 500):
+                chunk = wanted[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    'SELECT block, timestamp FROM block_timestamps'
+                    f' WHERE chain_id = ? AND block IN ({placeholders})',
+                    [chain_id, *chunk],
+                ).fetchall()
+                found.update({block: timestamp for block, timestamp in rows})
+        return found
+
+    def get_block_timestamp(self, chain_id: int, block: int) -> Optional[int]:
+        return self.get_block_timestamps(chain_id, [block]).get(block)
+
+    def put_block_timestamps(self, chain_id: int, values: Dict[int, int], safe_block: Optional[int]) -> int:
+        if safe_block is None:
+            return 0
+        stored = 0
+        with self._lock:
+            for block, timestamp in values.items():
+                if block <= safe_block:
+                    self._pending_timestamps[(chain_id, block)] = timestamp
+                    stored += 1
+            if len(self._pending) + len(self._pending_timestamps) >= CHAIN_CACHE_FLUSH_ROWS:
+                self._flush_locked()
+        return stored
+
+    def put_block_timestamp(self, chain_id: int, block: int, timestamp: int, safe_block: Optional[int]) -> bool:
+        return self.put_block_timestamps(chain_id, {block: timestamp}, safe_block) == 1
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._pending and not self._pending_timestamps:
+            return
+        rows = [(*key, value) for key, value in self._pending.items()]
+        timestamp_rows = [(*key, timestamp) for key, timestamp in self._pending_timestamps.items()]
+        self._pending.clear()
+        self._pending_timestamps.clear()
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO chain_reads (chain_id, address, selector, block, value)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            rows,
+        )
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO block_timestamps (chain_id, block, timestamp) VALUES (?, ?, ?)',
+            timestamp_rows,
+        )
+        self._conn.commit()
+        self._evict_locked()
+
+    def _used_bytes(self) -> int:
+        page_size = self._conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = self._conn.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = self._conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict_locked(self) -> None:
+        if self.max_bytes <= 0 or self._used_bytes() <= self.max_bytes:
+            return
+        # Drop the oldest quarter of each table's rows (insertion order) and give the pages back.
+        evict = 0
+        for table in ('chain_reads', 'block_timestamps'):
+            total = self._conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            count = (total + 3) // 4
+            self._conn.execute(
+                f'DELETE FROM {table} WHERE rowid IN'
+                f' (SELECT rowid FROM {table} ORDER BY rowid LIMIT ?)',
+                (count,),
+            )
+            evict += count
+        self._conn.commit()
+        self._conn.execute('PRAGMA incremental_vacuum')
+        logger.info('Chain read cache over %d bytes; evicted %d entries', self.max_bytes, evict)
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self._flush_locked()
+            finally:
+                self._conn.close()
+
+
+def open_chain_read_cache(cache_dir: str, max_mb: int = DEFAULT_CHAIN_CACHE_MAX_MB) -> Optional[ChainReadCache]:
+    try:
+        return ChainReadCache(os.path.join(cache_dir, 'chain_reads.sqlite3'), max_mb * 1024 * 1024)
+    except (OSError, sqlite3.Error) as exc:
+        logger.warning('Persistent chain cache unavailable (%s); continuing without it', exc)
+        return None
+
 
 @dataclass
 class VaultContext:
@@ -121,8 +491,32 @@ class VaultContext:
     decimals: int
     symbol: str
     asset_address: str
+    cache_dir: Optional[str] = None
+    rpc_batch_size: int = DEFAULT_RPC_BATCH_SIZE
+    max_concurrency: int = DEFAULT_ENDPOINT_CONCURRENCY
+    # Reads at or below safe_block are final and may be persisted to chain_cache.
+    chain_cache: Optional[ChainReadCache] = None
+    safe_block: Optional[int] = None
     price_per_share_cache: Dict[int, int] = field(default_factory=dict)
+    # Exact block timestamps only; estimates live in block_timestamp_estimates.
     block_timestamp_cache: Dict[int, datetime.datetime] = field(default_factory=dict)
+    block_timestamp_estimates: Dict[int, datetime.datetime] = field(default_factory=dict)
+    # Exact (block, timestamp) anchors used to interpolate timestamps of other blocks.
+    block_time_index: Optional['BlockTimeIndex'] = None
+    # (block, time) of the chain head, read once per run; see read_head_block.
+    head_reference: Optional[Tuple[int, datetime.datetime]] = None
+    fee_config_cache: Dict[Tuple[str, int], Tuple[int, int, int, int]] = field(default_factory=dict)
+    # Last accountant seen for the vault; lets accountant() and getVaultConfig share one multicall.
+    accountant_hint: Optional[str] = None
+    # When set, historical pricePerShare is computed from indexed events instead of eth_call.
+    pps_model: Optional['VaultPpsModel'] = None
+    # Precomputed (block, pps) series shared by every depositor of the vault.
+    pps_index: Optional['PpsSeriesIndex'] = None
+    # Skip pricePerShare reads at blocks where it provably equals an already read block.
+    skip_static_pps: bool = False
+    pps_change_plan: Optional['PpsChangePlan'] = None
+    # Indexed blocks where the vault's accountant (and so its fee config) may change.
+    fee_change_blocks: Optional[List[int]] = None
 
 
 @dataclass
@@ -132,6 +526,9 @@ class DepositEvent:
     owner: str
     assets: str
     shares: str
+    block_number: int
+    log_index: int
+    block_timestamp: int
 
 
 @dataclass
@@ -142,6 +539,9 @@ class WithdrawEvent:
     owner: str
     assets: str
     shares: str
+    block_number: int
+    log_index: int
+    block_timestamp: int
 
 
 @dataclass
@@ -150,103 +550,973 @@ class TransferEvent:
     sender: str
     receiver: str
     value: str
-
-
-@dataclass
-class Event:
-    type: str
     block_number: int
     log_index: int
-    data: Dict[str, Any]
+    block_timestamp: int
+
+
+# Event type codes of EventTimeline.types.
+EVENT_DEPOSIT = 0
+EVENT_WITHDRAW = 1
+EVENT_TRANSFER_IN = 2
+EVENT_TRANSFER_OUT = 3
+EVENT_TYPE_NAMES = ('deposit', 'withdraw', 'transfer_in', 'transfer_out')
+UINT64_MASK = (1 << 64) - 1
+INT64_LIMIT = 1 << 63
+# Below this many events the NumPy setup costs more than the Python loop.
+VECTORIZE_MIN_EVENTS = 512
+
+
+class LimbColumn:
+    # Integer column stored as two uint64 limbs per entry instead of one int
+    # object each; values outside [0, 2**128) are kept in a side table.
+    def __init__(self) -> None:
+        self.lo = array.array('Q')
+        self.hi = array.array('Q')
+        self.wide: Dict[int, int] = {}
+
+    def append(self, value: int) -> None:
+        if 0 <= value and value >> 128 == 0:
+            self.lo.append(value & UINT64_MASK)
+            self.hi.append(value >> 64)
+        else:
+            self.wide[len(self.lo)] = value
+            self.lo.append(0)
+            self.hi.append(0)
+
+    def __len__(self) -> int:
+        return len(self.lo)
+
+    def __getitem__(self, index: int) -> int:
+        if index < 0:
+            index += len(self.lo)
+        if index in self.wide:
+            return self.wide[index]
+        return self.hi[index] << 64 | self.lo[index]
+
+    def __iter__(self) -> Iterator[int]:
+        if self.wide:
+            return (self[index] for index in range(len(self.lo)))
+        return (hi << 64 | lo for lo, hi in zip(self.lo, self.hi))
+
+
+class EventTimeline:
+    # A depositor's deposits, withdrawals and transfers in (block, log) order,
+    # one typed array per field. Assets are zero for transfers.
+    def __init__(self) -> None:
+        self.types = array.array('B')
+        self.blocks = array.array('Q')
+        self.log_indexes = array.array('Q')
+        self.timestamps = array.array('Q')
+        self.shares = LimbColumn()
+        self.assets = LimbColumn()
+
+    def append(self, event_type: int, block_number: int, log_index: int, timestamp: int, shares: int, assets: int) -> None:
+        self.types.append(event_type)
+        self.blocks.append(block_number)
+        self.log_indexes.append(log_index)
+        self.timestamps.append(timestamp)
+        self.shares.append(shares)
+        self.assets.append(assets)
+
+    def __len__(self) -> int:
+        return len(self.types)
 
 
 @dataclass
-class PositionSnapshot:
-    block_number: int
-    event_type: str
-    shares_balance: int
-    shares_change: int
-    assets_deposited: int
-    assets_withdrawn: int
+class PositionState:
+    # Everything the position pass carries from one event to the next. Saved as
+    # a checkpoint, it lets a later run resume after (last_block, last_log_index).
+    current_shares: int = 0
+    total_deposited: int = 0
+    total_withdrawn: int = 0
+    peak_shares: int = 0
+    peak_shares_block: int = 0
+    peak_pps: Optional[int] = None
+    peak_timestamp: Optional[int] = None
+    # Cost basis in asset terms while shares change over time.
+    cost_shares: int = 0
+    cost_assets: int = 0
+    # Cumulative incremental profit through the last event.
+    profit: int = 0
+    # Incoming minus outgoing transfers, valued at the PPS of their blocks.
+    net_transfer_value: int = 0
+    deposits: int = 0
+    withdrawals: int = 0
+    transfers_in: int = 0
+    transfers_out: int = 0
+    first_block: Optional[int] = None
+    first_timestamp: Optional[int] = None
+    last_block: int = -1
+    last_log_index: int = -1
+    last_pps: Optional[int] = None
+
+    @property
+    def events(self) -> int:
+        return self.deposits + self.withdrawals + self.transfers_in + self.transfers_out
 
 
 @dataclass
 class PositionResult:
-    snapshots: List[PositionSnapshot]
-    current_shares: int
-    total_deposited: int
-    total_withdrawn: int
-    user_events: List[Event]
-    peak_shares: int
-    peak_shares_block: int
+    # The timeline holds only the events processed in this run; state covers
+    # the whole history, including any part restored from a checkpoint.
+    timeline: EventTimeline
+    state: PositionState
+    # Share balance, PPS and cumulative incremental profit at each timeline entry.
+    balances: LimbColumn
+    event_pps: List[int]
+    cumulative_profit: List[int]
+    weighted_avg_entry_pps: int
+    # Incremental profit through the current PPS.
+    net_profit: int
+    # State after the last event at or below the checkpoint block, if requested.
+    checkpoint: Optional[PositionState] = None
+
+
+@dataclass
+class HolderState:
+    shares: int = 0
+    total_deposited: int = 0
+    total_withdrawn: int = 0
+    cost_basis_assets: int = 0
+    cost_basis_shares: int = 0
+    net_profit: int = 0
+    last_pps: int = 0
+    peak_shares: int = 0
+    peak_shares_block: int = 0
+    peak_value: Optional[int] = None
+    first_block: Optional[int] = None
+    first_timestamp: Optional[int] = None
+    last_block: Optional[int] = None
+    net_transfer_value: int = 0
+    deposits: int = 0
+    withdrawals: int = 0
+    transfers: int = 0
+
+
+class HTTPRequestError(RuntimeError):
+    def __init__(self, message: str, status: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class HTTPConnectionPool:
+    # Keep-alive connections to one (scheme, host, port), shared across threads.
+    def __init__(self, scheme: str, host: str, port: int, max_idle: int = HTTP_POOL_MAX_IDLE) -> None:
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context() if scheme == 'https' else None
+
+    def _acquire(self, timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        if connection is None:
+            if self.scheme == 'https':
+                connection = http.client.HTTPSConnection(
+                    self.host, self.port, timeout=timeout, context=self._ssl_context
+                )
+            else:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+            return connection, False
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection, True
+
+    def _release(self, connection: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[bytes],
+        headers: Dict[str, str],
+        timeout: float,
+    ) -> Tuple[int, str, Optional[str], bytes]:
+        while True:
+            connection, reused = self._acquire(timeout)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                # The server may drop idle keep-alive sockets; retry on a fresh connection.
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, response.reason, response.getheader('Content-Encoding'), data
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def _http_pool_for(scheme: str, host: str, port: int) -> HTTPConnectionPool:
+    key = (scheme, host, port)
+    with _HTTP_POOLS_LOCK:
+        pool = _HTTP_POOLS.get(key)
+        if pool is None:
+            pool = HTTPConnectionPool(scheme, host, port)
+            _HTTP_POOLS[key] = pool
+        return pool
+
+
+def close_http_pools() -> None:
+    with _HTTP_POOLS_LOCK:
+        pools = list(_HTTP_POOLS.values())
+        _HTTP_POOLS.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _uses_proxy(scheme: str, host: str) -> bool:
+    proxies = urllib.request.getproxies()
+    return scheme in proxies and not urllib.request.proxy_bypass(host)
+
+
+def http_request_json(
+    url: str,
+    payload: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = DEFAULT_HTTP_TIMEOUT,
+) -> Any:
+    # POSTs payload as JSON (GET when payload is None) and decodes the JSON reply.
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise HTTPRequestError(f'Unsupported URL: {url}')
+    body = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request_headers = {
+        'Accept-Encoding': 'gzip',
+        'User-Agent': HTTP_USER_AGENT,
+    }
+    if body is not None:
+        request_headers['Content-Type'] = 'application/json'
+    request_headers.update(headers or {})
+
+    try:
+        if _uses_proxy(parts.scheme, parts.hostname):
+            # http.client has no proxy support, so proxied hosts go through urllib.
+            request = urllib.request.Request(url, data=body, headers=request_headers)
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    status, reason = response.status, response.reason
+                    encoding = response.headers.get('Content-Encoding')
+                    data = response.read()
+            except urllib.error.HTTPError as exc:
+                raise HTTPRequestError(f'HTTP Error {exc.code}: {exc.reason}', exc.code)
+        else:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            path = parts.path or '/'
+            if parts.query:
+                path = f'{path}?{parts.query}'
+            request_headers['Host'] = parts.netloc.rsplit('@', 1)[-1]
+            status, reason, encoding, data = _http_pool_for(parts.scheme, parts.hostname, port).request(
+                'POST' if body is not None else 'GET', path, body, request_headers, timeout
+            )
+    except (OSError, http.client.HTTPException) as exc:
+        raise HTTPRequestError(str(exc) or exc.__class__.__name__)
+
+    if status >= 400:
+        raise HTTPRequestError(f'HTTP Error {status}: {reason}', status)
+    try:
+        if encoding == 'gzip':
+            data = gzip.decompress(data)
+        return json.loads(data)
+    except (OSError, EOFError, ValueError, zlib.error) as exc:
+        # A truncated or non-JSON body (an HTML error page, say) is a transport failure.
+        raise HTTPRequestError(f'Invalid JSON response: {exc}')
+
+
+class RpcError(RuntimeError):
+    def __init__(
+        self,
+        message: str,
+        retryable: bool = False,
+        status: Optional[int] = None,
+        *,
+        reverted: bool = False,
+    ) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+        # The call itself reverted on chain, as opposed to the node failing to run it.
+        self.reverted = reverted
+
+
+def _transport_error_retryable(exc: HTTPRequestError) -> bool:
+    return exc.status is None or exc.status == 429 or exc.status >= 500
+
+
+def _endpoint_failure(exc: HTTPRequestError) -> bool:
+    # Anything but a malformed or oversized request is the endpoint's fault
+    # (auth, plan limits, missing route), so the call may go elsewhere.
+    return _transport_error_retryable(exc) or exc.status not in (400, 413)
+
+
+def _rpc_error(error: Any) -> RpcError:
+    if not isinstance(error, dict):
+        return RpcError(f'RPC error: {error}')
+    message = error.get('message')
+    hint = str(message or '').lower()
+    code = error.get('code')
+    data = error.get('data')
+    # Geth-style nodes answer a revert with code 3, others with -32000 and the
+    # revert data attached; the message wording varies between clients.
+    reverted = code == 3 or (code == -32000 and isinstance(data, str) and data.startswith('0x'))
+    retryable = not reverted and (
+        code in (-32005, 429) or any(marker in hint for marker in RPC_RETRYABLE_ERROR_HINTS)
+    )
+    return RpcError(f'RPC error: {message}', retryable, reverted=reverted)
 
 
-def rpc_call_with_url(rpc_url: str, method: str, params: List[Any]) -> Any:
-    payload = json.dumps({
+def rpc_call_with_url(
+    rpc_url: str,
+    method: str,
+    params: List[Any],
+    timeout: float = DEFAULT_HTTP_TIMEOUT,
+) -> Any:
+    payload = {
         'jsonrpc': '2.0',
         'method': method,
         'params': params,
         'id': 1,
-    }).encode('utf-8')
-    headers = {'Content-Type': 'application/json'}
-
-    request = urllib.request.Request(rpc_url, data=payload, headers=headers)
+    }
     try:
-        with urllib.request.urlopen(request, timeout=30) as response:
-            result = json.load(response)
-    except urllib.error.URLError as exc:
-        raise RuntimeError(f'RPC call failed: {exc}')
+        result = http_request_json(rpc_url, payload, timeout=timeout)
+    except HTTPRequestError as exc:
+        raise RpcError(f'RPC call failed: {exc}', _endpoint_failure(exc), exc.status)
 
+    if not isinstance(result, dict):
+        raise RpcError('RPC error: unexpected response', True)
     if 'error' in result:
-        raise RuntimeError(f"RPC error: {result['error'].get('message')}")
+        raise _rpc_error(result['error'])
     return result.get('result')
 
 
+def rpc_batch_call_with_url(
+    rpc_url: str,
+    calls: List[Tuple[str, List[Any]]],
+    return_exceptions: bool = False,
+) -> List[Any]:
+    # With return_exceptions, a failed or missing entry comes back as its
+    # RpcError in place of the result instead of failing the whole batch.
+    payload = [
+        {
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': params,
+            'id': index,
+        }
+        for index, (method, params) in enumerate(calls)
+    ]
+    try:
+        result = http_request_json(rpc_url, payload)
+    except HTTPRequestError as exc:
+        raise RpcError(f'RPC batch call failed: {exc}', _endpoint_failure(exc), exc.status)
+
+    # Endpoints without batch support answer with a single error object.
+    if not isinstance(result, list):
+        error = result.get('error') if isinstance(result, dict) else None
+        message = error.get('message') if isinstance(error, dict) else 'unexpected response'
+        raise RpcError(f'RPC batch error: {message}')
+
+    # Batch responses may come back in any order, so match them up by id.
+    responses = {entry.get('id'): entry for entry in result if isinstance(entry, dict)}
+    results: List[Any] = []
+    for index in range(len(calls)):
+        entry = responses.get(index)
+        if entry is None:
+            missing = RpcError(f'RPC batch response missing id {index}', True)
+            if return_exceptions:
+                results.append(missing)
+                continue
+            raise missing
+        if 'error' in entry:
+            if return_exceptions:
+                results.append(_rpc_error(entry['error']))
+                continue
+            raise _rpc_error(entry['error'])
+        results.append(entry.get('result'))
+    return results
+
+
+class RpcEndpointPool:
+    # Spreads calls over healthy endpoints and fails over with backoff on
+    # rate limits, endpoint-side HTTP errors and network errors. Historical
+    # state reads only go to archive_urls (every endpoint when None): when
+    # those are all cooling down the call waits rather than hitting a pruned
+    # node. With hedge_delay set, a call still pending after that many seconds
+    # is duplicated to another endpoint and whichever answers first wins.
+    def __init__(
+        self,
+        urls: List[str],
+        spread: int = 1,
+        retries: int = DEFAULT_RPC_RETRIES,
+        hedge_delay: Optional[float] = None,
+        archive_urls: Optional[Iterable[str]] = None,
+    ) -> None:
+        self.urls = list(dict.fromkeys(urls))
+        archive = set(archive_urls) if archive_urls is not None else set(self.urls)
+        self.archive_urls = [url for url in self.urls if url in archive] or self.urls
+        self.spread = max(1, min(spread, len(self.urls)))
+        self.retries = retries
+        self.hedge_delay = hedge_delay
+        self._failures: Dict[str, int] = {url: 0 for url in self.urls}
+        self._cooldown_until: Dict[str, float] = {url: 0.0 for url in self.urls}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=16) if hedge_delay else None
+
+    def _choose(self, exclude: Iterable[str] = (), historical: bool = False) -> Tuple[Optional[str], float]:
+        now = time.monotonic()
+        excluded = set(exclude)
+        candidates = self.archive_urls if historical else self.urls
+        with self._lock:
+            healthy = [url for url in candidates if url not in excluded and self._cooldown_until[url] <= now]
+            spread = [url for url in healthy if url in self.urls[:self.spread]]
+            if spread:
+                self._next += 1
+                return spread[self._next % len(spread)], 0.0
+            if healthy:
+                return healthy[0], 0.0
+            waiting = [url for url in candidates if url not in excluded]
+            if not waiting:
+                return None, 0.0
+            url = min(waiting, key=lambda candidate: self._cooldown_until[candidate])
+            return url, max(self._cooldown_until[url] - now, 0.0)
+
+    def _record_success(self, url: str) -> None:
+        with self._lock:
+            self._failures[url] = 0
+            self._cooldown_until[url] = 0.0
+
+    def _record_failure(self, url: str) -> None:
+        with self._lock:
+            self._failures[url] += 1
+            backoff = RPC_BACKOFF_BASE_SECONDS * 2 ** (self._failures[url] - 1)
+            backoff = min(backoff, RPC_BACKOFF_MAX_SECONDS) * random.uniform(0.8, 1.2)
+            self._cooldown_until[url] = time.monotonic() + backoff
+
+    def _send(self, url: str, send: Callable[[str], T]) -> T:
+        try:
+            result = send(url)
+        except RpcError as exc:
+            if exc.retryable:
+                self._record_failure(url)
+            raise
+        self._record_success(url)
+        return result
+
+    def _send_hedged(self, executor: ThreadPoolExecutor, url: str, send: Callable[[str], T], historical: bool) -> T:
+        primary = executor.submit(self._send, url, send)
+        done, _ = wait([primary], timeout=self.hedge_delay)
+        if done:
+            return primary.result()
+        backup_url, delay = self._choose(exclude=[url], historical=historical)
+        if backup_url is None or delay > 0:
+            return primary.result()
+        failures: List[BaseException] = []
+        for future in as_completed([primary, executor.submit(self._send, backup_url, send)]):
+            error = future.exception()
+            if error is None:
+                return future.result()
+            failures.append(error)
+        raise failures[-1]
+
+    def call(self, send: Callable[[str], T], historical: bool = False) -> T:
+        last_error: Optional[RpcError] = None
+        for attempt in range(self.retries + 1):
+            url, delay = self._choose(historical=historical)
+            if url is None:
+                break
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                if self._hedge_executor is not None and len(self.urls) > 1:
+                    return self._send_hedged(self._hedge_executor, url, send, historical)
+                return self._send(url, send)
+            except RpcError as exc:
+                if not exc.retryable:
+                    raise
+                last_error = exc
+                logger.debug('RPC attempt %d via %s failed: %s', attempt + 1, url, exc)
+        if last_error is None:
+            raise RpcError('No RPC endpoint configured')
+        raise last_error
+
+    def close(self) -> None:
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+
+
+def register_rpc_pool(primary_url: str, pool: RpcEndpointPool) -> None:
+    # rpc_call / rpc_batch_call route calls for primary_url through the pool.
+    previous = _RPC_POOLS.get(primary_url)
+    _RPC_POOLS[primary_url] = pool
+    if previous is not None:
+        previous.close()
+
+
+def close_rpc_pools() -> None:
+    pools = list(_RPC_POOLS.values())
+    _RPC_POOLS.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _reads_historical_state(method: str, params: List[Any]) -> bool:
+    return method in STATE_READ_METHODS and bool(params) and params[-1] not in ('latest', 'pending', 'safe', 'finalized')
+
+
 def rpc_call(rpc_url: str, method: str, params: List[Any]) -> Any:
-    return rpc_call_with_url(rpc_url, method, params)
+    pool = _RPC_POOLS.get(rpc_url)
+    if pool is None:
+        return rpc_call_with_url(rpc_url, method, params)
+    return pool.call(
+        lambda url: rpc_call_with_url(url, method, params),
+        historical=_reads_historical_state(method, params),
+    )
 
 
-def select_rpc_url(chain_id: int) -> str:
-    if chain_id not in CHAIN_CONFIG:
-        raise RuntimeError(f'Unsupported chain ID: {chain_id}')
+def rpc_batch_call(
+    rpc_url: str,
+    calls: List[Tuple[str, List[Any]]],
+    return_exceptions: bool = False,
+) -> List[Any]:
+    pool = _RPC_POOLS.get(rpc_url)
+    if pool is None:
+        return rpc_batch_call_with_url(rpc_url, calls, return_exceptions)
+    return pool.call(
+        lambda url: rpc_batch_call_with_url(url, calls, return_exceptions),
+        historical=any(_reads_historical_state(method, params) for method, params in calls),
+    )
+
+
+@dataclass
+class RpcProbeResult:
+    url: str
+    latency: Optional[float] = None
+    archive: bool = False
+    error: Optional[Exception] = None
+
+
+def probe_rpc_endpoint(rpc_url: str, timeout: float = RPC_PROBE_TIMEOUT) -> RpcProbeResult:
+    result = RpcProbeResult(url=rpc_url)
+    started = time.perf_counter()
+    try:
+        rpc_call_with_url(rpc_url, 'eth_blockNumber', [], timeout=timeout)
+        result.latency = time.perf_counter() - started
+    except RpcError as exc:
+        if exc.status != 429:
+            result.error = exc
+            return result
+        # Rate limited means reachable; keep it, but behind endpoints that answered.
+        result.latency = time.perf_counter() - started + timeout
+    except Exception as exc:
+        result.error = exc
+        return result
+    try:
+        rpc_call_with_url(rpc_url, 'eth_call', eth_call_params(ZERO_ADDRESS, '0x', ARCHIVE_PROBE_BLOCK), timeout=timeout)
+        result.archive = True
+    except Exception:
+        pass
+    return result
+
+
+def _rpc_candidates(chain_id: int) -> Tuple[List[str], List[str]]:
     config = CHAIN_CONFIG[chain_id]
-    env_override = os.environ.get(config['rpc_env'])
-    urls_to_try = [env_override] if env_override else []
-    urls_to_try.extend(config['fallback_rpcs'])
-    if os.environ.get('RPC_URL'):
-        urls_to_try.insert(0, os.environ['RPC_URL'])
-
-    last_error = None
-    for candidate in urls_to_try:
-        if not candidate:
-            continue
+    _ensure_local_env()
+    explicit = [os.environ.get('RPC_URL'), os.environ.get(config['rpc_env'])]
+    explicit = list(dict.fromkeys(url for url in explicit if url))
+    fallbacks = [url for url in config['fallback_rpcs'] if url not in explicit]
+    return explicit, fallbacks
+
+
+def _load_rpc_ranking(cache_dir: str, chain_id: int, candidates: List[str]) -> Optional[List[RpcProbeResult]]:
+    try:
+        with open(os.path.join(cache_dir, RPC_RANKING_FILE), encoding='utf-8') as handle:
+            entry = json.load(handle).get(str(chain_id))
+    except (OSError, ValueError, AttributeError):
+        return None
+    if not isinstance(entry, dict) or entry.get('candidates') != candidates:
+        return None
+    if time.time() - entry.get('checked_at', 0) > RPC_RANKING_TTL_SECONDS:
+        return None
+    try:
+        ranked = [
+            RpcProbeResult(url=item['url'], latency=float(item['latency']), archive=bool(item['archive']))
+            for item in entry.get('ranked') or []
+        ]
+    except (KeyError, TypeError, ValueError):
+        return None
+    return ranked or None
+
+
+def _save_rpc_ranking(
+    cache_dir: str,
+    chain_id: int,
+    candidates: List[str],
+    ranked: List[RpcProbeResult],
+) -> None:
+    path = os.path.join(cache_dir, RPC_RANKING_FILE)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
         try:
-            rpc_call_with_url(candidate, 'eth_blockNumber', [])
-            return candidate
-        except Exception as exc:
-            last_error = exc
-            continue
-    raise RuntimeError(f"All RPC endpoints failed for {config['name']}: {last_error}")
+            with open(path, encoding='utf-8') as handle:
+                data = json.load(handle)
+            if not isinstance(data, dict):
+                data = {}
+        except (OSError, ValueError):
+            data = {}
+        data[str(chain_id)] = {
+            'checked_at': int(time.time()),
+            'candidates': candidates,
+            'ranked': [
+                {'url': probe.url, 'latency': round(probe.latency or 0.0, 4), 'archive': probe.archive}
+                for probe in ranked
+            ],
+        }
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(data, handle, indent=2)
+        os.replace(temp_path, path)
+    except OSError as exc:
+        logger.warning('Could not save RPC ranking: %s', exc)
+
+
+def rank_rpc_endpoints(
+    chain_id: int,
+    cache_dir: Optional[str] = None,
+    *,
+    refresh: bool = False,
+) -> List[RpcProbeResult]:
+    if chain_id not in CHAIN_CONFIG:
+        raise RuntimeError(f'Unsupported chain ID: {chain_id}')
+    explicit, fallbacks = _rpc_candidates(chain_id)
+    candidates = explicit + fallbacks
+    if cache_dir is not None and not refresh:
+        cached = _load_rpc_ranking(cache_dir, chain_id, candidates)
+        if cached is not None:
+            return cached
+
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        probes = list(executor.map(probe_rpc_endpoint, candidates))
+    alive = [probe for probe in probes if probe.latency is not None]
+    if not alive:
+        last_error = next((probe.error for probe in reversed(probes) if probe.error is not None), None)
+        raise RuntimeError(f"All RPC endpoints failed for {CHAIN_CONFIG[chain_id]['name']}: {last_error}")
+
+    # Explicitly configured endpoints keep their priority; public fallbacks are
+    # ordered archive-capable first, then by measured latency.
+    ranked = [probe for probe in alive if probe.url in explicit]
+    ranked.extend(
+        probe
+        for probe in sorted(alive, key=lambda probe: (not probe.archive, probe.latency))
+        if probe.url not in explicit
+    )
+    for probe in alive:
+        if not probe.archive:
+            logger.debug('RPC endpoint %s failed the archive probe', probe.url)
+    if cache_dir is not None:
+        _save_rpc_ranking(cache_dir, chain_id, candidates, ranked)
+    return ranked
+
+
+def select_rpc_endpoints(chain_id: int, cache_dir: Optional[str] = None) -> List[RpcProbeResult]:
+    ranked = rank_rpc_endpoints(chain_id, cache_dir)
+    if cache_dir is None:
+        return ranked
+    try:
+        rpc_call_with_url(ranked[0].url, 'eth_blockNumber', [], timeout=RPC_PROBE_TIMEOUT)
+        return ranked
+    except Exception:
+        # The cached favourite went away; probe everything again.
+        return rank_rpc_endpoints(chain_id, cache_dir, refresh=True)
 
-def contract_call(rpc_url: str, address: str, data: str, block_number: Optional[int] = None) -> str:
+
+def select_rpc_url(chain_id: int, cache_dir: Optional[str] = None) -> str:
+    return select_rpc_endpoints(chain_id, cache_dir)[0].url
+
+
+def build_rpc_pool(
+    chain_id: int,
+    endpoints: List[RpcProbeResult],
+    *,
+    retries: int = DEFAULT_RPC_RETRIES,
+    hedge_delay: Optional[float] = None,
+) -> RpcEndpointPool:
+    # Load is spread over the explicitly configured endpoints when there are
+    # any (public RPCs are then failover only), otherwise over every archive
+    # node. Historical reads never fail over to an endpoint that failed the
+    # archive probe, unless none passed it.
+    explicit, _ = _rpc_candidates(chain_id)
+    preferred = [probe for probe in endpoints if probe.url in explicit]
+    if not preferred:
+        preferred = [probe for probe in endpoints if probe.archive]
+    archive_urls = [probe.url for probe in endpoints if probe.archive]
+    if not archive_urls:
+        logger.warning('No RPC endpoint for chain %s passed the archive probe; historical reads may fail', chain_id)
+    return RpcEndpointPool(
+        [probe.url for probe in endpoints],
+        spread=len(preferred),
+        retries=retries,
+        hedge_delay=hedge_delay,
+        archive_urls=archive_urls or None,
+    )
+
+
+def get_safe_block(rpc_url: str, chain_id: int) -> Optional[int]:
+    # Highest block considered final for this chain, used to guard persistent caching.
+    finality_blocks = CHAIN_CONFIG.get(chain_id, {}).get('finality_blocks')
+    if finality_blocks is None:
+        return None
+    try:
+        head = int(rpc_call(rpc_url, 'eth_blockNumber', []), 16)
+    except Exception as exc:
+        logger.warning('Could not determine finalized block (%s); persistent cache is read-only', exc)
+        return None
+    return max(head - finality_blocks, -1)
+
+
+def read_head_block(ctx: VaultContext) -> int:
+    # The head is read once per run, like the current pricePerShare, so a batch
+    # does not pay one eth_blockNumber per depositor.
+    if ctx.head_reference is None:
+        head = int(rpc_call(ctx.rpc_url, 'eth_blockNumber', []), 16)
+        ctx.head_reference = (head, datetime.datetime.now(datetime.timezone.utc))
+    return ctx.head_reference[0]
+
+
+def eth_call_params(address: str, data: str, block_number: Optional[int] = None) -> List[Any]:
     params: List[Any] = [{'to': address, 'data': data}]
     params.append(f'0x{block_number:x}' if block_number is not None else 'latest')
-    return rpc_call(rpc_url, 'eth_call', params)
+    return params
+
+
+def contract_call(rpc_url: str, address: str, data: str, block_number: Optional[int] = None) -> str:
+    return rpc_call(rpc_url, 'eth_call', eth_call_params(address, data, block_number))
+
+
+def _abi_word(value: int) -> str:
+    return f'{value:064x}'
+
+
+def _abi_address(address: str) -> str:
+    return address.lower().replace('0x', '').rjust(64, '0')
+
+
+def encode_aggregate3(calls: List[Tuple[str, str]]) -> str:
+    # aggregate3((address target, bool allowFailure, bytes callData)[]), every call allowed to fail.
+    elements: List[str] = []
+    for target, data in calls:
+        payload = data[2:] if data.startswith('0x') else data
+        padded = payload.ljust((len(payload) + 63) // 64 * 64, '0')
+        elements.append(
+            _abi_address(target) + _abi_word(1) + _abi_word(96) + _abi_word(len(payload) // 2) + padded
+        )
+    offsets: List[str] = []
+    position = 32 * len(calls)
+    for element in elements:
+        offsets.append(_abi_word(position))
+        position += len(element) // 2
+    return AGGREGATE3_SELECTOR + _abi_word(32) + _abi_word(len(calls)) + ''.join(offsets) + ''.join(elements)
+
+
+def decode_aggregate3(data_hex: str, expected: int) -> List[Optional[str]]:
+    # Returns (bool success, bytes returnData)[]; failed calls decode to None.
+    payload = bytes.fromhex(data_hex[2:] if data_hex.startswith('0x') else data_hex)
+
+    def word(offset: int) -> int:
+        if offset + 32 > len(payload):
+            raise ValueError('aggregate3 response truncated')
+        return int.from_bytes(payload[offset:offset + 32], 'big')
+
+    array_start = word(0)
+    count = word(array_start)
+    if count != expected:
+        raise ValueError(f'aggregate3 returned {count} results for {expected} calls')
+    base = array_start + 32
+    results: List[Optional[str]] = []
+    for index in range(count):
+        element = base + word(base + 32 * index)
+        success = word(element) != 0
+        data_start = element + word(element + 32)
+        length = word(data_start)
+        if data_start + 32 + length > len(payload):
+            raise ValueError('aggregate3 response truncated')
+        data = payload[data_start + 32:data_start + 32 + length]
+        results.append('0x' + data.hex() if success else None)
+    return results
+
+
+def _single_calls(rpc_url: str, calls: List[Tuple[str, str]], block_number: Optional[int]) -> List[Optional[str]]:
+    results: List[Optional[str]] = []
+    for target, data in calls:
+        try:
+            results.append(contract_call(rpc_url, target, data, block_number))
+        except RpcError as exc:
+            if not exc.reverted:
+                raise
+            results.append(None)
+    return results
+
+
+def multicall(
+    rpc_url: str,
+    chain_id: int,
+    calls: List[Tuple[str, str]],
+    block_number: Optional[int] = None,
+) -> List[Optional[str]]:
+    # Runs (target, calldata) reads in one eth_call through Multicall3. Reverted
+    # calls come back as None. Falls back to one eth_call per read where
+    # Multicall3 is not deployed.
+    missing_at = _MULTICALL_MISSING_AT.get(chain_id)
+    at_block = float('inf') if block_number is None else block_number
+    if len(calls) <= 1 or (missing_at is not None and at_block <= missing_at):
+        return _single_calls(rpc_url, calls, block_number)
+
+    try:
+        response = contract_call(rpc_url, MULTICALL3_ADDRESS, encode_aggregate3(calls), block_number)
+        return decode_aggregate3(response, len(calls))
+    except RpcError as exc:
+        if exc.retryable:
+            raise
+        reason = str(exc)
+    except ValueError as exc:
+        reason = str(exc)
+    # An empty response means there is no contract at that block (yet).
+    if missing_at is None or at_block > missing_at:
+        _MULTICALL_MISSING_AT[chain_id] = at_block
+        logger.debug('Multicall3 unavailable at block %s (%s); using single calls', block_number, reason)
+    return _single_calls(rpc_url, calls, block_number)
 
 
 def get_price_per_share_at_block(ctx: VaultContext, block_number: int) -> int:
     if block_number in ctx.price_per_share_cache:
         return ctx.price_per_share_cache[block_number]
 
+    if ctx.pps_index is not None:
+        indexed = ctx.pps_index.get(block_number)
+        if indexed is not None:
+            ctx.price_per_share_cache[block_number] = indexed
+            return indexed
+
+    if ctx.pps_model is not None:
+        value = model_price_per_share(ctx, block_number)
+        ctx.price_per_share_cache[block_number] = value
+        return value
+
+    static_value = static_price_per_share(ctx, block_number)
+    if static_value is not None:
+        ctx.price_per_share_cache[block_number] = static_value
+        return static_value
+
+    if ctx.chain_cache is not None:
+        cached = ctx.chain_cache.get(ctx.chain_id, ctx.address, PRICE_PER_SHARE_SELECTOR, block_number)
+        if cached is not None:
+            value = int(cached, 16)
+            ctx.price_per_share_cache[block_number] = value
+            remember_static_price_per_share(ctx, block_number, value)
+            return value
+
     price_hex = contract_call(ctx.rpc_url, ctx.address, PRICE_PER_SHARE_SELECTOR, block_number)
     value = int(price_hex, 16)
     ctx.price_per_share_cache[block_number] = value
+    remember_static_price_per_share(ctx, block_number, value)
+    if ctx.chain_cache is not None:
+        ctx.chain_cache.put(ctx.chain_id, ctx.address, PRICE_PER_SHARE_SELECTOR, block_number, hex(value), ctx.safe_block)
     return value
 
 
-def get_asset_address(rpc_url: str, vault_address: str) -> str:
-    asset_hex = contract_call(rpc_url, vault_address, ASSET_SELECTOR)
-    return '0x' + asset_hex[-40:]
+def prefetch_price_per_share(
+    ctx: VaultContext,
+    block_numbers: Iterable[int],
+    batch_size: Optional[int] = None,
+) -> int:
+    batch_size = ctx.rpc_batch_size if batch_size is None else batch_size
+    pending = sorted({block for block in block_numbers if block not in ctx.price_per_share_cache})
+    if pending and ctx.pps_index is not None:
+        for block in pending:
+            indexed = ctx.pps_index.get(block)
+            if indexed is not None:
+                ctx.price_per_share_cache[block] = indexed
+        pending = [block for block in pending if block not in ctx.price_per_share_cache]
+    if ctx.pps_model is not None:
+        for block in pending:
+            ctx.price_per_share_cache[block] = model_price_per_share(ctx, block)
+        return 0
+    pending, aliases = split_static_pps_blocks(ctx, pending)
+    if pending and ctx.chain_cache is not None:
+        cached = ctx.chain_cache.get_many(ctx.chain_id, ctx.address, PRICE_PER_SHARE_SELECTOR, pending)
+        for block, price_hex in cached.items():
+            ctx.price_per_share_cache[block] = int(price_hex, 16)
+            remember_static_price_per_share(ctx, block, ctx.price_per_share_cache[block])
+        pending = [block for block in pending if block not in cached]
+    if batch_size <= 1 or len(pending) <= 1:
+        # Nothing worth batching; get_price_per_share_at_block fetches on demand.
+        fill_static_pps_aliases(ctx, aliases)
+        return 0
+
+    fetched = 0
+    start = 0
+    while start < len(pending):
+        chunk = pending[start:start + batch_size]
+        calls = [
+            ('eth_call', eth_call_params(ctx.address, PRICE_PER_SHARE_SELECTOR, block))
+            for block in chunk
+        ]
+        try:
+            results: List[Any] = rpc_batch_call(ctx.rpc_url, calls, return_exceptions=True)
+        except RpcError as exc:
+            if not exc.retryable and batch_size > 1:
+                # The endpoint rejected the batch itself (unsupported or too
+                # large); retry the chunk in smaller batches.
+                batch_size = ctx.rpc_batch_size = batch_size // 2
+                if batch_size > 1:
+                    logger.debug('Batched pricePerShare lookup rejected (%s); batch size now %d', exc, batch_size)
+                    continue
+                logger.warning('Batched pricePerShare lookup rejected (%s); falling back to single calls', exc)
+                break
+            logger.warning('Batched pricePerShare lookup failed (%s); using single calls for %d blocks', exc, len(chunk))
+            results = [exc] * len(chunk)
+        start += len(chunk)
+        fetched_chunk: Dict[int, str] = {}
+        for block, price_hex in zip(chunk, results):
+            try:
+                if not isinstance(price_hex, str) or not price_hex.startswith('0x'):
+                    raise ValueError(price_hex)
+                value = int(price_hex, 16)
+            except ValueError as exc:
+                # Left uncached, so get_price_per_share_at_block fetches this block on its own.
+                logger.debug('Batched pricePerShare at block %s unusable (%s)', block, exc)
+                continue
+            ctx.price_per_share_cache[block] = value
+            remember_static_price_per_share(ctx, block, value)
+            fetched_chunk[block] = hex(value)
+        if ctx.chain_cache is not None and fetched_chunk:
+            ctx.chain_cache.put_many(ctx.chain_id, ctx.address, PRICE_PER_SHARE_SELECTOR, fetched_chunk, ctx.safe_block)
+        fetched += len(fetched_chunk)
+    fill_static_pps_aliases(ctx, aliases)
+    return fetched
 
 
 def decode_abi_string(data_hex: str) -> str:
@@ -271,48 +1541,316 @@ def get_token_symbol(rpc_url: str, token_address: str) -> str:
     return decode_abi_string(symbol_hex)
 
 
-def validate_vault_address(rpc_url: str, vault_address: str) -> None:
-    asset_hex = contract_call(rpc_url, vault_address, ASSET_SELECTOR)
+@dataclass
+class VaultState:
+    asset_address: str
+    decimals: int
+    price_per_share: int
+    accountant: Optional[str]
+
+
+def read_vault_state(rpc_url: str, chain_id: int, vault_address: str) -> VaultState:
+    # Validates the vault and reads its current state in a single multicall.
+    asset_hex, decimals_hex, price_hex, accountant_hex = multicall(
+        rpc_url,
+        chain_id,
+        [
+            (vault_address, ASSET_SELECTOR),
+            (vault_address, DECIMALS_SELECTOR),
+            (vault_address, PRICE_PER_SHARE_SELECTOR),
+            (vault_address, ACCOUNTANT_SELECTOR),
+        ],
+    )
     if not asset_hex or len(asset_hex) < 42:
         raise RuntimeError('Vault asset() response invalid')
-    decimals_hex = contract_call(rpc_url, vault_address, DECIMALS_SELECTOR)
-    if not decimals_hex:
+    if not decimals_hex or decimals_hex == '0x':
         raise RuntimeError('Vault decimals() response invalid')
-    _ = int(decimals_hex, 16)
-    price_hex = contract_call(rpc_url, vault_address, PRICE_PER_SHARE_SELECTOR)
-    if not price_hex:
+    if not price_hex or price_hex == '0x':
         raise RuntimeError('Vault pricePerShare() response invalid')
+    accountant = None
+    if accountant_hex and len(accountant_hex) >= 42:
+        accountant = '0x' + accountant_hex[-40:]
+    return VaultState(
+        asset_address='0x' + asset_hex[-40:],
+        decimals=int(decimals_hex, 16),
+        price_per_share=int(price_hex, 16),
+        accountant=accountant,
+    )
+
+
+def remember_block_timestamp(ctx: VaultContext, block_number: int, timestamp: int) -> None:
+    if block_number not in ctx.block_timestamp_cache:
+        ctx.block_timestamp_cache[block_number] = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+class BlockTimeIndex:
+    # Sorted exact (block, timestamp) anchors for one chain. linear[i] marks the
+    # segment from anchor i to anchor i + 1 as checked: its midpoint was within
+    # max_error seconds of the straight line, so interpolating inside it is
+    # trusted. That is a single sample, not a guarantee; dates interpolated in a
+    # checked segment are approximate and only used for plotting.
+    def __init__(self, chain_id: int, max_error: int = BLOCK_TIME_MAX_ERROR_SECONDS) -> None:
+        self.chain_id = chain_id
+        self.max_error = max_error
+        self.blocks = array.array('Q')
+        self.timestamps = array.array('Q')
+        self.linear = array.array('B')
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def add(self, block_number: int, timestamp: int) -> None:
+        index = bisect.bisect_left(self.blocks, block_number)
+        if index < len(self.blocks) and self.blocks[index] == block_number:
+            return
+        # Both halves of a split segment stay as trusted as the segment was.
+        inherited = self.linear[index - 1] if 0 < index < len(self.blocks) else 0
+        self.blocks.insert(index, block_number)
+        self.timestamps.insert(index, timestamp)
+        self.linear.insert(index, inherited)
+        self.dirty = True
+
+    def mark_linear(self, start_block: int, end_block: int) -> None:
+        first = bisect.bisect_left(self.blocks, start_block)
+        last = bisect.bisect_left(self.blocks, end_block)
+        for index in range(first, last):
+            self.linear[index] = 1
+        self.dirty = True
+
+    def segment(self, block_number: int) -> Optional[int]:
+        # Index of the anchor starting the segment strictly containing block_number.
+        index = bisect.bisect_left(self.blocks, block_number)
+        if index == 0 or index == len(self.blocks) or self.blocks[index] == block_number:
+            return None
+        return index - 1
+
+    def estimate(self, block_number: int) -> Optional[Tuple[int, int]]:
+        # (timestamp, error in seconds), or None outside the anchored range. The
+        # error is a hard bound except in checked segments, where it is the
+        # nominal max_error.
+        index = bisect.bisect_left(self.blocks, block_number)
+        if index < len(self.blocks) and self.blocks[index] == block_number:
+            return self.timestamps[index], 0
+        if index == 0 or index == len(self.blocks):
+            return None
+        start_block, end_block = self.blocks[index - 1], self.blocks[index]
+        start_time, end_time = self.timestamps[index - 1], self.timestamps[index]
+        timestamp = start_time + (end_time - start_time) * (block_number - start_block) // (end_block - start_block)
+        # Timestamps never decrease, so the true value lies between the anchors.
+        error = max(timestamp - start_time, end_time - timestamp)
+        if self.linear[index - 1]:
+            error = min(error, self.max_error)
+        return timestamp, error
+
+    def block_at(self, timestamp: float) -> Optional[float]:
+        # Inverse interpolation: the (fractional) block produced at timestamp.
+        index = bisect.bisect_left(self.timestamps, timestamp)
+        if index == 0 or index == len(self.timestamps):
+            return None
+        start_block, end_block = self.blocks[index - 1], self.blocks[index]
+        start_time, end_time = self.timestamps[index - 1], self.timestamps[index]
+        if end_time == start_time:
+            return float(start_block)
+        return start_block + (timestamp - start_time) / (end_time - start_time) * (end_block - start_block)
+
+
+def block_time_index_path(cache_dir: str, chain_id: int) -> str:
+    return os.path.join(cache_dir, BLOCK_TIME_INDEX_DIR, f'{chain_id}.bin')
+
+
+def save_block_time_index(cache_dir: str, index: BlockTimeIndex, safe_block: Optional[int]) -> None:
+    # Only anchors at or below the finalized block are written. One JSON header
+    # line, then the raw block, timestamp and linear-flag arrays.
+    if safe_block is None:
+        # No finalized block from the node: keep anchors at least the finality
+        # depth (the deepest configured one for unknown chains) below the newest.
+        finality_blocks = CHAIN_CONFIG.get(index.chain_id, {}).get('finality_blocks') or max(
+            config['finality_blocks'] for config in CHAIN_CONFIG.values()
+        )
+        safe_block = index.blocks[-1] - finality_blocks if index.blocks else -1
+    count = bisect.bisect_right(index.blocks, safe_block)
+    linear = index.linear[:count]
+    if count:
+        linear[-1] = 0
+    path = block_time_index_path(cache_dir, index.chain_id)
+    header = {
+        'version': BLOCK_TIME_INDEX_VERSION,
+        'chain_id': index.chain_id,
+        'max_error': index.max_error,
+        'count': count,
+        'byteorder': sys.byteorder,
+    }
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'wb') as handle:
+            handle.write(json.dumps(header).encode('utf-8') + b'\n')
+            index.blocks[:count].tofile(handle)
+            index.timestamps[:count].tofile(handle)
+            linear.tofile(handle)
+        os.replace(temp_path, path)
+    except OSError as exc:
+        logger.warning('Could not save block time index %s: %s', path, exc)
+
+
+def load_block_time_index(cache_dir: str, chain_id: int) -> Optional[BlockTimeIndex]:
+    path = block_time_index_path(cache_dir, chain_id)
+    try:
+        with open(path, 'rb') as handle:
+            header = json.loads(handle.readline())
+            if header.get('version') != BLOCK_TIME_INDEX_VERSION or header.get('chain_id') != chain_id:
+                return None
+            count = int(header['count'])
+            index = BlockTimeIndex(chain_id)
+            index.blocks.fromfile(handle, count)
+            index.timestamps.fromfile(handle, count)
+            index.linear.fromfile(handle, count)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, EOFError) as exc:
+        logger.warning('Ignoring unreadable block time index %s: %s', path, exc)
+        return None
+    if header.get('byteorder') != sys.byteorder:
+        index.blocks.byteswap()
+        index.timestamps.byteswap()
+    # Segments checked against a looser bound are not trusted under a tighter one.
+    if int(header.get('max_error', 0)) > index.max_error:
+        index.linear = array.array('B', bytes(count))
+    return index
+
+
+def read_block_timestamp(ctx: VaultContext, block_number: int) -> int:
+    # Exact timestamp from memory, the persistent cache or the RPC; raises when the RPC fails.
+    cached = ctx.block_timestamp_cache.get(block_number)
+    if cached is not None:
+        return int(cached.timestamp())
+
+    if ctx.chain_cache is not None:
+        stored = ctx.chain_cache.get_block_timestamp(ctx.chain_id, block_number)
+        if stored is not None:
+            remember_block_timestamp(ctx, block_number, stored)
+            return stored
+
+    block = rpc_call(ctx.rpc_url, 'eth_getBlockByNumber', [f'0x{block_number:x}', False])
+    timestamp = int(block['timestamp'], 16)
+    if ctx.chain_cache is not None:
+        ctx.chain_cache.put_block_timestamp(ctx.chain_id, block_number, timestamp, ctx.safe_block)
+    remember_block_timestamp(ctx, block_number, timestamp)
+    return timestamp
+
+
+def estimate_block_timestamp(ctx: VaultContext, block_number: int) -> datetime.datetime:
+    # Last resort when the exact read failed: interpolate between anchors at
+    # any error, else extrapolate from the nearest anchor or the chain head.
+    index = ctx.block_time_index
+    if index is not None:
+        estimate = index.estimate(block_number)
+        if estimate is not None:
+            return datetime.datetime.fromtimestamp(estimate[0], datetime.timezone.utc)
+
+    try:
+        if index is not None and len(index):
+            nearest = min(bisect.bisect_left(index.blocks, block_number), len(index) - 1)
+            reference_block = index.blocks[nearest]
+            reference_time = datetime.datetime.fromtimestamp(index.timestamps[nearest], datetime.timezone.utc)
+        else:
+            read_head_block(ctx)
+            reference_block, reference_time = ctx.head_reference
+        block_time = get_chain_fallback_block_time_seconds(ctx)
+        if block_time is None:
+            return reference_time
+        return reference_time - datetime.timedelta(seconds=(reference_block - block_number) * block_time)
+    except Exception:
+        return datetime.datetime.now(datetime.timezone.utc)
 
 
-def get_block_timestamp(ctx: VaultContext, block_number: int) -> datetime.datetime:
+def get_block_timestamp(ctx: VaultContext, block_number: int, *, exact: bool = False) -> datetime.datetime:
+    # Unless exact is requested, a timestamp interpolated from the block time
+    # index within its error bound is good enough and costs no RPC call.
     if block_number in ctx.block_timestamp_cache:
         return ctx.block_timestamp_cache[block_number]
 
+    if not exact and ctx.block_time_index is not None:
+        estimate = ctx.block_time_index.estimate(block_number)
+        if estimate is not None and estimate[1] <= ctx.block_time_index.max_error:
+            return datetime.datetime.fromtimestamp(estimate[0], datetime.timezone.utc)
+
     try:
-        block = rpc_call(ctx.rpc_url, 'eth_getBlockByNumber', [f'0x{block_number:x}', False])
-        timestamp = int(block['timestamp'], 16)
-        result = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        read_block_timestamp(ctx, block_number)
+        return ctx.block_timestamp_cache[block_number]
     except Exception:
-        try:
-            # If the exact block timestamp fails, estimate it using chain block time.
-            current_block_hex = rpc_call(ctx.rpc_url, 'eth_blockNumber', [])
-            current_block = int(current_block_hex, 16)
-            current_time = datetime.datetime.now(datetime.timezone.utc)
-            block_diff = current_block - block_number
-            block_time = get_chain_fallback_block_time_seconds(ctx)
-            if block_diff < 0:
-                block_diff = 0
-            if block_time is None:
-                result = current_time
-            else:
-                result = current_time - datetime.timedelta(seconds=block_diff * block_time)
-        except Exception:
-            result = datetime.datetime.now(datetime.timezone.utc)
+        pass
 
-    ctx.block_timestamp_cache[block_number] = result
+    result = ctx.block_timestamp_estimates.get(block_number)
+    if result is None:
+        result = estimate_block_timestamp(ctx, block_number)
+        ctx.block_timestamp_estimates[block_number] = result
     return result
 
 
+def refine_block_time_index(ctx: VaultContext, blocks: Iterable[int]) -> None:
+    # Bisect the anchor segments around the requested blocks until each one is
+    # bounded within max_error or passed the midpoint check (see BlockTimeIndex).
+    # Every round reads its midpoints concurrently.
+    wanted = sorted(set(blocks))
+    if not wanted:
+        return
+    if ctx.block_time_index is None:
+        ctx.block_time_index = BlockTimeIndex(ctx.chain_id)
+    index = ctx.block_time_index
+    for block_number in wanted:
+        cached = ctx.block_timestamp_cache.get(block_number)
+        if cached is not None:
+            index.add(block_number, int(cached.timestamp()))
+
+    probes: List[Tuple[int, int, int, int, int]] = []
+    reads = [block for block in (wanted[0], wanted[-1]) if index.estimate(block) is None]
+    while reads:
+        results = run_with_chain_client(
+            ctx.max_concurrency,
+            lambda client: asyncio.gather(
+                *(client.call(ctx.rpc_url, read_block_timestamp, ctx, block) for block in reads),
+                return_exceptions=True,
+            ),
+        )
+        failed = False
+        for block_number, result in zip(reads, results):
+            if isinstance(result, BaseException):
+                failed = True
+                continue
+            index.add(block_number, result)
+        for start_block, start_time, end_block, end_time, middle in probes:
+            actual = ctx.block_timestamp_cache.get(middle)
+            if actual is None:
+                continue
+            predicted = start_time + (end_time - start_time) * (middle - start_block) // (end_block - start_block)
+            if abs(int(actual.timestamp()) - predicted) <= index.max_error:
+                index.mark_linear(start_block, end_block)
+        if failed:
+            # Without fresh anchors the loop cannot make progress; lookups fall back to exact reads.
+            return
+
+        segments: Dict[int, Tuple[int, int, int, int, int]] = {}
+        for block_number in wanted:
+            estimate = index.estimate(block_number)
+            if estimate is None or estimate[1] <= index.max_error:
+                continue
+            position = index.segment(block_number)
+            if position is None or position in segments:
+                continue
+            start_block, end_block = index.blocks[position], index.blocks[position + 1]
+            segments[position] = (
+                start_block,
+                index.timestamps[position],
+                end_block,
+                index.timestamps[position + 1],
+                (start_block + end_block) // 2,
+            )
+        probes = list(segments.values())
+        reads = [probe[4] for probe in probes]
+
+
 def _extract_rpc_urls(raw_list: Any) -> List[str]:
     urls: List[str] = []
     if not isinstance(raw_list, list):
@@ -329,19 +1867,8 @@ def _extract_rpc_urls(raw_list: Any) -> List[str]:
     return urls
 
 
-def _load_chainlist_rpcs() -> Dict[int, List[str]]:
-    global _CHAINLIST_RPCS
-    if _CHAINLIST_RPCS is not None:
-        return _CHAINLIST_RPCS
-
-    _CHAINLIST_RPCS = {}
-    try:
-        with urllib.request.urlopen('https://chainlist.org/rpcs.json', timeout=30) as response:
-            data = json.load(response)
-    except Exception as exc:
-        logger.warning('Could not load Chainlist RPCs: %s', exc)
-        return _CHAINLIST_RPCS
-
+def _parse_chainlist_rpcs(data: Any) -> Dict[int, List[str]]:
+    rpcs: Dict[int, List[str]] = {}
     if isinstance(data, dict):
         if isinstance(data.get('rpcs'), dict):
             data = data['rpcs']
@@ -357,7 +1884,7 @@ def _load_chainlist_rpcs() -> Dict[int, List[str]]:
                 continue
             urls = _extract_rpc_urls(entry.get('rpc') or entry.get('rpcs') or entry.get('rpcUrls'))
             if urls:
-                _CHAINLIST_RPCS[int(chain_id)] = urls
+                rpcs[int(chain_id)] = urls
     elif isinstance(data, dict):
         for key, value in data.items():
             try:
@@ -366,14 +1893,111 @@ def _load_chainlist_rpcs() -> Dict[int, List[str]]:
                 continue
             urls = _extract_rpc_urls(value)
             if urls:
-                _CHAINLIST_RPCS[chain_id] = urls
+                rpcs[chain_id] = urls
+    return rpcs
+
+
+def _load_chainlist_snapshot(cache_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(cache_dir, CHAINLIST_SNAPSHOT_FILE), encoding='utf-8') as handle:
+            snapshot = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != CHAINLIST_SNAPSHOT_VERSION:
+        return None
+    if not isinstance(snapshot.get('chains'), dict):
+        return None
+    return snapshot
+
 
-    return _CHAINLIST_RPCS
+def _save_chainlist_snapshot(cache_dir: str, chains: Dict[str, Dict[str, Any]]) -> None:
+    path = os.path.join(cache_dir, CHAINLIST_SNAPSHOT_FILE)
+    snapshot = {
+        'version': CHAINLIST_SNAPSHOT_VERSION,
+        'fetched_at': int(time.time()),
+        'chains': chains,
+    }
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(snapshot, handle, indent=2)
+        os.replace(temp_path, path)
+    except OSError as exc:
+        logger.warning('Could not save Chainlist snapshot: %s', exc)
+
+
+def refresh_chainlist_snapshot(cache_dir: str) -> None:
+    # Keep only the supported chains: a handful of HTTP endpoints each and a
+    # block time measured against a few of them in parallel. The configured
+    # fallbacks are only probed when none of the listed endpoints answers.
+    previous = _load_chainlist_snapshot(cache_dir) or {'chains': {}}
+    try:
+        chainlist = _parse_chainlist_rpcs(http_request_json(CHAINLIST_URL, timeout=CHAINLIST_FETCH_TIMEOUT))
+    except Exception as exc:
+        logger.debug('Could not load Chainlist RPCs: %s', exc)
+        chainlist = {}
+
+    chains: Dict[str, Dict[str, Any]] = {}
+    for chain_id, config in CHAIN_CONFIG.items():
+        entry = previous['chains'].get(str(chain_id)) or {}
+        listed = [url for url in chainlist.get(chain_id, []) if url.startswith(('http://', 'https://'))]
+        rpcs = listed[:CHAINLIST_SNAPSHOT_MAX_RPCS] or entry.get('rpcs') or []
+        measured = _measure_block_times(rpcs[:BLOCK_TIME_PROBE_ENDPOINTS])
+        if not measured:
+            measured = _measure_block_times(config['fallback_rpcs'][:BLOCK_TIME_PROBE_ENDPOINTS])
+        block_time = sorted(measured)[len(measured) // 2] if measured else entry.get('block_time')
+        chains[str(chain_id)] = {'rpcs': rpcs, 'block_time': block_time}
+    _save_chainlist_snapshot(cache_dir, chains)
+
+
+def _measure_block_times(rpc_urls: List[str]) -> List[float]:
+    # Plain threads rather than an executor: the refresh may still be running
+    # while the interpreter shuts down, when executors refuse new work.
+    measured: List[Optional[float]] = [None] * len(rpc_urls)
+
+    def probe(index: int) -> None:
+        measured[index] = _estimate_block_time_seconds(rpc_urls[index])
+
+    threads = [threading.Thread(target=probe, args=(index,), daemon=True) for index in range(len(rpc_urls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [seconds for seconds in measured if seconds]
+
+
+def _join_chainlist_refresh() -> None:
+    # A daemon thread dies with the interpreter, so give a running refresh a
+    # short chance to save the snapshot before exiting.
+    thread = _CHAINLIST_REFRESH
+    if thread is None or not thread.is_alive():
+        return
+    thread.join(CHAINLIST_REFRESH_EXIT_TIMEOUT)
+    if thread.is_alive():
+        logger.debug('Chainlist snapshot refresh still running at exit; leaving it to the next run')
+
+
+def _start_chainlist_refresh(cache_dir: str) -> None:
+    # At most one refresh per process; it runs on a daemon thread so no caller
+    # waits for it, and is joined with a timeout at exit.
+    global _CHAINLIST_REFRESH
+    with _CHAINLIST_REFRESH_LOCK:
+        if _CHAINLIST_REFRESH is not None:
+            return
+        _CHAINLIST_REFRESH = threading.Thread(
+            target=refresh_chainlist_snapshot,
+            args=(cache_dir,),
+            name='chainlist-refresh',
+            daemon=True,
+        )
+        _CHAINLIST_REFRESH.start()
+        atexit.register(_join_chainlist_refresh)
 
 
-def _estimate_block_time_seconds(rpc_url: str) -> Optional[float]:
+def _estimate_block_time_seconds(rpc_url: str, timeout: float = RPC_PROBE_TIMEOUT) -> Optional[float]:
     try:
-        latest = rpc_call_with_url(rpc_url, 'eth_getBlockByNumber', ['latest', False])
+        latest = rpc_call_with_url(rpc_url, 'eth_getBlockByNumber', ['latest', False], timeout=timeout)
         if not latest or 'number' not in latest or 'timestamp' not in latest:
             return None
         latest_number = int(latest['number'], 16)
@@ -382,7 +2006,7 @@ def _estimate_block_time_seconds(rpc_url: str) -> Optional[float]:
         sample_number = max(latest_number - 1000, 0)
         if sample_number == latest_number:
             return None
-        older = rpc_call_with_url(rpc_url, 'eth_getBlockByNumber', [f'0x{sample_number:x}', False])
+        older = rpc_call_with_url(rpc_url, 'eth_getBlockByNumber', [f'0x{sample_number:x}', False], timeout=timeout)
         if not older or 'timestamp' not in older:
             return None
         latest_time = int(latest['timestamp'], 16)
@@ -395,21 +2019,23 @@ def _estimate_block_time_seconds(rpc_url: str) -> Optional[float]:
 
 
 def get_chain_fallback_block_time_seconds(ctx: VaultContext) -> Optional[float]:
+    # Never blocks on the network: a measured block time from the snapshot,
+    # else the configured one. A stale snapshot is refreshed in the background.
     if ctx.chain_id in _CHAIN_BLOCK_TIME_CACHE:
         return _CHAIN_BLOCK_TIME_CACHE[ctx.chain_id]
 
-    candidates = [ctx.rpc_url]
-    candidates.extend(_load_chainlist_rpcs().get(ctx.chain_id, []))
-
-    for rpc_url in candidates:
-        if not rpc_url:
-            continue
-        seconds = _estimate_block_time_seconds(rpc_url)
-        if seconds:
-            _CHAIN_BLOCK_TIME_CACHE[ctx.chain_id] = seconds
-            return seconds
-
-    return None
+    seconds = None
+    if ctx.cache_dir is not None:
+        snapshot = _load_chainlist_snapshot(ctx.cache_dir)
+        if snapshot is None or time.time() - snapshot.get('fetched_at', 0) > CHAINLIST_SNAPSHOT_TTL_SECONDS:
+            _start_chainlist_refresh(ctx.cache_dir)
+        if snapshot is not None:
+            seconds = (snapshot['chains'].get(str(ctx.chain_id)) or {}).get('block_time')
+    if not seconds:
+        seconds = CHAIN_CONFIG.get(ctx.chain_id, {}).get('block_time')
+    if seconds:
+        _CHAIN_BLOCK_TIME_CACHE[ctx.chain_id] = seconds
+    return seconds
 
 
 def format_date(value: datetime.datetime) -> str:
@@ -447,316 +2073,705 @@ def format_units_display(value: int, decimals: int) -> str:
     return f"{whole}.{frac[:max_frac]}".rstrip('.')
 
 
-def query_envio_graphql(query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
-    payload = json.dumps({'query': query, 'variables': variables}).encode('utf-8')
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {ENVIO_TOKEN}',
-    }
-    request = urllib.request.Request(ENVIO_GRAPHQL_URL, data=payload, headers=headers)
-    try:
-        with urllib.request.urlopen(request, timeout=30) as response:
-            result = json.load(response)
-    except urllib.error.URLError as exc:
-        raise RuntimeError(f'GraphQL query failed: {exc}')
+@dataclass
+class EnvioSettings:
+    graphql_url: str
+    token: str
+
+
+def envio_settings() -> EnvioSettings:
+    # The only place the indexer settings are read; at call time, so .env (or
+    # a caller's environment) applies.
+    _ensure_local_env()
+    return EnvioSettings(
+        graphql_url=os.environ.get('ENVIO_GRAPHQL_URL', DEFAULT_ENVIO_GRAPHQL_URL),
+        token=os.environ.get('ENVIO_PASSWORD', ''),
+    )
+
+
+class GraphQLError(RuntimeError):
+    # The indexer answered with an errors list; validation is set when it
+    # rejected the query itself (unknown field, bad syntax) rather than failing to run it.
+    def __init__(self, errors: Any) -> None:
+        super().__init__(f'GraphQL errors: {errors}')
+        self.errors = errors
+        codes = {
+            (error.get('extensions') or {}).get('code')
+            for error in (errors if isinstance(errors, list) else [])
+            if isinstance(error, dict)
+        }
+        self.validation = any(code in GRAPHQL_VALIDATION_ERROR_CODES for code in codes)
+
+
+def query_envio_graphql(
+    query: str,
+    variables: Dict[str, Any],
+    retries: int = DEFAULT_GRAPHQL_RETRIES,
+) -> Dict[str, Any]:
+    settings = envio_settings()
+    payload = {'query': query, 'variables': variables}
+    headers = {'Authorization': f'Bearer {settings.token}'}
+    for attempt in range(retries + 1):
+        try:
+            result = http_request_json(settings.graphql_url, payload, headers)
+            break
+        except HTTPRequestError as exc:
+            if attempt == retries or not _transport_error_retryable(exc):
+                raise RuntimeError(f'GraphQL query failed: {exc}')
+            backoff = min(RPC_BACKOFF_BASE_SECONDS * 2 ** attempt, RPC_BACKOFF_MAX_SECONDS)
+            logger.debug('GraphQL attempt %d failed (%s); retrying', attempt + 1, exc)
+            time.sleep(backoff * random.uniform(0.8, 1.2))
 
     if 'errors' in result:
-        raise RuntimeError(f"GraphQL errors: {result['errors']}")
+        raise GraphQLError(result['errors'])
     return result.get('data', {})
 
 
-def get_deposit_events(depositor_address: str, vault_address: Optional[str] = None) -> List[DepositEvent]:
-    if vault_address:
-        query = textwrap.dedent('''
-            query GetDepositorDeposits($depositorAddress: String!, $vaultAddress: String!) {
-              Deposit(
-                where: {
-                  owner: { _eq: $depositorAddress }
-                  vaultAddress: { _eq: $vaultAddress }
-                }
-                order_by: { id: asc }
-              ) {
-                id
-                sender
-                owner
-                assets
-                shares
-              }
-            }
-        ''')
+KEYSET_PAGE_QUERY = textwrap.dedent('''
+    query {name}({variable_definitions}$chainId: Int!, $afterBlock: Int!, $afterLog: Int!, $limit: Int!) {{
+      {entity}(
+        where: {{
+          chainId: {{ _eq: $chainId }}
+          {filters}
+          _or: [
+            {{ blockNumber: {{ _gt: $afterBlock }} }}
+            {{ blockNumber: {{ _eq: $afterBlock }}, logIndex: {{ _gt: $afterLog }} }}
+          ]
+        }}
+        order_by: [{{ blockNumber: asc }}, {{ logIndex: asc }}]
+        limit: $limit
+      ) {{
+        {fields}
+      }}
+    }}
+''')
+
+
+def iter_envio_event_pages(
+    name: str,
+    entity: str,
+    filters: str,
+    variable_definitions: str,
+    variables: Dict[str, Any],
+    fields: List[str],
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    after: Tuple[int, int] = (-1, -1),
+) -> Iterator[List[Dict[str, Any]]]:
+    # Keyset pagination over (blockNumber, logIndex), which is only unique
+    # within one chain, so every page is filtered by chainId.
+    selected = list(fields)
+    for cursor_field in ('blockNumber', 'logIndex'):
+        if cursor_field not in selected:
+            selected.append(cursor_field)
+    query = KEYSET_PAGE_QUERY.format(
+        name=name,
+        entity=entity,
+        filters=filters,
+        variable_definitions=f'{variable_definitions}, ' if variable_definitions else '',
+        fields='\n    '.join(selected),
+    )
+    after_block, after_log = after
+    while True:
         data = query_envio_graphql(query, {
-            'depositorAddress': depositor_address.lower(),
-            'vaultAddress': vault_address.lower(),
+            **variables,
+            'chainId': chain_id,
+            'afterBlock': after_block,
+            'afterLog': after_log,
+            'limit': page_size,
         })
-    else:
-        query = textwrap.dedent('''
-            query GetDepositorDeposits($depositorAddress: String!) {
-              Deposit(
-                where: { owner: { _eq: $depositorAddress } }
-                order_by: { id: asc }
-              ) {
-                id
-                sender
-                owner
-                assets
-                shares
-              }
-            }
-        ''')
-        data = query_envio_graphql(query, {'depositorAddress': depositor_address.lower()})
-    return [DepositEvent(**entry) for entry in data.get('Deposit', [])]
+        rows = data.get(entity, [])
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        after_block, after_log = rows[-1]['blockNumber'], rows[-1]['logIndex']
 
 
-def get_withdraw_events(depositor_address: str, vault_address: Optional[str] = None) -> List[WithdrawEvent]:
-    if vault_address:
-        query = textwrap.dedent('''
-            query GetDepositorWithdrawals($depositorAddress: String!, $vaultAddress: String!) {
-              Withdraw(
-                where: {
-                  owner: { _eq: $depositorAddress }
-                  vaultAddress: { _eq: $vaultAddress }
-                }
-                order_by: { id: asc }
-              ) {
-                id
-                sender
-                receiver
-                owner
-                assets
-                shares
-              }
-            }
-        ''')
-        data = query_envio_graphql(query, {
-            'depositorAddress': depositor_address.lower(),
-            'vaultAddress': vault_address.lower(),
-        })
-    else:
-        query = textwrap.dedent('''
-            query GetDepositorWithdrawals($depositorAddress: String!) {
-              Withdraw(
-                where: { owner: { _eq: $depositorAddress } }
-                order_by: { id: asc }
-              ) {
-                id
-                sender
-                receiver
-                owner
-                assets
-                shares
-              }
-            }
-        ''')
-        data = query_envio_graphql(query, {'depositorAddress': depositor_address.lower()})
-    return [WithdrawEvent(**entry) for entry in data.get('Withdraw', [])]
+def iter_vault_share_events(
+    vault_address: str,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    after: Tuple[int, int] = (-1, -1),
+) -> Iterator[Tuple[int, int, str, Dict[str, Any]]]:
+    # Every Deposit, Withdraw and holder-to-holder Transfer of a vault, merged in (block, log) order.
+    variables = {'vaultAddress': vault_address.lower()}
+    vault_filter = 'vaultAddress: { _eq: $vaultAddress }'
+    streams = []
+    for kind, entity, fields in (
+        ('deposit', 'Deposit', ['owner', 'assets', 'shares', 'blockTimestamp']),
+        ('withdraw', 'Withdraw', ['owner', 'assets', 'shares', 'blockTimestamp']),
+        ('transfer', 'Transfer', ['sender', 'receiver', 'value', 'blockTimestamp']),
+    ):
+        filters = vault_filter
+        entity_variables = dict(variables)
+        definitions = '$vaultAddress: String!'
+        if entity == 'Transfer':
+            # Mints and burns are already covered by Deposit/Withdraw (and fee/locked-profit shares).
+            filters += '\n      sender: { _neq: $zeroAddress }\n      receiver: { _neq: $zeroAddress }'
+            definitions += ', $zeroAddress: String!'
+            entity_variables['zeroAddress'] = ZERO_ADDRESS
+        pages = iter_envio_event_pages(
+            f'GetVault{entity}Page',
+            entity,
+            filters,
+            definitions,
+            entity_variables,
+            fields,
+            chain_id,
+            page_size,
+            after,
+        )
+        streams.append(_tag_event_rows(pages, kind))
+    return heapq.merge(*streams, key=lambda item: (item[0], item[1]))
+
+
+def _tag_event_rows(
+    pages: Iterable[List[Dict[str, Any]]],
+    kind: str,
+) -> Iterator[Tuple[int, int, str, Dict[str, Any]]]:
+    for page in pages:
+        for row in page:
+            yield row['blockNumber'], row['logIndex'], kind, row
+
+
+# blockNumber, logIndex and blockTimestamp are indexed columns, so events carry
+# their position and time without parsing ids or asking the RPC for timestamps.
+EVENT_POSITION_FIELDS = ['blockNumber', 'logIndex', 'blockTimestamp']
+DEPOSIT_FIELDS = ['id', 'sender', 'owner', 'assets', 'shares', *EVENT_POSITION_FIELDS]
+WITHDRAW_FIELDS = ['id', 'sender', 'receiver', 'owner', 'assets', 'shares', *EVENT_POSITION_FIELDS]
+TRANSFER_FIELDS = ['id', 'sender', 'receiver', 'value', *EVENT_POSITION_FIELDS]
+
+
+def _deposit_from_row(entry: Dict[str, Any]) -> DepositEvent:
+    return DepositEvent(
+        id=entry['id'],
+        sender=entry['sender'],
+        owner=entry['owner'],
+        assets=entry['assets'],
+        shares=entry['shares'],
+        block_number=int(entry['blockNumber']),
+        log_index=int(entry['logIndex']),
+        block_timestamp=int(entry['blockTimestamp']),
+    )
+
+
+def _withdraw_from_row(entry: Dict[str, Any]) -> WithdrawEvent:
+    return WithdrawEvent(
+        id=entry['id'],
+        sender=entry['sender'],
+        receiver=entry['receiver'],
+        owner=entry['owner'],
+        assets=entry['assets'],
+        shares=entry['shares'],
+        block_number=int(entry['blockNumber']),
+        log_index=int(entry['logIndex']),
+        block_timestamp=int(entry['blockTimestamp']),
+    )
+
+
+def _transfer_from_row(entry: Dict[str, Any]) -> TransferEvent:
+    return TransferEvent(
+        id=entry['id'],
+        sender=entry['sender'],
+        receiver=entry['receiver'],
+        value=entry['value'],
+        block_number=int(entry['blockNumber']),
+        log_index=int(entry['logIndex']),
+        block_timestamp=int(entry['blockTimestamp']),
+    )
 
 
-def get_transfer_events(depositor_address: str, vault_address: Optional[str] = None) -> List[TransferEvent]:
-    zero_address = '0x' + '0' * 40
+def _depositor_filters(
+    owner_field: str,
+    vault_address: Optional[str],
+) -> Tuple[str, str, Dict[str, Any]]:
+    filters = f'{owner_field}: {{ _eq: $depositorAddress }}'
+    definitions = '$depositorAddress: String!'
+    variables: Dict[str, Any] = {}
     if vault_address:
-        query = textwrap.dedent('''
-            query GetDepositorTransfers($depositorAddress: String!, $zeroAddress: String!, $vaultAddress: String!) {
-              transfersFrom: Transfer(
-                where: {
-                  sender: { _eq: $depositorAddress }
-                  receiver: { _neq: $zeroAddress }
-                  vaultAddress: { _eq: $vaultAddress }
-                }
-                order_by: { id: asc }
-              ) {
-                id
-                sender
-                receiver
-                value
-              }
-              transfersTo: Transfer(
-                where: {
-                  receiver: { _eq: $depositorAddress }
-                  sender: { _neq: $zeroAddress }
-                  vaultAddress: { _eq: $vaultAddress }
-                }
-                order_by: { id: asc }
-              ) {
-                id
-                sender
-                receiver
-                value
-              }
-            }
-        ''')
-        data = query_envio_graphql(query, {
-            'depositorAddress': depositor_address.lower(),
-            'zeroAddress': zero_address.lower(),
-            'vaultAddress': vault_address.lower(),
-        })
-    else:
-        query = textwrap.dedent('''
-            query GetDepositorTransfers($depositorAddress: String!, $zeroAddress: String!) {
-              transfersFrom: Transfer(
-                where: {
-                  sender: { _eq: $depositorAddress }
-                  receiver: { _neq: $zeroAddress }
-                }
-                order_by: { id: asc }
-              ) {
-                id
-                sender
-                receiver
-                value
-              }
-              transfersTo: Transfer(
-                where: {
-                  receiver: { _eq: $depositorAddress }
-                  sender: { _neq: $zeroAddress }
-                }
-                order_by: { id: asc }
-              ) {
-                id
-                sender
-                receiver
-                value
-              }
-            }
-        ''')
-        data = query_envio_graphql(query, {
-            'depositorAddress': depositor_address.lower(),
-            'zeroAddress': zero_address.lower(),
-        })
-    return [TransferEvent(**entry) for entry in data.get('transfersFrom', []) + data.get('transfersTo', [])]
+        filters += '\n      vaultAddress: { _eq: $vaultAddress }'
+        definitions += ', $vaultAddress: String!'
+        variables['vaultAddress'] = vault_address.lower()
+    return filters, definitions, variables
 
 
-def parse_event_id(event_id: str) -> Tuple[int, int]:
-    parts = event_id.split('_')
-    return int(parts[1]), int(parts[2])
+def iter_deposit_events(
+    depositor_address: str,
+    vault_address: Optional[str] = None,
+    *,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    after: Tuple[int, int] = (-1, -1),
+) -> Iterator[DepositEvent]:
+    filters, definitions, variables = _depositor_filters('owner', vault_address)
+    variables['depositorAddress'] = depositor_address.lower()
+    pages = iter_envio_event_pages(
+        'GetDepositorDeposits',
+        'Deposit',
+        filters,
+        definitions,
+        variables,
+        DEPOSIT_FIELDS,
+        chain_id,
+        page_size,
+        after,
+    )
+    for page in pages:
+        for entry in page:
+            yield _deposit_from_row(entry)
 
 
-def build_event_timeline(
-    deposits: List[DepositEvent],
-    withdrawals: List[WithdrawEvent],
-    transfers: List[TransferEvent],
+def iter_withdraw_events(
     depositor_address: str,
-) -> List[Event]:
-    events: List[Event] = []
-
-    for deposit in deposits:
-        block, log = parse_event_id(deposit.id)
-        events.append(Event('deposit', block, log, deposit.__dict__))
-
-    for withdrawal in withdrawals:
-        block, log = parse_event_id(withdrawal.id)
-        events.append(Event('withdraw', block, log, withdrawal.__dict__))
-
-    for transfer in transfers:
-        block, log = parse_event_id(transfer.id)
-        event_type = 'transfer_out' if transfer.sender.lower() == depositor_address.lower() else 'transfer_in'
-        events.append(Event(event_type, block, log, transfer.__dict__))
-
-    events.sort(key=lambda itm: (itm.block_number, itm.log_index))
-    return events
-
-
-def calculate_position(events: List[Event], depositor_address: str) -> PositionResult:
-    snapshots: List[PositionSnapshot] = []
-    user_events: List[Event] = []
-    current_shares = 0
-    total_deposited = 0
-    total_withdrawn = 0
-    peak_shares = 0
-    peak_shares_block = 0
-
-    for event in events:
-        shares_change = 0
-        if event.type == 'deposit':
-            shares_change = int(event.data['shares'])
-            current_shares += shares_change
-            total_deposited += int(event.data['assets'])
-            user_events.append(event)
-        elif event.type == 'withdraw':
-            shares_change = -int(event.data['shares'])
-            current_shares += shares_change
-            total_withdrawn += int(event.data['assets'])
-            user_events.append(event)
-        elif event.type in ('transfer_in', 'transfer_out'):
-            shares_change = int(event.data['value']) if event.type == 'transfer_in' else -int(event.data['value'])
-            current_shares += shares_change
-            user_events.append(event)
-
-        if current_shares > peak_shares:
-            peak_shares = current_shares
-            peak_shares_block = event.block_number
-
-        snapshots.append(PositionSnapshot(
-            block_number=event.block_number,
-            event_type=event.type,
-            shares_balance=current_shares,
-            shares_change=shares_change,
-            assets_deposited=total_deposited,
-            assets_withdrawn=total_withdrawn,
-        ))
+    vault_address: Optional[str] = None,
+    *,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    after: Tuple[int, int] = (-1, -1),
+) -> Iterator[WithdrawEvent]:
+    filters, definitions, variables = _depositor_filters('owner', vault_address)
+    variables['depositorAddress'] = depositor_address.lower()
+    pages = iter_envio_event_pages(
+        'GetDepositorWithdrawals',
+        'Withdraw',
+        filters,
+        definitions,
+        variables,
+        WITHDRAW_FIELDS,
+        chain_id,
+        page_size,
+        after,
+    )
+    for page in pages:
+        for entry in page:
+            yield _withdraw_from_row(entry)
 
-    return PositionResult(
-        snapshots=snapshots,
-        current_shares=current_shares,
-        total_deposited=total_deposited,
-        total_withdrawn=total_withdrawn,
-        user_events=user_events,
-        peak_shares=peak_shares,
-        peak_shares_block=peak_shares_block,
+
+def _iter_transfer_side(
+    side: str,
+    depositor_address: str,
+    vault_address: Optional[str],
+    chain_id: int,
+    page_size: int,
+    after: Tuple[int, int],
+) -> Iterator[TransferEvent]:
+    # side is the field matching the depositor; the other side must not be the zero address (mint/burn).
+    other = 'receiver' if side == 'sender' else 'sender'
+    filters, definitions, variables = _depositor_filters(side, vault_address)
+    filters += f'\n      {other}: {{ _neq: $zeroAddress }}'
+    definitions += ', $zeroAddress: String!'
+    variables['depositorAddress'] = depositor_address.lower()
+    variables['zeroAddress'] = ZERO_ADDRESS
+    pages = iter_envio_event_pages(
+        'GetDepositorTransfersFrom' if side == 'sender' else 'GetDepositorTransfersTo',
+        'Transfer',
+        filters,
+        definitions,
+        variables,
+        TRANSFER_FIELDS,
+        chain_id,
+        page_size,
+        after,
     )
+    for page in pages:
+        for entry in page:
+            yield _transfer_from_row(entry)
 
 
-def calculate_weighted_average_entry_pps(ctx: VaultContext, events: List[Event], decimals: int) -> int:
-    scale = 10 ** decimals
-    total_assets = 0
-    total_shares = 0
-
-    # Track cost basis in asset terms while shares change over time.
-    for event in events:
-        if event.type == 'deposit':
-            shares = int(event.data['shares'])
-            assets = int(event.data['assets'])
-            total_shares += shares
-            total_assets += assets
-        elif event.type == 'withdraw':
-            shares = int(event.data['shares'])
-            if total_shares > 0:
-                remove_shares = min(shares, total_shares)
-                removed_assets = (total_assets * remove_shares) // total_shares
-                total_shares -= remove_shares
-                total_assets -= removed_assets
-        elif event.type == 'transfer_in':
-            # Incoming transfers are valued at the PPS of the transfer block.
-            shares = int(event.data['value'])
-            pps = get_price_per_share_at_block(ctx, event.block_number)
-            assets = shares * pps // scale
-            total_shares += shares
-            total_assets += assets
-        elif event.type == 'transfer_out':
-            shares = int(event.data['value'])
-            if total_shares > 0:
-                remove_shares = min(shares, total_shares)
-                removed_assets = (total_assets * remove_shares) // total_shares
-                total_shares -= remove_shares
-                total_assets -= removed_assets
-
-    if total_shares == 0:
-        return 0
+def iter_transfer_events(
+    depositor_address: str,
+    vault_address: Optional[str] = None,
+    *,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    after: Tuple[int, int] = (-1, -1),
+) -> Iterator[TransferEvent]:
+    # Outgoing and incoming transfers are paged separately and merged in chain order.
+    return heapq.merge(
+        _iter_transfer_side('sender', depositor_address, vault_address, chain_id, page_size, after),
+        _iter_transfer_side('receiver', depositor_address, vault_address, chain_id, page_size, after),
+        key=lambda transfer: (transfer.block_number, transfer.log_index),
+    )
 
-    return total_assets * scale // total_shares
 
+COMBINED_EVENTS_QUERY = textwrap.dedent('''
+    query GetDepositorEvents({variable_definitions}, $chainId: Int!, $zeroAddress: String!, $afterBlock: Int!, $afterLog: Int!, $limit: Int!) {{
+      deposits: Deposit(
+        where: {{
+          {owner_filters}
+          {after_filter}
+        }}
+        order_by: [{{ blockNumber: asc }}, {{ logIndex: asc }}]
+        limit: $limit
+      ) {{
+        {deposit_fields}
+      }}
+      withdrawals: Withdraw(
+        where: {{
+          {owner_filters}
+          {after_filter}
+        }}
+        order_by: [{{ blockNumber: asc }}, {{ logIndex: asc }}]
+        limit: $limit
+      ) {{
+        {withdraw_fields}
+      }}
+      transfersFrom: Transfer(
+        where: {{
+          {sender_filters}
+          receiver: {{ _neq: $zeroAddress }}
+          {after_filter}
+        }}
+        order_by: [{{ blockNumber: asc }}, {{ logIndex: asc }}]
+        limit: $limit
+      ) {{
+        {transfer_fields}
+      }}
+      transfersTo: Transfer(
+        where: {{
+          {receiver_filters}
+          sender: {{ _neq: $zeroAddress }}
+          {after_filter}
+        }}
+        order_by: [{{ blockNumber: asc }}, {{ logIndex: asc }}]
+        limit: $limit
+      ) {{
+        {transfer_fields}
+      }}
+    }}
+''')
+# Same chain filter and (block, log) keyset cursor as KEYSET_PAGE_QUERY, so a run can resume after a checkpoint.
+AFTER_CURSOR_FILTER = 'chainId: { _eq: $chainId }\n      _or: [{ blockNumber: { _gt: $afterBlock } }, { blockNumber: { _eq: $afterBlock }, logIndex: { _gt: $afterLog } }]'
+# Set once the indexer's schema rejects the combined query so later depositors skip straight to split queries.
+_COMBINED_EVENTS_QUERY_FAILED = False
+
+
+def _continue_pages(
+    first_page: List[Dict[str, Any]],
+    convert: Any,
+    page_size: int,
+    remaining: Any,
+) -> Iterator[Any]:
+    # Yield the first page, then keep paging from its last (block, log) if it was full.
+    for entry in first_page:
+        yield convert(entry)
+    if len(first_page) >= page_size:
+        yield from remaining((first_page[-1]['blockNumber'], first_page[-1]['logIndex']))
+
+
+def fetch_depositor_events(
+    depositor_address: str,
+    vault_address: Optional[str] = None,
+    *,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    after: Tuple[int, int] = (-1, -1),
+) -> Tuple[Iterator[DepositEvent], Iterator[WithdrawEvent], Iterator[TransferEvent]]:
+    # Fetch the first page of deposits, withdrawals and both transfer directions
+    # in a single aliased request; only sets with more rows need follow-up pages.
+    global _COMBINED_EVENTS_QUERY_FAILED
+
+    def split_queries() -> Tuple[Iterator[DepositEvent], Iterator[WithdrawEvent], Iterator[TransferEvent]]:
+        return (
+            iter_deposit_events(depositor_address, vault_address, chain_id=chain_id, page_size=page_size, after=after),
+            iter_withdraw_events(depositor_address, vault_address, chain_id=chain_id, page_size=page_size, after=after),
+            iter_transfer_events(depositor_address, vault_address, chain_id=chain_id, page_size=page_size, after=after),
+        )
 
-def read_accountant_fee_config(
-    ctx: VaultContext,
-    vault_address: str,
+    if _COMBINED_EVENTS_QUERY_FAILED:
+        return split_queries()
+
+    owner_filters, definitions, variables = _depositor_filters('owner', vault_address)
+    sender_filters, _, _ = _depositor_filters('sender', vault_address)
+    receiver_filters, _, _ = _depositor_filters('receiver', vault_address)
+    indent = '\n    '
+    query = COMBINED_EVENTS_QUERY.format(
+        variable_definitions=definitions,
+        owner_filters=owner_filters,
+        sender_filters=sender_filters,
+        receiver_filters=receiver_filters,
+        after_filter=AFTER_CURSOR_FILTER,
+        deposit_fields=indent.join(DEPOSIT_FIELDS),
+        withdraw_fields=indent.join(WITHDRAW_FIELDS),
+        transfer_fields=indent.join(TRANSFER_FIELDS),
+    )
+    variables.update({
+        'depositorAddress': depositor_address.lower(),
+        'chainId': chain_id,
+        'zeroAddress': ZERO_ADDRESS,
+        'afterBlock': after[0],
+        'afterLog': after[1],
+        'limit': page_size,
+    })
+    try:
+        data = query_envio_graphql(query, variables)
+    except GraphQLError as exc:
+        # Transport failures were already retried and would hit the split
+        # queries too, so only a rejected query switches them on.
+        if not exc.validation:
+            raise
+        logger.warning('Combined event query rejected (%s); falling back to separate queries', exc)
+        _COMBINED_EVENTS_QUERY_FAILED = True
+        return split_queries()
+
+    deposits = _continue_pages(
+        data.get('deposits', []),
+        _deposit_from_row,
+        page_size,
+        lambda after: iter_deposit_events(depositor_address, vault_address, chain_id=chain_id, page_size=page_size, after=after),
+    )
+    withdrawals = _continue_pages(
+        data.get('withdrawals', []),
+        _withdraw_from_row,
+        page_size,
+        lambda after: iter_withdraw_events(depositor_address, vault_address, chain_id=chain_id, page_size=page_size, after=after),
+    )
+    transfers = heapq.merge(
+        _continue_pages(
+            data.get('transfersFrom', []),
+            _transfer_from_row,
+            page_size,
+            lambda after: _iter_transfer_side('sender', depositor_address, vault_address, chain_id, page_size, after),
+        ),
+        _continue_pages(
+            data.get('transfersTo', []),
+            _transfer_from_row,
+            page_size,
+            lambda after: _iter_transfer_side('receiver', depositor_address, vault_address, chain_id, page_size, after),
+        ),
+        key=lambda transfer: (transfer.block_number, transfer.log_index),
+    )
+    return deposits, withdrawals, transfers
+
+
+def get_deposit_events(
+    depositor_address: str,
+    vault_address: Optional[str] = None,
+    *,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+) -> List[DepositEvent]:
+    return list(iter_deposit_events(depositor_address, vault_address, chain_id=chain_id, page_size=page_size))
+
+
+def get_withdraw_events(
+    depositor_address: str,
+    vault_address: Optional[str] = None,
+    *,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+) -> List[WithdrawEvent]:
+    return list(iter_withdraw_events(depositor_address, vault_address, chain_id=chain_id, page_size=page_size))
+
+
+def get_transfer_events(
+    depositor_address: str,
+    vault_address: Optional[str] = None,
+    *,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+) -> List[TransferEvent]:
+    return list(iter_transfer_events(depositor_address, vault_address, chain_id=chain_id, page_size=page_size))
+
+
+def is_self_transfer(sender: str, receiver: str) -> bool:
+    # A holder sending shares to itself moves nothing; every replay skips these.
+    return sender.lower() == receiver.lower()
+
+
+def build_event_timeline(
+    deposits: Iterable[DepositEvent],
+    withdrawals: Iterable[WithdrawEvent],
+    transfers: Iterable[TransferEvent],
+    depositor_address: str,
+) -> EventTimeline:
+    # Each input must already be in (block, log) order, as the iter_*_events
+    # generators are; amounts are parsed once here. A self-transfer is listed
+    # as both outgoing and incoming, so it is dropped rather than counted twice.
+    depositor = depositor_address.lower()
+    timeline = EventTimeline()
+
+    def transfer_type(transfer: TransferEvent) -> int:
+        return EVENT_TRANSFER_OUT if transfer.sender.lower() == depositor else EVENT_TRANSFER_IN
+
+    merged = heapq.merge(
+        ((deposit.block_number, deposit.log_index, EVENT_DEPOSIT, deposit) for deposit in deposits),
+        ((withdrawal.block_number, withdrawal.log_index, EVENT_WITHDRAW, withdrawal) for withdrawal in withdrawals),
+        (
+            (transfer.block_number, transfer.log_index, transfer_type(transfer), transfer)
+            for transfer in transfers
+            if not is_self_transfer(transfer.sender, transfer.receiver)
+        ),
+        key=lambda item: (item[0], item[1]),
+    )
+    for block_number, log_index, event_type, event in merged:
+        if event_type == EVENT_DEPOSIT or event_type == EVENT_WITHDRAW:
+            shares, assets = int(event.shares), int(event.assets)
+        else:
+            shares, assets = int(event.value), 0
+        timeline.append(event_type, block_number, log_index, event.block_timestamp, shares, assets)
+    return timeline
+
+
+def calculate_position(
+    ctx: VaultContext,
+    timeline: EventTimeline,
+    current_pps: int,
+    decimals: int,
+    *,
+    start: Optional[PositionState] = None,
+    checkpoint_block: Optional[int] = None,
+) -> PositionResult:
+    # One pass over the timeline yields balances, peak, cost basis and
+    # incremental profit, looking up each event block's PPS once. It continues
+    # from start when given, and snapshots the state at checkpoint_block.
+    scale = 10 ** decimals
+    prefetch_price_per_share(ctx, timeline.blocks)
+    vectorized = HAS_NUMPY and len(timeline) >= VECTORIZE_MIN_EVENTS
+    state = replace(start) if start is not None else PositionState()
+    balances = LimbColumn()
+    event_pps: List[int] = []
+    cumulative_profit: List[int] = []
+    checkpoint: Optional[PositionState] = None
+    checkpoint_events = len(timeline)
+    current_shares = state.current_shares
+    cost_shares = state.cost_shares
+    cost_assets = state.cost_assets
+    profit = state.profit
+    previous_pps = state.last_pps
+    start_shares = current_shares
+
+    def snapshot() -> PositionState:
+        return replace(
+            state,
+            current_shares=current_shares,
+            cost_shares=cost_shares,
+            cost_assets=cost_assets,
+            profit=profit,
+            last_pps=previous_pps,
+        )
+
+    events = zip(timeline.types, timeline.blocks, timeline.log_indexes, timeline.timestamps, timeline.shares, timeline.assets)
+    for index, (event_type, block_number, log_index, timestamp, shares, assets) in enumerate(events):
+        if checkpoint_block is not None and checkpoint is None and block_number > checkpoint_block:
+            checkpoint = snapshot()
+            checkpoint_events = index
+        pps = get_price_per_share_at_block(ctx, block_number)
+        if previous_pps is not None and not vectorized:
+            profit += current_shares * (pps - previous_pps) // scale
+
+        if event_type == EVENT_DEPOSIT or event_type == EVENT_TRANSFER_IN:
+            current_shares += shares
+            if event_type == EVENT_DEPOSIT:
+                state.deposits += 1
+                state.total_deposited += assets
+            else:
+                # Incoming transfers are valued at the PPS of the transfer block.
+                state.transfers_in += 1
+                assets = shares * pps // scale
+                state.net_transfer_value += assets
+            cost_shares += shares
+            cost_assets += assets
+        else:
+            current_shares -= shares
+            if event_type == EVENT_WITHDRAW:
+                state.withdrawals += 1
+                state.total_withdrawn += assets
+            else:
+                state.transfers_out += 1
+                state.net_transfer_value -= shares * pps // scale
+            if cost_shares > 0:
+                remove_shares = min(shares, cost_shares)
+                cost_assets -= (cost_assets * remove_shares) // cost_shares
+                cost_shares -= remove_shares
+
+        if current_shares > state.peak_shares:
+            state.peak_shares = current_shares
+            state.peak_shares_block = block_number
+            state.peak_pps = pps
+            state.peak_timestamp = timestamp
+        if state.first_block is None:
+            state.first_block = block_number
+            state.first_timestamp = timestamp
+        state.last_block = block_number
+        state.last_log_index = log_index
+        balances.append(current_shares)
+        event_pps.append(pps)
+        cumulative_profit.append(profit)
+        previous_pps = pps
+
+    if vectorized:
+        # The bulk path starts from zero shares; add the step from the resumed
+        # state to the first event, then the profit already accumulated.
+        first_step = start_shares * (event_pps[0] - state.last_pps) // scale if state.last_pps is not None else 0
+        cumulative_profit = cumulative_incremental_profit(balances, event_pps, scale, state.profit + first_step)
+        profit = cumulative_profit[-1]
+        if checkpoint is not None:
+            checkpoint.profit = cumulative_profit[checkpoint_events - 1] if checkpoint_events else state.profit
+    state = snapshot()
+    if checkpoint_block is not None and checkpoint is None:
+        checkpoint = state
+
+    net_profit = profit
+    if previous_pps is not None:
+        # Add profit from the last event to the current on-chain PPS.
+        net_profit += current_shares * (current_pps - previous_pps) // scale
+
+    return PositionResult(
+        timeline=timeline,
+        state=state,
+        balances=balances,
+        event_pps=event_pps,
+        cumulative_profit=cumulative_profit,
+        weighted_avg_entry_pps=cost_assets * scale // cost_shares if cost_shares else 0,
+        net_profit=net_profit,
+        checkpoint=checkpoint,
+    )
+
+
+class FeeConfigUnavailable(RuntimeError):
+    # The chain answered, but the vault had no usable fee config at that block.
+    pass
+
+
+def read_accountant_fee_config(
+    ctx: VaultContext,
+    vault_address: str,
     block_number: Optional[int] = None,
 ) -> Tuple[int, int, int, int]:
-    accountant_hex = contract_call(ctx.rpc_url, vault_address, '0x4fb3ccc5', block_number)
+    cache_key = (vault_address.lower(), block_number) if block_number is not None else None
+    if cache_key is not None and cache_key in ctx.fee_config_cache:
+        return ctx.fee_config_cache[cache_key]
+
+    # Ask for the accountant and, optimistically, the config from the last known
+    # accountant in one multicall; a changed accountant costs one extra call.
+    config_call = GET_VAULT_CONFIG_SELECTOR + _abi_address(vault_address)
+    guess = ctx.accountant_hint
+    calls = [(vault_address, ACCOUNTANT_SELECTOR)]
+    if guess is not None:
+        calls.append((guess, config_call))
+    results = multicall(ctx.rpc_url, ctx.chain_id, calls, block_number)
+    accountant_hex = results[0]
+    if not accountant_hex or len(accountant_hex) < 42:
+        raise FeeConfigUnavailable(f'Vault accountant() call failed at block {block_number}')
     accountant_address = '0x' + accountant_hex[-40:]
-    selector = '0xde1eb9a3'
-    vault_param = vault_address.lower().replace('0x', '').rjust(64, '0')
-    config_hex = contract_call(ctx.rpc_url, accountant_address, selector + vault_param, block_number)
-    if not config_hex:
-        raise RuntimeError('Empty getVaultConfig response')
+    if int(accountant_address, 16) == 0:
+        raise FeeConfigUnavailable(f'Vault has no accountant at block {block_number}')
+    if guess is not None and accountant_address.lower() == guess.lower():
+        config_hex = results[1]
+        if config_hex is None:
+            raise FeeConfigUnavailable(f'getVaultConfig reverted on accountant {accountant_address}')
+    else:
+        try:
+            config_hex = contract_call(ctx.rpc_url, accountant_address, config_call, block_number)
+        except RpcError as exc:
+            if not exc.reverted:
+                raise
+            raise FeeConfigUnavailable(f'getVaultConfig reverted on accountant {accountant_address}: {exc}')
+        ctx.accountant_hint = accountant_address
+    if not config_hex or config_hex == '0x':
+        raise FeeConfigUnavailable(f'Empty getVaultConfig response from accountant {accountant_address}')
     raw_payload = config_hex[2:] if config_hex.startswith('0x') else config_hex
     if len(raw_payload) < 64 * 4:
         logger.warning(
@@ -768,16 +2783,10 @@ def read_accountant_fee_config(
     else:
         hex_payload = raw_payload
     words = [int(hex_payload[i * 64:(i + 1) * 64], 16) for i in range(4)]
-    return (words[0], words[1], words[2], words[3])
-
-
-def verify_management_fee_zero(ctx: VaultContext, vault_address: str, blocks: List[int]) -> None:
-    for block in blocks:
-        management_fee, _, _, _ = read_accountant_fee_config(ctx, vault_address, block)
-        if management_fee != 0:
-            raise RuntimeError(
-                f'Management fee non-zero ({management_fee}) detected at block {block}; expected 0'
-            )
+    config = (words[0], words[1], words[2], words[3])
+    if cache_key is not None:
+        ctx.fee_config_cache[cache_key] = config
+    return config
 
 
 def get_performance_fee_rate(
@@ -798,93 +2807,1150 @@ def get_performance_fee_rate(
             logger.info('Performance fee %.2f%% (calculated from on-chain)', ratio_bps / 100)
         return ratio_bps
     except Exception as exc:
-        logger.warning('Could not fetch performance fee rate (%s) - using default 10%%', exc)
-        return 1000
+        logger.warning(
+            'Could not fetch performance fee rate (%s) - using default %.2f%%',
+            exc,
+            DEFAULT_PERFORMANCE_FEE_BPS / 100,
+        )
+        return DEFAULT_PERFORMANCE_FEE_BPS
 
 
-def sample_fee_check_blocks(start_block: int, end_block: int, checks: int = 5) -> List[int]:
-    if checks <= 1 or start_block == end_block:
-        return [start_block] * checks
+@dataclass
+class FeeSegment:
+    # Fee rates in force from start_block through end_block (inclusive).
+    start_block: int
+    end_block: int
+    management_fee: int
+    performance_fee_bps: int
 
-    span = end_block - start_block
-    if span <= 0:
-        return [start_block] * checks
 
-    return [start_block + (span * i) // (checks - 1) for i in range(checks)]
+@dataclass
+class FeeSegmentProfit:
+    segment: FeeSegment
+    net_profit: int
+    gross_profit: int
+    total_fees: int
+
+
+def fetch_fee_change_blocks(vault_address: str, chain_id: int, page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE) -> List[int]:
+    # Blocks where the vault switched accountant or an accountant added or removed it.
+    blocks = set()
+    for name, entity, vault_field in (
+        ('GetVaultAccountantUpdatesPage', 'UpdateAccountant', 'vaultAddress'),
+        ('GetAccountantVaultChangesPage', 'V3AccountantVaultChanged', 'vault'),
+    ):
+        for page in iter_envio_event_pages(
+            name,
+            entity,
+            f'{vault_field}: {{ _eq: $vaultAddress }}',
+            '$vaultAddress: String!',
+            {'vaultAddress': vault_address.lower()},
+            [],
+            chain_id,
+            page_size,
+        ):
+            blocks.update(row['blockNumber'] for row in page)
+    return sorted(blocks)
+
+
+def _fee_rates_at(ctx: VaultContext, block_number: int, strict: bool = False) -> Tuple[int, int]:
+    # Like get_performance_fee_rate, a block without a usable config (no
+    # accountant, reverted getVaultConfig, maxFee zero) gets the default rate,
+    # unless strict verification asks for the real one. RPC failures propagate.
+    try:
+        management_fee, performance_fee, _, max_fee = read_accountant_fee_config(ctx, ctx.address, block_number)
+        if max_fee == 0:
+            raise FeeConfigUnavailable('maxFee is zero')
+        return management_fee, performance_fee * 10000 // max_fee
+    except FeeConfigUnavailable as exc:
+        if strict:
+            raise RuntimeError(f'No fee config to verify at block {block_number}: {exc}')
+        logger.warning(
+            'No fee config at block %d (%s) - using default %.2f%%',
+            block_number,
+            exc,
+            DEFAULT_PERFORMANCE_FEE_BPS / 100,
+        )
+        # Cached as the equivalent config, so the block is not read (or warned about) again.
+        ctx.fee_config_cache[(ctx.address.lower(), block_number)] = (0, DEFAULT_PERFORMANCE_FEE_BPS, 0, 10000)
+        return 0, DEFAULT_PERFORMANCE_FEE_BPS
+
 
+def _fee_sample_blocks(start_block: int, end_block: int, samples: int = FEE_HISTORY_SAMPLES) -> List[int]:
+    # Both ends of the span plus evenly spaced interior blocks.
+    step = (end_block - start_block) / (samples + 1)
+    interior = (start_block + round(step * index) for index in range(1, samples + 1))
+    return sorted({start_block, end_block, *interior})
 
-def verify_performance_fee_stability(
+
+def _locate_fee_changes(
     ctx: VaultContext,
-    vault_address: str,
-    first_block: Optional[int],
-    last_block: Optional[int],
-    reference_fee_bps: int,
-    checks: int = 5,
-    *,
-    blocks_to_check: Optional[List[int]] = None,
-) -> List[int]:
-    if first_block is None or last_block is None:
-        return []
-    if checks <= 0:
-        return []
+    start_block: int,
+    end_block: int,
+    samples: int = FEE_HISTORY_SAMPLES,
+    strict: bool = False,
+) -> List[Tuple[int, Tuple[int, int]]]:
+    # Config updates inside an accountant are not indexed. The rates are read
+    # at sampled blocks across the span, and wherever two neighbouring samples
+    # differ a bisection finds each block where they changed. A change that is
+    # reverted between two samples is not seen.
+    changes: List[Tuple[int, Tuple[int, int]]] = []
+    blocks = _fee_sample_blocks(start_block, end_block, samples)
+    low, low_rates = blocks[0], _fee_rates_at(ctx, blocks[0], strict)
+    for sample in blocks[1:]:
+        sample_rates = _fee_rates_at(ctx, sample, strict)
+        while low_rates != sample_rates:
+            high = sample
+            while high - low > 1:
+                middle = (low + high) // 2
+                if _fee_rates_at(ctx, middle, strict) == low_rates:
+                    low = middle
+                else:
+                    high = middle
+            low, low_rates = high, _fee_rates_at(ctx, high, strict)
+            changes.append((low, low_rates))
+        low = sample
+    return changes
+
+
+def build_fee_history(
+    ctx: VaultContext,
+    start_block: int,
+    end_block: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    strict: bool = False,
+) -> List[FeeSegment]:
+    # Fee config is read only around indexed accountant changes: at sampled
+    # blocks of every span between them, plus a bisection where samples differ.
+    # strict fails on blocks without a readable config instead of defaulting.
+    if ctx.fee_change_blocks is None:
+        ctx.fee_change_blocks = fetch_fee_change_blocks(ctx.address, ctx.chain_id, page_size)
+    change_blocks = [block for block in ctx.fee_change_blocks if start_block < block <= end_block]
+    span_starts = [start_block, *change_blocks]
+    span_ends = [block - 1 for block in change_blocks] + [end_block]
+    prefetch_chain_reads(
+        ctx,
+        fee_config_blocks=[
+            block
+            for span_start, span_end in zip(span_starts, span_ends)
+            for block in _fee_sample_blocks(span_start, span_end)
+        ],
+    )
 
-    if blocks_to_check is None:
-        blocks_to_check = sample_fee_check_blocks(first_block, last_block, checks)
-    observed = []
-    for block in blocks_to_check:
-        fee = get_performance_fee_rate(ctx, vault_address, block, log=False)
-        observed.append((block, fee))
+    segments: List[FeeSegment] = []
+    for span_start, span_end in zip(span_starts, span_ends):
+        points = [(span_start, _fee_rates_at(ctx, span_start, strict))]
+        points.extend(_locate_fee_changes(ctx, span_start, span_end, strict=strict))
+        for index, (block_number, rates) in enumerate(points):
+            segment_end = points[index + 1][0] - 1 if index + 1 < len(points) else span_end
+            previous = segments[-1] if segments else None
+            if previous is not None and (previous.management_fee, previous.performance_fee_bps) == rates:
+                previous.end_block = segment_end
+            else:
+                segments.append(FeeSegment(block_number, segment_end, *rates))
+    return segments
 
-    if any(fee != reference_fee_bps for _, fee in observed):
+
+def verify_fee_history(segments: List[FeeSegment], reference_fee_bps: int) -> None:
+    if any(segment.performance_fee_bps != reference_fee_bps for segment in segments):
         details = ', '.join(
-            f'Block {block}: {fee / 100:.2f}%' for block, fee in observed
+            f'Blocks {segment.start_block}-{segment.end_block}: {segment.performance_fee_bps / 100:.2f}%'
+            for segment in segments
         )
         raise RuntimeError(
             f'Performance fee changed during depositor activity; expected '
             f'{reference_fee_bps / 100:.2f}%, observed [{details}]'
         )
-    return blocks_to_check
-
-
-def calculate_incremental_profit_and_fees(
-    ctx: VaultContext,
-    snapshots: List[PositionSnapshot],
-    performance_fee_bps: int,
-    current_pps: int,
-    current_shares: int,
-    decimals: int,
-) -> Dict[str, int]:
-    scale = 10 ** decimals
-    net_profit = 0
-    previous_shares = 0
-    previous_pps = get_price_per_share_at_block(ctx, snapshots[0].block_number) if snapshots else current_pps
-
-    # Incremental profit accumulates as PPS changes between user events.
-    for snapshot in snapshots:
-        snapshot_pps = get_price_per_share_at_block(ctx, snapshot.block_number)
-        delta_pps = snapshot_pps - previous_pps
-        net_profit += previous_shares * delta_pps // scale
-        previous_shares = snapshot.shares_balance
-        previous_pps = snapshot_pps
+    for segment in segments:
+        if segment.management_fee != 0:
+            raise RuntimeError(
+                f'Management fee non-zero ({segment.management_fee}) detected in blocks '
+                f'{segment.start_block}-{segment.end_block}; expected 0'
+            )
 
-    # Add profit from the last snapshot to the current on-chain PPS.
-    net_profit += previous_shares * (current_pps - previous_pps) // scale
 
+def apply_performance_fee(net_profit: int, performance_fee_bps: int) -> Tuple[int, int]:
+    # Gross up net profit by the performance fee; returns (gross_profit, total_fees).
     basis_points = 10000
     gross_profit = net_profit
     total_fees = 0
     if net_profit > 0 and basis_points > performance_fee_bps:
         gross_profit = net_profit * basis_points // (basis_points - performance_fee_bps)
         total_fees = gross_profit - net_profit
+    return gross_profit, total_fees
+
+
+def _cumulative_profit_numpy(balances: LimbColumn, pps: List[int], scale: int) -> List[int]:
+    count = len(pps)
+    prices = np.array(pps, dtype=np.int64 if max(pps) < INT64_LIMIT else object)
+    deltas = np.zeros(count, dtype=prices.dtype)
+    deltas[1:] = np.diff(prices)
+    low = np.frombuffer(balances.lo, dtype=np.uint64)
+    high = np.frombuffer(balances.hi, dtype=np.uint64)
+    split_limbs = bool(balances.wide) or bool(high.any())
+    if not split_limbs and prices.dtype == np.int64 and int(low.max()) < INT64_LIMIT:
+        max_step = int(low.max()) * int(np.abs(deltas).max())
+        if max_step < INT64_LIMIT and (max_step // scale + 1) * count < INT64_LIMIT:
+            # Every product and partial sum fits in int64; numpy floor_divide
+            # rounds toward -inf like Python's //.
+            previous_shares = np.zeros(count, dtype=np.int64)
+            previous_shares[1:] = low[:-1]
+            return np.cumsum(np.floor_divide(previous_shares * deltas, scale)).tolist()
+    # Object dtype keeps arbitrary-precision Python ints for 18-decimal amounts.
+    shares = low.astype(object)
+    if split_limbs:
+        shares += high.astype(object) * (1 << 64)
+        for index, value in balances.wide.items():
+            shares[index] = value
+    previous_shares = np.zeros(count, dtype=object)
+    previous_shares[1:] = shares[:-1]
+    return np.cumsum(previous_shares * deltas.astype(object) // scale).tolist()
+
+
+def cumulative_incremental_profit(
+    balances: LimbColumn,
+    pps: List[int],
+    scale: int,
+    initial: int = 0,
+) -> List[int]:
+    # Profit after each event: the balance held since the previous event times
+    # that interval's PPS change, floored per interval.
+    if HAS_NUMPY and len(pps) >= VECTORIZE_MIN_EVENTS:
+        cumulative = _cumulative_profit_numpy(balances, pps, scale)
+        return [initial + profit for profit in cumulative] if initial else cumulative
+    cumulative = []
+    profit = initial
+    previous_shares = 0
+    previous_pps = pps[0] if pps else 0
+    for balance, snapshot_pps in zip(balances, pps):
+        profit += previous_shares * (snapshot_pps - previous_pps) // scale
+        previous_shares = balance
+        previous_pps = snapshot_pps
+        cumulative.append(profit)
+    return cumulative
+
+
+def calculate_incremental_profit_and_fees(position: PositionResult, performance_fee_bps: int) -> Dict[str, int]:
+    gross_profit, total_fees = apply_performance_fee(position.net_profit, performance_fee_bps)
 
     return {
-        'net_profit': net_profit,
+        'net_profit': position.net_profit,
         'gross_profit': gross_profit,
         'total_fees': total_fees,
-        'effective_shares': current_shares,
+        'effective_shares': position.state.current_shares,
+    }
+
+
+def calculate_fee_weighted_profit(
+    ctx: VaultContext,
+    position: PositionResult,
+    segments: List[FeeSegment],
+    current_pps: int,
+    decimals: int,
+) -> Tuple[Dict[str, int], List[FeeSegmentProfit]]:
+    # Same incremental profit as calculate_position, split at fee segment
+    # boundaries so each part is grossed up at the rate in force.
+    scale = 10 ** decimals
+    prefetch_price_per_share(ctx, [segment.end_block for segment in segments[:-1]])
+    segment_net = [0] * len(segments)
+    index = 0
+    previous_shares = 0
+    previous_pps = position.event_pps[0] if position.event_pps else current_pps
+
+    def close_segments_before(block_number: Optional[int]) -> None:
+        nonlocal index, previous_pps
+        while index < len(segments) - 1 and (block_number is None or segments[index].end_block < block_number):
+            boundary_pps = get_price_per_share_at_block(ctx, segments[index].end_block)
+            segment_net[index] += previous_shares * (boundary_pps - previous_pps) // scale
+            previous_pps = boundary_pps
+            index += 1
+
+    for block_number, balance, snapshot_pps in zip(position.timeline.blocks, position.balances, position.event_pps):
+        close_segments_before(block_number)
+        segment_net[index] += previous_shares * (snapshot_pps - previous_pps) // scale
+        previous_shares = balance
+        previous_pps = snapshot_pps
+
+    close_segments_before(None)
+    segment_net[index] += previous_shares * (current_pps - previous_pps) // scale
+
+    breakdown = []
+    for segment, net_profit in zip(segments, segment_net):
+        gross_profit, total_fees = apply_performance_fee(net_profit, segment.performance_fee_bps)
+        breakdown.append(FeeSegmentProfit(segment, net_profit, gross_profit, total_fees))
+    totals = {
+        'net_profit': sum(item.net_profit for item in breakdown),
+        'gross_profit': sum(item.gross_profit for item in breakdown),
+        'total_fees': sum(item.total_fees for item in breakdown),
+        'effective_shares': position.state.current_shares,
+    }
+    return totals, breakdown
+
+
+def _apply_holder_share_change(
+    holder: HolderState,
+    block_number: int,
+    timestamp: Optional[int],
+    pps: int,
+    scale: int,
+) -> None:
+    # Accrue profit on the shares held since the holder's previous event, as in
+    # calculate_incremental_profit_and_fees, before the balance changes.
+    holder.net_profit += holder.shares * (pps - holder.last_pps) // scale
+    holder.last_pps = pps
+    holder.last_block = block_number
+    if holder.first_block is None:
+        holder.first_block = block_number
+        holder.first_timestamp = timestamp
+
+
+def _remove_holder_cost_basis(holder: HolderState, shares: int) -> None:
+    if holder.cost_basis_shares > 0:
+        remove_shares = min(shares, holder.cost_basis_shares)
+        removed_assets = (holder.cost_basis_assets * remove_shares) // holder.cost_basis_shares
+        holder.cost_basis_shares -= remove_shares
+        holder.cost_basis_assets -= removed_assets
+
+
+def replay_vault_holders(
+    ctx: VaultContext,
+    events: Iterable[Tuple[int, int, str, Dict[str, Any]]],
+    chunk_size: int = 5000,
+) -> Dict[str, HolderState]:
+    # Single pass over a vault's share events keeping every holder's balance,
+    # cost basis and incremental profit. Events are processed in chunks so the
+    # PPS of each chunk's blocks can be prefetched in one batch.
+    scale = 10 ** ctx.decimals
+    holders: Dict[str, HolderState] = {}
+
+    def holder_for(address: str) -> HolderState:
+        key = address.lower()
+        holder = holders.get(key)
+        if holder is None:
+            holder = holders[key] = HolderState()
+        return holder
+
+    def track_peak(holder: HolderState, block_number: int, pps: int) -> None:
+        if holder.shares > holder.peak_shares:
+            holder.peak_shares = holder.shares
+            holder.peak_shares_block = block_number
+            holder.peak_value = holder.shares * pps // scale
+
+    iterator = iter(events)
+    while True:
+        chunk = [item for _, item in zip(range(chunk_size), iterator)]
+        if not chunk:
+            break
+        prefetch_price_per_share(ctx, [block for block, _, _, _ in chunk])
+        for block_number, _, kind, row in chunk:
+            pps = get_price_per_share_at_block(ctx, block_number)
+            timestamp = row.get('blockTimestamp')
+            if kind == 'deposit':
+                holder = holder_for(row['owner'])
+                _apply_holder_share_change(holder, block_number, timestamp, pps, scale)
+                shares = int(row['shares'])
+                assets = int(row['assets'])
+                holder.shares += shares
+                holder.total_deposited += assets
+                holder.cost_basis_shares += shares
+                holder.cost_basis_assets += assets
+                holder.deposits += 1
+                track_peak(holder, block_number, pps)
+            elif kind == 'withdraw':
+                holder = holder_for(row['owner'])
+                _apply_holder_share_change(holder, block_number, timestamp, pps, scale)
+                shares = int(row['shares'])
+                holder.shares -= shares
+                holder.total_withdrawn += int(row['assets'])
+                _remove_holder_cost_basis(holder, shares)
+                holder.withdrawals += 1
+                track_peak(holder, block_number, pps)
+            elif kind == 'transfer':
+                if is_self_transfer(row['sender'], row['receiver']):
+                    continue
+                value = int(row['value'])
+                sender = holder_for(row['sender'])
+                _apply_holder_share_change(sender, block_number, timestamp, pps, scale)
+                transfer_value = value * pps // scale
+                sender.shares -= value
+                sender.net_transfer_value -= transfer_value
+                _remove_holder_cost_basis(sender, value)
+                sender.transfers += 1
+                track_peak(sender, block_number, pps)
+                receiver = holder_for(row['receiver'])
+                _apply_holder_share_change(receiver, block_number, timestamp, pps, scale)
+                receiver.shares += value
+                # Transfers are valued at the PPS of the transfer block.
+                receiver.net_transfer_value += transfer_value
+                receiver.cost_basis_shares += value
+                receiver.cost_basis_assets += transfer_value
+                receiver.transfers += 1
+                track_peak(receiver, block_number, pps)
+    return holders
+
+
+def _summary_record(
+    ctx: VaultContext,
+    depositor: str,
+    *,
+    current_shares: int,
+    current_value: int,
+    total_deposited: int,
+    total_withdrawn: int,
+    net_transfer_value: int,
+    weighted_avg_entry_pps: int,
+    current_pps: int,
+    net_profit: int,
+    gross_profit: int,
+    total_fees: int,
+    performance_fee_bps: int,
+    peak_shares: int,
+    peak_shares_block: int,
+    peak_value: Optional[int],
+    first_interaction_block: Optional[int],
+    first_interaction_timestamp: Optional[int],
+    deposits: int,
+    withdrawals: int,
+    transfers: int,
+) -> Dict[str, Any]:
+    # The SUMMARY_FIELDS record shared by single-depositor and all-holder
+    # reports. Token amounts are decimal strings so JSON keeps full precision.
+    net_deposited = total_deposited - total_withdrawn
+    return {
+        'depositor': depositor,
+        'vault': ctx.address,
+        'chain_id': ctx.chain_id,
+        'symbol': ctx.symbol,
+        'decimals': ctx.decimals,
+        'current_shares': str(current_shares),
+        'current_value': str(current_value),
+        'total_deposited': str(total_deposited),
+        'total_withdrawn': str(total_withdrawn),
+        'net_deposited': str(net_deposited),
+        'transfer_adjusted_net': str(net_deposited + net_transfer_value),
+        'weighted_avg_entry_pps': str(weighted_avg_entry_pps),
+        'current_pps': str(current_pps),
+        'net_profit': str(net_profit),
+        'gross_profit': str(gross_profit),
+        'total_fees': str(total_fees),
+        'performance_fee_bps': performance_fee_bps,
+        'peak_shares': str(peak_shares),
+        'peak_shares_block': peak_shares_block,
+        'peak_value': str(peak_value) if peak_value is not None else None,
+        'first_interaction_block': first_interaction_block,
+        'first_interaction_timestamp': first_interaction_timestamp,
+        'deposits': deposits,
+        'withdrawals': withdrawals,
+        'transfers': transfers,
+        'events': deposits + withdrawals + transfers,
     }
 
 
+def holder_state_to_dict(
+    ctx: VaultContext,
+    address: str,
+    holder: HolderState,
+    current_pps: int,
+    performance_fee_bps: int,
+) -> Dict[str, Any]:
+    scale = 10 ** ctx.decimals
+    net_profit = holder.net_profit + holder.shares * (current_pps - holder.last_pps) // scale
+    gross_profit, total_fees = apply_performance_fee(net_profit, performance_fee_bps)
+    if holder.cost_basis_shares > 0:
+        weighted_avg_entry_pps = holder.cost_basis_assets * scale // holder.cost_basis_shares
+    else:
+        weighted_avg_entry_pps = 0
+    return _summary_record(
+        ctx,
+        address,
+        current_shares=holder.shares,
+        current_value=holder.shares * current_pps // scale,
+        total_deposited=holder.total_deposited,
+        total_withdrawn=holder.total_withdrawn,
+        net_transfer_value=holder.net_transfer_value,
+        weighted_avg_entry_pps=weighted_avg_entry_pps,
+        current_pps=current_pps,
+        net_profit=net_profit,
+        gross_profit=gross_profit,
+        total_fees=total_fees,
+        performance_fee_bps=performance_fee_bps,
+        peak_shares=holder.peak_shares,
+        peak_shares_block=holder.peak_shares_block,
+        peak_value=holder.peak_value,
+        first_interaction_block=holder.first_block,
+        first_interaction_timestamp=holder.first_timestamp,
+        deposits=holder.deposits,
+        withdrawals=holder.withdrawals,
+        transfers=holder.transfers,
+    )
+
+
+@dataclass
+class VaultAccountingState:
+    # Mirrors the VaultV3 storage that pricePerShare depends on.
+    total_assets: int = 0
+    total_supply: int = 0
+    locked_shares: int = 0
+    profit_unlocking_rate: int = 0
+    full_profit_unlock_date: int = 0
+    last_profit_update: int = 0
+    profit_max_unlock_time: int = 0
+
+    def unlocked_shares(self, timestamp: int) -> int:
+        if self.full_profit_unlock_date > timestamp:
+            return self.profit_unlocking_rate * (timestamp - self.last_profit_update) // MAX_BPS_EXTENDED
+        if self.full_profit_unlock_date != 0:
+            return self.locked_shares
+        return 0
+
+    def effective_supply(self, timestamp: int) -> int:
+        return self.total_supply - self.unlocked_shares(timestamp)
+
+    def price_per_share(self, timestamp: int, decimals: int) -> int:
+        one_share = 10 ** decimals
+        supply = self.effective_supply(timestamp)
+        if supply == 0:
+            return one_share
+        return one_share * self.total_assets // supply
+
+
+@dataclass
+class VaultPpsModel:
+    # State at the end of every block with a vault accounting event.
+    # debt_decrease_blocks are where a strategy's debt was pulled back, the
+    # usual place for a loss the events do not show.
+    blocks: List[int]
+    states: List[VaultAccountingState]
+    block_timestamps: Dict[int, int]
+    decimals: int
+    debt_decrease_blocks: List[int] = field(default_factory=list)
+
+    def state_at(self, block_number: int) -> VaultAccountingState:
+        index = bisect.bisect_right(self.blocks, block_number) - 1
+        return self.states[index] if index >= 0 else VaultAccountingState()
+
+
+def iter_vault_accounting_events(
+    vault_address: str,
+    chain_id: int,
+    unlock_time_rows: List[Dict[str, Any]],
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+) -> Iterator[Tuple[int, int, str, Dict[str, Any]]]:
+    # Every event that moves totalAssets, totalSupply or the vault's locked
+    # shares, plus debt updates, merged in (block, log) order.
+    vault = vault_address.lower()
+    streams = []
+    for kind, entity, fields, extra_filter, extra_variables in (
+        ('deposit', 'Deposit', ['assets'], '', {}),
+        ('withdraw', 'Withdraw', ['assets'], '', {}),
+        ('mint', 'Transfer', ['receiver', 'value'], 'sender: { _eq: $zeroAddress }', {'zeroAddress': ZERO_ADDRESS}),
+        ('burn', 'Transfer', ['sender', 'value'], 'receiver: { _eq: $zeroAddress }', {'zeroAddress': ZERO_ADDRESS}),
+        (
+            'lock',
+            'Transfer',
+            ['value'],
+            'sender: { _neq: $zeroAddress }\n      receiver: { _eq: $vaultAddress }',
+            {'zeroAddress': ZERO_ADDRESS},
+        ),
+        ('report', 'StrategyReported', ['gain', 'loss', 'total_refunds'], '', {}),
+        ('debt', 'DebtUpdated', ['current_debt', 'new_debt'], '', {}),
+    ):
+        filters = 'vaultAddress: { _eq: $vaultAddress }'
+        definitions = '$vaultAddress: String!'
+        if extra_filter:
+            filters += f'\n      {extra_filter}'
+        if extra_variables:
+            definitions += ', $zeroAddress: String!'
+        pages = iter_envio_event_pages(
+            f'GetVault{kind.title()}AccountingPage',
+            entity,
+            filters,
+            definitions,
+            {'vaultAddress': vault, **extra_variables},
+            [*fields, 'blockTimestamp'],
+            chain_id,
+            page_size,
+        )
+        streams.append(_tag_event_rows(pages, kind))
+    streams.append(_tag_event_rows([unlock_time_rows], 'unlock_time'))
+    return heapq.merge(*streams, key=lambda item: (item[0], item[1]))
+
+
+def fetch_profit_max_unlock_time_updates(
+    vault_address: str,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for page in iter_envio_event_pages(
+        'GetVaultUnlockTimeUpdatesPage',
+        'UpdateProfitMaxUnlockTime',
+        'vaultAddress: { _eq: $vaultAddress }',
+        '$vaultAddress: String!',
+        {'vaultAddress': vault_address.lower()},
+        ['profit_max_unlock_time', 'blockTimestamp'],
+        chain_id,
+        page_size,
+    ):
+        rows.extend(page)
+    return rows
+
+
+def replay_vault_accounting(
+    events: Iterable[Tuple[int, int, str, Dict[str, Any]]],
+    vault_address: str,
+    initial_profit_max_unlock_time: int,
+    decimals: int,
+) -> VaultPpsModel:
+    # Follows VaultV3._process_report: shares minted to or burned from the vault
+    # in a report encode shares_to_lock - shares_to_burn - unlocked, and the new
+    # unlocking schedule is derived from that and the vault's share balance.
+    # A debt update only moves assets between idle and debt, unless the
+    # strategy returns less than the debt it gives back; that loss is in no
+    # event, so those blocks are recorded for validate_vault_pps_model.
+    vault = vault_address.lower()
+    state = VaultAccountingState(profit_max_unlock_time=initial_profit_max_unlock_time)
+    model = VaultPpsModel(blocks=[], states=[], block_timestamps={}, decimals=decimals)
+    current_block: Optional[int] = None
+    report_lock_delta = 0
+
+    for block_number, _, kind, row in events:
+        if block_number != current_block:
+            if current_block is not None:
+                model.blocks.append(current_block)
+                model.states.append(replace(state))
+            current_block = block_number
+            report_lock_delta = 0
+        timestamp = int(row['blockTimestamp'])
+        model.block_timestamps[block_number] = timestamp
+
+        if kind == 'deposit':
+            state.total_assets += int(row['assets'])
+        elif kind == 'withdraw':
+            state.total_assets -= int(row['assets'])
+        elif kind == 'mint':
+            value = int(row['value'])
+            state.total_supply += value
+            if row['receiver'].lower() == vault:
+                state.locked_shares += value
+                report_lock_delta += value
+        elif kind == 'burn':
+            value = int(row['value'])
+            state.total_supply -= value
+            if row['sender'].lower() == vault:
+                state.locked_shares -= value
+                report_lock_delta -= value
+        elif kind == 'lock':
+            state.locked_shares += int(row['value'])
+        elif kind == 'report':
+            state.total_assets += int(row['gain']) - int(row['loss']) + int(row['total_refunds'])
+            before = replace(state, locked_shares=state.locked_shares - report_lock_delta)
+            shares_to_lock = max(report_lock_delta + before.unlocked_shares(timestamp), 0)
+            if state.locked_shares > 0:
+                previously_locked_time = 0
+                if state.full_profit_unlock_date > timestamp:
+                    previously_locked_time = (
+                        (state.locked_shares - shares_to_lock) * (state.full_profit_unlock_date - timestamp)
+                    )
+                period = (
+                    previously_locked_time + shares_to_lock * state.profit_max_unlock_time
+                ) // state.locked_shares
+                if period > 0:
+                    state.profit_unlocking_rate = state.locked_shares * MAX_BPS_EXTENDED // period
+                    state.full_profit_unlock_date = timestamp + period
+                    state.last_profit_update = timestamp
+                else:
+                    state.full_profit_unlock_date = 0
+            else:
+                state.full_profit_unlock_date = 0
+            report_lock_delta = 0
+        elif kind == 'debt':
+            if int(row['new_debt']) < int(row['current_debt']) and model.debt_decrease_blocks[-1:] != [block_number]:
+                model.debt_decrease_blocks.append(block_number)
+        elif kind == 'unlock_time':
+            state.profit_max_unlock_time = int(row['profit_max_unlock_time'])
+            if state.profit_max_unlock_time == 0:
+                # setProfitMaxUnlockTime(0) burns the locked shares (seen as a burn above).
+                state.profit_unlocking_rate = 0
+                state.full_profit_unlock_date = 0
+            report_lock_delta = 0
+
+    if current_block is not None:
+        model.blocks.append(current_block)
+        model.states.append(replace(state))
+    return model
+
+
+def model_price_per_share(ctx: VaultContext, block_number: int) -> int:
+    assert ctx.pps_model is not None
+    timestamp = ctx.pps_model.block_timestamps.get(block_number)
+    if timestamp is None:
+        timestamp = int(get_block_timestamp(ctx, block_number, exact=True).timestamp())
+    return ctx.pps_model.state_at(block_number).price_per_share(timestamp, ctx.pps_model.decimals)
+
+
+def _first_report_block(vault_address: str, chain_id: int, before_block: int) -> Optional[int]:
+    pages = iter_envio_event_pages(
+        'GetVaultFirstReport',
+        'StrategyReported',
+        'vaultAddress: { _eq: $vaultAddress }\n      blockNumber: { _lt: $beforeBlock }',
+        '$vaultAddress: String!, $beforeBlock: Int!',
+        {'vaultAddress': vault_address.lower(), 'beforeBlock': before_block},
+        [],
+        chain_id,
+        1,
+    )
+    first_page = next(iter(pages), [])
+    return first_page[0]['blockNumber'] if first_page else None
+
+
+def read_initial_profit_max_unlock_time(
+    ctx: VaultContext,
+    unlock_time_rows: List[Dict[str, Any]],
+    report_rows: Optional[List[Dict[str, Any]]] = None,
+) -> int:
+    # profitMaxUnlockTime is set at deployment without an event. With no
+    # updates the current value is the initial one. Otherwise it only matters
+    # to reports before the first update, and only then is it read at the
+    # block before that update, which needs an archive node.
+    if not unlock_time_rows:
+        return int(contract_call(ctx.rpc_url, ctx.address, PROFIT_MAX_UNLOCK_TIME_SELECTOR, None), 16)
+    first_update = unlock_time_rows[0]['blockNumber']
+    if report_rows is not None:
+        first_report = report_rows[0]['blockNumber'] if report_rows else None
+    else:
+        first_report = _first_report_block(ctx.address, ctx.chain_id, first_update)
+    if first_report is None or first_report >= first_update:
+        # Never used before the first update replaces it.
+        return int(unlock_time_rows[0]['profit_max_unlock_time'])
+    try:
+        return int(contract_call(ctx.rpc_url, ctx.address, PROFIT_MAX_UNLOCK_TIME_SELECTOR, first_update - 1), 16)
+    except (RuntimeError, ValueError) as exc:
+        raise RuntimeError(
+            f'profitMaxUnlockTime before its first update (block {first_update}) is not indexed '
+            f'and needs an archive RPC: {exc}'
+        )
+
+
+def build_vault_pps_model(ctx: VaultContext, page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE) -> VaultPpsModel:
+    unlock_time_rows = fetch_profit_max_unlock_time_updates(ctx.address, ctx.chain_id, page_size)
+    initial_unlock_time = read_initial_profit_max_unlock_time(ctx, unlock_time_rows)
+    events = iter_vault_accounting_events(ctx.address, ctx.chain_id, unlock_time_rows, page_size)
+    return replay_vault_accounting(events, ctx.address, initial_unlock_time, ctx.decimals)
+
+
+def validate_vault_pps_model(
+    ctx: VaultContext,
+    model: VaultPpsModel,
+    samples: int = PPS_VALIDATION_SAMPLES,
+) -> List[str]:
+    # Compares the model against on-chain reads at the chain head and at
+    # historical blocks (debt decreases first, then evenly spaced ones);
+    # historical samples are skipped without an archive node. Losses realised
+    # outside a report (a strategy returning less than its debt on a debt
+    # update or withdrawal) are the only unindexed changes to totalAssets and
+    # they only lower it, so a matching head proves none happened and a
+    # higher modelled totalAssets is reported as such.
+    head = rpc_call(ctx.rpc_url, 'eth_getBlockByNumber', ['latest', False])
+    head_block = int(head['number'], 16)
+    checks = [(head_block, int(head['timestamp'], 16))]
+    if samples > 0:
+        sampled = model.debt_decrease_blocks[-samples:]
+        if model.blocks:
+            step = max(len(model.blocks) // samples, 1)
+            sampled += [model.blocks[index] for index in range(step - 1, len(model.blocks), step)[:samples]]
+        for block_number in sorted(set(sampled)):
+            checks.append((block_number, model.block_timestamps[block_number]))
+
+    mismatches: List[str] = []
+    for block_number, timestamp in checks:
+        try:
+            reads = multicall(
+                ctx.rpc_url,
+                ctx.chain_id,
+                [
+                    (ctx.address, TOTAL_ASSETS_SELECTOR),
+                    (ctx.address, TOTAL_SUPPLY_SELECTOR),
+                    (ctx.address, PRICE_PER_SHARE_SELECTOR),
+                ],
+                block_number,
+            )
+        except RuntimeError as exc:
+            if block_number == head_block:
+                raise
+            logger.debug('Skipping PPS validation at block %d: %s', block_number, exc)
+            continue
+        if any(not value or value == '0x' for value in reads):
+            mismatches.append(f'block {block_number}: vault reads failed')
+            continue
+        total_assets, total_supply, price_per_share = (int(value, 16) for value in reads)
+        state = model.state_at(block_number)
+        expected = (
+            state.total_assets,
+            state.effective_supply(timestamp),
+            state.price_per_share(timestamp, model.decimals),
+        )
+        if expected[0] > total_assets:
+            mismatches.append(
+                f'block {block_number}: totalAssets {expected[0]} vs {total_assets}; '
+                f'{expected[0] - total_assets} of strategy losses realised outside reports are not in the indexed events'
+            )
+        elif expected != (total_assets, total_supply, price_per_share):
+            mismatches.append(
+                f'block {block_number}: totalAssets {expected[0]} vs {total_assets}, '
+                f'totalSupply {expected[1]} vs {total_supply}, '
+                f'pricePerShare {expected[2]} vs {price_per_share}'
+            )
+    return mismatches
+
+
+def attach_event_pps_model(ctx: VaultContext, pps_source: str, page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE) -> None:
+    if pps_source == 'rpc':
+        return
+    logger.info('Rebuilding pricePerShare history from indexed vault events...')
+    try:
+        model = build_vault_pps_model(ctx, page_size)
+        mismatches = validate_vault_pps_model(ctx, model)
+    except Exception as exc:
+        if pps_source == 'events':
+            raise RuntimeError(f'Could not rebuild pricePerShare from events: {exc}')
+        logger.warning('Could not rebuild pricePerShare from events (%s); using RPC reads', exc)
+        return
+    if mismatches:
+        details = '; '.join(mismatches)
+        if pps_source == 'events':
+            raise RuntimeError(f'Event-derived pricePerShare does not match on-chain state: {details}')
+        logger.warning('Event-derived pricePerShare does not match on-chain state (%s); using RPC reads', details)
+        return
+    logger.info('Event-derived pricePerShare matches on-chain state (%d blocks replayed)', len(model.blocks))
+    ctx.pps_model = model
+
+
+# Indexed events after which pricePerShare may differ: anything touching
+# totalAssets, totalSupply or the vault's locked shares.
+PPS_CHANGE_EVENT_QUERIES = (
+    ('Deposit', ''),
+    ('Withdraw', ''),
+    ('Transfer', 'sender: { _eq: $zeroAddress }'),
+    ('Transfer', 'receiver: { _eq: $zeroAddress }'),
+    ('Transfer', 'sender: { _eq: $vaultAddress }'),
+    ('Transfer', 'receiver: { _eq: $vaultAddress }'),
+    ('DebtUpdated', ''),
+    ('DebtPurchased', ''),
+    ('StrategyChanged', ''),
+    ('Shutdown', ''),
+)
+
+
+@dataclass
+class PpsChangePlan:
+    # Between two change blocks, pricePerShare only moves while profit is
+    # unlocking; unlock_ends bounds fullProfitUnlockDate after each change block.
+    start_block: int
+    end_block: int
+    change_blocks: List[int]
+    unlock_ends: List[int]
+    segment_values: Dict[int, int] = field(default_factory=dict)
+
+    def segment(self, block_number: int, timestamp: Optional[int]) -> Optional[int]:
+        if timestamp is None or not self.start_block <= block_number <= self.end_block:
+            return None
+        index = bisect.bisect_right(self.change_blocks, block_number) - 1
+        if index < 0 or timestamp < self.unlock_ends[index]:
+            return None
+        return index
+
+
+def _known_block_timestamp(ctx: VaultContext, block_number: int) -> Optional[int]:
+    cached = ctx.block_timestamp_cache.get(block_number)
+    return int(cached.timestamp()) if cached is not None else None
+
+
+def _iter_pps_change_blocks(
+    vault_address: str,
+    chain_id: int,
+    start_block: int,
+    end_block: int,
+    page_size: int,
+) -> Iterator[int]:
+    variables = {'vaultAddress': vault_address.lower(), 'zeroAddress': ZERO_ADDRESS, 'endBlock': end_block}
+    for entity, extra_filter in PPS_CHANGE_EVENT_QUERIES:
+        filters = 'vaultAddress: { _eq: $vaultAddress }\n      blockNumber: { _lte: $endBlock }'
+        if extra_filter:
+            filters += f'\n      {extra_filter}'
+        for page in iter_envio_event_pages(
+            f'GetVault{entity}ChangesPage',
+            entity,
+            filters,
+            '$vaultAddress: String!, $zeroAddress: String!, $endBlock: Int!',
+            variables,
+            [],
+            chain_id,
+            page_size,
+            (start_block, MAX_LOG_INDEX),
+        ):
+            for row in page:
+                yield row['blockNumber']
+
+
+def build_pps_change_plan(
+    ctx: VaultContext,
+    start_block: int,
+    end_block: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+) -> PpsChangePlan:
+    # Reports and unlock-time updates are read over the whole history (they
+    # bound the unlock window); other change events only inside the range.
+    unlock_time_rows = fetch_profit_max_unlock_time_updates(ctx.address, ctx.chain_id, page_size)
+    report_rows: List[Dict[str, Any]] = []
+    for page in iter_envio_event_pages(
+        'GetVaultReportTimesPage',
+        'StrategyReported',
+        'vaultAddress: { _eq: $vaultAddress }\n      blockNumber: { _lte: $endBlock }',
+        '$vaultAddress: String!, $endBlock: Int!',
+        {'vaultAddress': ctx.address.lower(), 'endBlock': end_block},
+        ['blockTimestamp'],
+        ctx.chain_id,
+        page_size,
+    ):
+        report_rows.extend(page)
+    unlock_time = read_initial_profit_max_unlock_time(ctx, unlock_time_rows, report_rows)
+
+    change_blocks = {start_block}
+    change_blocks.update(_iter_pps_change_blocks(ctx.address, ctx.chain_id, start_block, end_block, page_size))
+    timeline = heapq.merge(
+        _tag_event_rows([report_rows], 'report'),
+        _tag_event_rows([unlock_time_rows], 'unlock_time'),
+        key=lambda item: (item[0], item[1]),
+    )
+    # The vault can be fully unlocked no later than the latest report time plus
+    # the unlock time in force, since each new period averages old and new locks.
+    unlock_end = 0
+    unlock_end_by_block: Dict[int, int] = {}
+    for block_number, _, kind, row in timeline:
+        if kind == 'unlock_time':
+            unlock_time = int(row['profit_max_unlock_time'])
+        else:
+            unlock_end = max(unlock_end, int(row['blockTimestamp']) + unlock_time)
+        unlock_end_by_block[block_number] = unlock_end
+        if block_number >= start_block:
+            change_blocks.add(block_number)
+
+    ordered = sorted(change_blocks)
+    history = sorted(unlock_end_by_block.items())
+    history_blocks = [block_number for block_number, _ in history]
+    unlock_ends = []
+    for block_number in ordered:
+        index = bisect.bisect_right(history_blocks, block_number) - 1
+        unlock_ends.append(history[index][1] if index >= 0 else 0)
+    return PpsChangePlan(start_block, end_block, ordered, unlock_ends)
+
+
+def ensure_pps_change_plan(
+    ctx: VaultContext,
+    start_block: int,
+    end_block: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+) -> None:
+    plan = ctx.pps_change_plan
+    if plan is not None and plan.start_block <= start_block and end_block <= plan.end_block:
+        return
+    if plan is not None:
+        start_block = min(start_block, plan.start_block)
+        end_block = max(end_block, plan.end_block)
+    ctx.pps_change_plan = build_pps_change_plan(ctx, start_block, end_block, page_size)
+
+
+def static_price_per_share(ctx: VaultContext, block_number: int) -> Optional[int]:
+    plan = ctx.pps_change_plan
+    if plan is None:
+        return None
+    segment = plan.segment(block_number, _known_block_timestamp(ctx, block_number))
+    return plan.segment_values.get(segment) if segment is not None else None
+
+
+def remember_static_price_per_share(ctx: VaultContext, block_number: int, value: int) -> None:
+    plan = ctx.pps_change_plan
+    if plan is None:
+        return
+    segment = plan.segment(block_number, _known_block_timestamp(ctx, block_number))
+    if segment is not None:
+        plan.segment_values.setdefault(segment, value)
+
+
+def split_static_pps_blocks(ctx: VaultContext, blocks: List[int]) -> Tuple[List[int], Dict[int, int]]:
+    # Keeps one block per unchanged-PPS segment to read; the rest alias it.
+    plan = ctx.pps_change_plan
+    if plan is None:
+        return blocks, {}
+    to_read: List[int] = []
+    aliases: Dict[int, int] = {}
+    representatives: Dict[int, int] = {}
+    for block_number in blocks:
+        segment = plan.segment(block_number, _known_block_timestamp(ctx, block_number))
+        if segment is None:
+            to_read.append(block_number)
+        elif segment in plan.segment_values:
+            ctx.price_per_share_cache[block_number] = plan.segment_values[segment]
+        elif segment in representatives:
+            aliases[block_number] = representatives[segment]
+        else:
+            representatives[segment] = block_number
+            to_read.append(block_number)
+    return to_read, aliases
+
+
+def fill_static_pps_aliases(ctx: VaultContext, aliases: Dict[int, int]) -> None:
+    for block_number, representative in aliases.items():
+        if representative in ctx.price_per_share_cache:
+            ctx.price_per_share_cache[block_number] = ctx.price_per_share_cache[representative]
+
+
+class PpsSeriesIndex:
+    # Sorted (block, pricePerShare) pairs for final blocks of one vault, kept
+    # in typed arrays; values too large for uint64 fall back to a list.
+    def __init__(self, chain_id: int, vault_address: str, source: str = 'rpc') -> None:
+        self.chain_id = chain_id
+        self.vault_address = vault_address.lower()
+        self.source = source
+        self.through_block = -1
+        self.blocks = array.array('Q')
+        self.values: Any = array.array('Q')
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def get(self, block_number: int) -> Optional[int]:
+        index = bisect.bisect_left(self.blocks, block_number)
+        if index < len(self.blocks) and self.blocks[index] == block_number:
+            return self.values[index]
+        return None
+
+    def extend(self, points: Iterable[Tuple[int, int]], through_block: int) -> None:
+        for block_number, value in sorted(points):
+            if block_number <= self.through_block or (self.blocks and block_number <= self.blocks[-1]):
+                continue
+            self.blocks.append(block_number)
+            try:
+                self.values.append(value)
+            except OverflowError:
+                self.values = list(self.values)
+                self.values.append(value)
+        self.through_block = max(self.through_block, through_block)
+
+
+def pps_index_path(cache_dir: str, chain_id: int, vault_address: str) -> str:
+    return os.path.join(cache_dir, PPS_INDEX_DIR, f'{chain_id}-{vault_address.lower()}.bin')
+
+
+def save_pps_index(cache_dir: str, index: PpsSeriesIndex) -> Optional[str]:
+    # One JSON header line, then the raw block and value arrays. A cache dir
+    # that cannot be written only costs the next run a rebuild.
+    path = pps_index_path(cache_dir, index.chain_id, index.vault_address)
+    typed = isinstance(index.values, array.array)
+    header = {
+        'version': PPS_INDEX_VERSION,
+        'chain_id': index.chain_id,
+        'vault': index.vault_address,
+        'source': index.source,
+        'through_block': index.through_block,
+        'count': len(index),
+        'byteorder': sys.byteorder,
+        'values': 'Q' if typed else 'json',
+    }
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'wb') as handle:
+            handle.write(json.dumps(header).encode('utf-8') + b'\n')
+            index.blocks.tofile(handle)
+            if typed:
+                index.values.tofile(handle)
+            else:
+                handle.write(json.dumps([str(value) for value in index.values]).encode('utf-8'))
+        os.replace(temp_path, path)
+    except OSError as exc:
+        logger.warning('Could not save PPS index %s: %s', path, exc)
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return None
+    return path
+
+
+def load_pps_index(cache_dir: str, chain_id: int, vault_address: str) -> Optional[PpsSeriesIndex]:
+    path = pps_index_path(cache_dir, chain_id, vault_address)
+    try:
+        with open(path, 'rb') as handle:
+            header = json.loads(handle.readline())
+            if (
+                header.get('version') != PPS_INDEX_VERSION
+                or header.get('chain_id') != chain_id
+                or header.get('vault') != vault_address.lower()
+            ):
+                return None
+            count = int(header['count'])
+            index = PpsSeriesIndex(chain_id, vault_address, header.get('source', 'rpc'))
+            index.blocks.fromfile(handle, count)
+            if header['values'] == 'Q':
+                index.values.fromfile(handle, count)
+            else:
+                index.values = [int(value) for value in json.loads(handle.read())]
+                if len(index.values) != count:
+                    raise ValueError('value count mismatch')
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, EOFError) as exc:
+        logger.warning('Ignoring unreadable PPS index %s: %s', path, exc)
+        return None
+    if header.get('byteorder') != sys.byteorder:
+        index.blocks.byteswap()
+        if isinstance(index.values, array.array):
+            index.values.byteswap()
+    index.through_block = int(header['through_block'])
+    return index
+
+
+def build_pps_index(
+    ctx: VaultContext,
+    cache_dir: str,
+    *,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+) -> PpsSeriesIndex:
+    # Prices every vault event block up to the finalized block, extending an
+    # existing index from where it stopped.
+    safe_block = ctx.safe_block if ctx.safe_block is not None else get_safe_block(ctx.rpc_url, ctx.chain_id)
+    if safe_block is None or safe_block < 0:
+        raise RuntimeError('Cannot build a PPS index without a finalized block')
+    source = 'events' if ctx.pps_model is not None else 'rpc'
+    index = ctx.pps_index or PpsSeriesIndex(ctx.chain_id, ctx.address, source)
+    ctx.pps_index = None
+
+    after = (index.through_block, MAX_LOG_INDEX) if index.through_block >= 0 else (-1, -1)
+    blocks = sorted({
+        block_number
+        for block_number, _, _, _ in iter_vault_share_events(ctx.address, ctx.chain_id, page_size, after)
+        if block_number <= safe_block
+    })
+    logger.info('Pricing %d new vault event blocks up to block %d...', len(blocks), safe_block)
+    for start in range(0, len(blocks), PPS_INDEX_BUILD_CHUNK):
+        chunk = blocks[start:start + PPS_INDEX_BUILD_CHUNK]
+        prefetch_chain_reads(ctx, pps_blocks=chunk)
+        index.extend(((block, get_price_per_share_at_block(ctx, block)) for block in chunk), index.through_block)
+    index.through_block = max(index.through_block, safe_block)
+    path = save_pps_index(cache_dir, index)
+    logger.info(
+        'PPS index for %s holds %d blocks through %d (%s)',
+        ctx.address,
+        len(index),
+        index.through_block,
+        path or 'not saved',
+    )
+    ctx.pps_index = index
+    return index
+
+
 def sample_series(series: List[Dict[str, int]], max_points: int) -> List[Dict[str, int]]:
     if len(series) <= max_points:
         return series
@@ -897,49 +3963,27 @@ def sample_series(series: List[Dict[str, int]], max_points: int) -> List[Dict[st
     return sampled
 
 
-def prepare_balance_profit_series(
-    ctx: VaultContext,
-    snapshots: List[PositionSnapshot],
-    decimals: int,
-    current_pps: int,
-    current_shares: int,
-) -> List[Dict[str, int]]:
-    if not snapshots:
+def prepare_balance_profit_series(ctx: VaultContext, position: PositionResult) -> List[Dict[str, int]]:
+    blocks = position.timeline.blocks
+    if not blocks:
         return []
-    scale = 10 ** decimals
-    series: List[Dict[str, int]] = []
-    profit = 0
-    previous_shares = 0
-    previous_pps = get_price_per_share_at_block(ctx, snapshots[0].block_number)
-
-    # Mirror the incremental profit calc so the plot matches fee math.
-    for snapshot in snapshots:
-        snapshot_pps = get_price_per_share_at_block(ctx, snapshot.block_number)
-        delta_pps = snapshot_pps - previous_pps
-        profit += previous_shares * delta_pps // scale
-        previous_shares = snapshot.shares_balance
-        previous_pps = snapshot_pps
-        series.append({
-            'block': snapshot.block_number,
-            'shares': snapshot.shares_balance,
-            'profit': profit,
-        })
-
-    # Extend the series to "now" with the current PPS.
-    profit += previous_shares * (current_pps - previous_pps) // scale
+    # The position pass already computed the incremental profit the fee math uses.
+    series: List[Dict[str, int]] = [
+        {'block': block_number, 'shares': balance, 'profit': profit}
+        for block_number, balance, profit in zip(blocks, position.balances, position.cumulative_profit)
+    ]
 
     # Add the current state as a final data point (block is best-effort).
     try:
-        current_block_hex = rpc_call(ctx.rpc_url, 'eth_blockNumber', [])
-        current_block = int(current_block_hex, 16)
+        current_block = read_head_block(ctx)
     except Exception:
-        # If RPC call fails, use last snapshot block + offset as approximation.
-        current_block = snapshots[-1].block_number + 1000
+        # If RPC call fails, use last event block + offset as approximation.
+        current_block = blocks[-1] + 1000
 
     series.append({
         'block': current_block,
-        'shares': current_shares,
-        'profit': profit,
+        'shares': position.state.current_shares,
+        'profit': position.net_profit,
     })
 
     return series
@@ -947,18 +3991,16 @@ def prepare_balance_profit_series(
 
 def plot_balance_profit(
     ctx: VaultContext,
-    snapshots: List[PositionSnapshot],
+    position: PositionResult,
     decimals: int,
-    current_pps: int,
-    current_shares: int,
     symbol: str,
 ) -> None:
-    if not snapshots:
+    if not position.timeline:
         return
     if not HAS_MATPLOTLIB:  # pragma: no cover
         logger.info('Install matplotlib (`pip install matplotlib`) to see the plot.')
         return
-    series = prepare_balance_profit_series(ctx, snapshots, decimals, current_pps, current_shares)
+    series = prepare_balance_profit_series(ctx, position)
     graph_series = sample_series(series, 300)
     blocks = [point['block'] for point in graph_series]
     shares = [point['shares'] / (10 ** decimals) for point in graph_series]
@@ -979,6 +4021,8 @@ def plot_balance_profit(
     ax.tick_params(axis='y', labelcolor='tab:blue')
     ax.grid(alpha=0.3)
 
+    # Axis dates only need day precision, so interpolate them from a few anchors.
+    refine_block_time_index(ctx, blocks)
     dates = [get_block_timestamp(ctx, block) for block in blocks]
 
     # Add a top x-axis for start/end dates plus quarterly markers.
@@ -1014,7 +4058,11 @@ def plot_balance_profit(
         while quarter_start < dates[-1]:
             target_ts = quarter_start.timestamp()
             idx = bisect.bisect_left(date_timestamps, target_ts)
-            if 0 < idx < len(date_timestamps):
+            block_at = ctx.block_time_index.block_at(target_ts) if ctx.block_time_index is not None else None
+            if block_at is not None and blocks[0] <= block_at <= blocks[-1]:
+                quarter = (quarter_start.month - 1) // 3 + 1
+                ticks.append((block_at, f'Q{quarter} {quarter_start.year}'))
+            elif 0 < idx < len(date_timestamps):
                 before_ts = date_timestamps[idx - 1]
                 after_ts = date_timestamps[idx]
                 if after_ts != before_ts:
@@ -1062,9 +4110,6 @@ def plot_balance_profit(
 def format_output(
     ctx: VaultContext,
     depositor_address: str,
-    deposits: List[DepositEvent],
-    withdrawals: List[WithdrawEvent],
-    transfers: List[TransferEvent],
     position: PositionResult,
     current_value: int,
     weighted_avg_entry_pps: int,
@@ -1075,26 +4120,19 @@ def format_output(
     first_interaction_block: Optional[int],
     peak_value: Optional[int],
     peak_date: Optional[datetime.datetime],
+    *,
+    fee_segments: Optional[List[FeeSegmentProfit]] = None,
+    plot: bool = True,
 ) -> None:
     net_profit = profit_and_fees['net_profit']
     gross_profit = profit_and_fees['gross_profit']
     total_fees = profit_and_fees['total_fees']
-    current_shares = position.current_shares
-    total_deposited = position.total_deposited
-    total_withdrawn = position.total_withdrawn
+    state = position.state
+    current_shares = state.current_shares
+    total_deposited = state.total_deposited
+    total_withdrawn = state.total_withdrawn
     net_deposited = total_deposited - total_withdrawn
-    transfers_in = [t for t in transfers if t.receiver.lower() == depositor_address.lower()]
-    transfers_out = [t for t in transfers if t.sender.lower() == depositor_address.lower()]
-    transfer_adjusted_net = net_deposited
-    scale = 10 ** ctx.decimals
-    for transfer in transfers:
-        shares = int(transfer.value)
-        pps = get_price_per_share_at_block(ctx, parse_event_id(transfer.id)[0])
-        assets = shares * pps // scale
-        if transfer.receiver.lower() == depositor_address.lower():
-            transfer_adjusted_net += assets
-        elif transfer.sender.lower() == depositor_address.lower():
-            transfer_adjusted_net -= assets
+    transfer_adjusted_net = net_deposited + state.net_transfer_value
 
     print('\n' + '=' * 80)
     print('YEARN V3 DEPOSITOR FEE & PROFIT ANALYSIS')
@@ -1117,18 +4155,18 @@ def format_output(
     print(f'Total Withdrawn:    {format_units_display(total_withdrawn, ctx.decimals)} {ctx.symbol}')
     print(f'Net Deposited:      {format_units_display(net_deposited, ctx.decimals)} {ctx.symbol}')
 
-    if position.peak_shares > 0:
+    if position.state.peak_shares > 0:
         print('\n📊 Peak Position:')
-        print(f'   Highest Shares:  {format_units_display(position.peak_shares, ctx.decimals)} shares')
+        print(f'   Highest Shares:  {format_units_display(position.state.peak_shares, ctx.decimals)} shares')
         if peak_value is not None:
             print(f'   Peak Value:      {format_units_display(peak_value, ctx.decimals)} {ctx.symbol}')
         if peak_date:
-            print(f'   Peak Date:       Block {position.peak_shares_block} ({format_date(peak_date)})')
+            print(f'   Peak Date:       Block {position.state.peak_shares_block} ({format_date(peak_date)})')
         else:
-            print(f'   Peak Block:      {position.peak_shares_block}')
+            print(f'   Peak Block:      {position.state.peak_shares_block}')
 
-        shares_diff = current_shares - position.peak_shares
-        shares_diff_pct = (shares_diff * 10000) // position.peak_shares if position.peak_shares else 0
+        shares_diff = current_shares - position.state.peak_shares
+        shares_diff_pct = (shares_diff * 10000) // position.state.peak_shares if position.state.peak_shares else 0
         if shares_diff < 0:
             print(f'   Change from peak: {format_units_display(-shares_diff, ctx.decimals)} shares lower ({abs(shares_diff_pct) / 100:.2f}%)')
         elif shares_diff == 0:
@@ -1162,56 +4200,801 @@ def format_output(
     if gross_profit > 0:
         fee_percentage = (total_fees * 10000) // gross_profit
         print(f'Fees as % of Gross:     {fee_percentage / 100:.2f}%')
+    if fee_segments:
+        # Segment bounds come from sampled fee config reads, so a change undone
+        # between two samples is missing; say so rather than imply exact rates.
+        print('Fees by Rate Segment (fee changes located from sampled config reads):')
+        for item in fee_segments:
+            segment = item.segment
+            print(
+                f'   Blocks {segment.start_block}-{segment.end_block} at {segment.performance_fee_bps / 100}%: '
+                f'{format_units_display(item.total_fees, ctx.decimals)} {ctx.symbol} fees on '
+                f'{format_units_display(item.net_profit, ctx.decimals)} {ctx.symbol} net profit'
+            )
 
     print('\nCalculation Method:')
     print('  • Weighted average entry PPS calculated from deposits and incoming transfers (transfers valued at the block PPS)')
     print('  • Net profit = (Current PPS - Entry PPS) × Current Shares')
-    print('  • Gross profit = Net profit / (1 - Fee Rate)')
+    if fee_segments:
+        print('  • Gross profit = Σ segment net profit / (1 - segment Fee Rate), segments from sampled fee config reads')
+    else:
+        print('  • Gross profit = Net profit / (1 - Fee Rate)')
     print('  • Fees = Gross profit - Net profit')
 
     print('\n📝 USER EVENTS')
     print('-' * 80)
-    print(f'Total Deposits:     {len(deposits)}')
-    print(f'Total Withdrawals:  {len(withdrawals)}')
-    print(f'Total Transfers:    {len(transfers)} (excluding mint/burn)')
-    print(f'  - Transfers IN:   {len(transfers_in)}')
-    print(f'  - Transfers OUT:  {len(transfers_out)}')
-    print(f'Total Events Processed: {len(position.user_events)}')
-
-    all_events = build_event_timeline(deposits, withdrawals, transfers, depositor_address)
-    if all_events:
+    print(f'Total Deposits:     {state.deposits}')
+    print(f'Total Withdrawals:  {state.withdrawals}')
+    print(f'Total Transfers:    {state.transfers_in + state.transfers_out} (excluding mint/burn)')
+    print(f'  - Transfers IN:   {state.transfers_in}')
+    print(f'  - Transfers OUT:  {state.transfers_out}')
+    timeline = position.timeline
+    print(f'Total Events Processed: {state.events}')
+
+    if timeline:
         print('\n  Events:')
-        for index, event in enumerate(all_events, start=1):
-            block = event.block_number
-            if event.type == 'deposit':
-                assets = int(event.data['assets'])
-                shares = int(event.data['shares'])
+        restored = state.events - len(timeline)
+        if restored:
+            print(f'    ({restored} earlier events restored from checkpoint)')
+        events = zip(timeline.types, timeline.blocks, timeline.shares, timeline.assets)
+        for index, (event_type, block, shares, assets) in enumerate(events, start=restored + 1):
+            if event_type == EVENT_DEPOSIT:
                 print(f'    {index}. Block {block}: Deposit {format_units_display(assets, ctx.decimals)} {ctx.symbol} → {format_units_display(shares, ctx.decimals)} shares')
-            elif event.type == 'withdraw':
-                assets = int(event.data['assets'])
-                shares = int(event.data['shares'])
+            elif event_type == EVENT_WITHDRAW:
                 print(f'    {index}. Block {block}: Withdraw {format_units_display(shares, ctx.decimals)} shares → {format_units_display(assets, ctx.decimals)} {ctx.symbol}')
-            elif event.type == 'transfer_in':
-                value = int(event.data['value'])
-                print(f'    {index}. Block {block}: Transfer IN {format_units_display(value, ctx.decimals)} shares')
-            elif event.type == 'transfer_out':
-                value = int(event.data['value'])
-                print(f'    {index}. Block {block}: Transfer OUT {format_units_display(value, ctx.decimals)} shares')
+            elif event_type == EVENT_TRANSFER_IN:
+                print(f'    {index}. Block {block}: Transfer IN {format_units_display(shares, ctx.decimals)} shares')
+            else:
+                print(f'    {index}. Block {block}: Transfer OUT {format_units_display(shares, ctx.decimals)} shares')
 
     print('\n' + '=' * 80)
 
-    plot_balance_profit(ctx, position.snapshots, ctx.decimals, current_pps, current_shares, ctx.symbol)
+    if plot:
+        plot_balance_profit(ctx, position, ctx.decimals, ctx.symbol)
+
+
+
+class AsyncChainClient:
+    # asyncio front for the blocking RPC/GraphQL helpers. Coroutines run on the
+    # client's own event loop thread and calls on one worker pool; each
+    # endpoint URL gets its own semaphore, so one slow provider cannot starve
+    # another and no endpoint sees more than max_concurrency requests at a time.
+
+    def __init__(self, max_concurrency: int = DEFAULT_ENDPOINT_CONCURRENCY) -> None:
+        self.max_concurrency = max(max_concurrency, 1)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency * 4)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='chain-client', daemon=True)
+        self._thread.start()
+
+    def _semaphore(self, endpoint: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(endpoint)
+        if semaphore is None:
+            semaphore = self._semaphores[endpoint] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def call(self, endpoint: str, func: Callable[..., T], *args: Any) -> T:
+        async with self._semaphore(endpoint):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def rpc(self, rpc_url: str, method: str, params: List[Any]) -> Any:
+        return await self.call(rpc_url, rpc_call, rpc_url, method, params)
+
+    async def graphql(self, query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.call(envio_settings().graphql_url, query_envio_graphql, query, variables)
+
+    def submit(self, func: Callable[..., T], *args: Any) -> 'Future[T]':
+        return self._executor.submit(func, *args)
+
+    def run(self, build: Callable[['AsyncChainClient'], Any]) -> Any:
+        # Blocks until the coroutine built against this client finishes. It
+        # runs on the client's loop, so callers need no event loop of their
+        # own and may even be inside one.
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('AsyncChainClient.run called from its own event loop')
+
+        async def runner() -> Any:
+            return await build(self)
+
+        return asyncio.run_coroutine_threadsafe(runner(), self._loop).result()
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=True)
+
+
+async def fetch_price_per_share_async(client: AsyncChainClient, ctx: VaultContext, blocks: Iterable[int]) -> None:
+    pending = sorted({block for block in blocks if block not in ctx.price_per_share_cache})
+    pending, aliases = split_static_pps_blocks(ctx, pending)
+    if ctx.rpc_batch_size > 1 and len(pending) > 1:
+        # Each chunk is one JSON-RPC batch; chunks go out in parallel.
+        chunks = [pending[start:start + ctx.rpc_batch_size] for start in range(0, len(pending), ctx.rpc_batch_size)]
+        await asyncio.gather(
+            *(client.call(ctx.rpc_url, prefetch_price_per_share, ctx, chunk) for chunk in chunks),
+            return_exceptions=True,
+        )
+    # Whatever batching did not cover (disabled, rejected, single block) goes out as concurrent single calls.
+    remaining = [block for block in pending if block not in ctx.price_per_share_cache]
+    # Failures are left uncached and surface again from the synchronous caller.
+    await asyncio.gather(
+        *(client.call(ctx.rpc_url, get_price_per_share_at_block, ctx, block) for block in remaining),
+        return_exceptions=True,
+    )
+    fill_static_pps_aliases(ctx, aliases)
+
+
+async def fetch_block_timestamps_async(client: AsyncChainClient, ctx: VaultContext, blocks: Iterable[int]) -> None:
+    pending = sorted({block for block in blocks if block not in ctx.block_timestamp_cache})
+    await asyncio.gather(
+        *(client.call(ctx.rpc_url, functools.partial(get_block_timestamp, exact=True), ctx, block) for block in pending),
+        return_exceptions=True,
+    )
+
+
+async def fetch_fee_configs_async(
+    client: AsyncChainClient,
+    ctx: VaultContext,
+    vault_address: str,
+    blocks: Iterable[int],
+) -> None:
+    pending = sorted({block for block in blocks if (vault_address.lower(), block) not in ctx.fee_config_cache})
+    await asyncio.gather(
+        *(client.call(ctx.rpc_url, read_accountant_fee_config, ctx, vault_address, block) for block in pending),
+        return_exceptions=True,
+    )
+
+
+def chain_client(max_concurrency: int = DEFAULT_ENDPOINT_CONCURRENCY) -> AsyncChainClient:
+    # One client (loop thread and worker pool) per concurrency limit, reused for the whole run.
+    client = _CHAIN_CLIENTS.get(max_concurrency)
+    if client is None:
+        client = _CHAIN_CLIENTS[max_concurrency] = AsyncChainClient(max_concurrency)
+    return client
+
+
+def close_chain_clients() -> None:
+    clients = list(_CHAIN_CLIENTS.values())
+    _CHAIN_CLIENTS.clear()
+    for client in clients:
+        client.close()
+
+
+def run_with_chain_client(max_concurrency: int, build: Callable[[AsyncChainClient], Any]) -> Any:
+    # Synchronous facade: run coroutines built against the shared client and wait for them.
+    return chain_client(max_concurrency).run(build)
+
+
+def read_ahead(client: AsyncChainClient, items: Iterator[T], chunk_size: int, depth: int = 2) -> Iterator[T]:
+    # Drains items on a client worker into a bounded queue, so several paged
+    # streams fetch concurrently while at most depth chunks of each are held.
+    chunks: 'queue.Queue[Tuple[Optional[List[T]], Optional[BaseException]]]' = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def offer(entry: Tuple[Optional[List[T]], Optional[BaseException]]) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            chunk: List[T] = []
+            for item in items:
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    if not offer((chunk, None)):
+                        return
+                    chunk = []
+            if chunk and not offer((chunk, None)):
+                return
+            offer((None, None))
+        except BaseException as exc:
+            offer((None, exc))
+
+    client.submit(produce)
+    try:
+        while True:
+            chunk, error = chunks.get()
+            if error is not None:
+                raise error
+            if chunk is None:
+                return
+            yield from chunk
+    finally:
+        # Lets the worker go if the consumer stops early.
+        stop.set()
+
+
+def prefetch_chain_reads(
+    ctx: VaultContext,
+    *,
+    pps_blocks: Iterable[int] = (),
+    timestamp_blocks: Iterable[int] = (),
+    fee_config_blocks: Iterable[int] = (),
+) -> None:
+    # Warm the PPS, timestamp and fee-config caches concurrently; the calculators
+    # then run unchanged against the filled caches.
+    pps_blocks = list(pps_blocks)
+    timestamp_blocks = list(timestamp_blocks)
+    fee_config_blocks = list(fee_config_blocks)
+
+    async def build(client: AsyncChainClient) -> None:
+        await asyncio.gather(
+            fetch_price_per_share_async(client, ctx, pps_blocks),
+            fetch_block_timestamps_async(client, ctx, timestamp_blocks),
+            fetch_fee_configs_async(client, ctx, ctx.address, fee_config_blocks),
+        )
+
+    run_with_chain_client(ctx.max_concurrency, build)
+
+
+def fetch_depositor_event_streams(
+    depositor_address: str,
+    vault_address: Optional[str] = None,
+    *,
+    chain_id: int,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    max_concurrency: int = DEFAULT_ENDPOINT_CONCURRENCY,
+    after: Tuple[int, int] = (-1, -1),
+) -> Tuple[Iterator[DepositEvent], Iterator[WithdrawEvent], Iterator[TransferEvent]]:
+    # Same streams as fetch_depositor_events, but follow-up pages of the three
+    # result sets are fetched ahead in parallel while the caller consumes them.
+    client = chain_client(max_concurrency)
+    deposits, withdrawals, transfers = fetch_depositor_events(
+        depositor_address,
+        vault_address,
+        chain_id=chain_id,
+        page_size=page_size,
+        after=after,
+    )
+    return (
+        read_ahead(client, deposits, page_size),
+        read_ahead(client, withdrawals, page_size),
+        read_ahead(client, transfers, page_size),
+    )
+
 
+def is_valid_address(address: str) -> bool:
+    return address.startswith('0x') and len(address) == 42
+
+
+def checkpoint_path(cache_dir: str, chain_id: int, vault_address: str, depositor_address: str) -> str:
+    return os.path.join(
+        cache_dir,
+        CHECKPOINT_DIR,
+        f'{chain_id}-{vault_address.lower()}-{depositor_address.lower()}.json',
+    )
+
+
+def load_position_checkpoint(
+    cache_dir: str,
+    chain_id: int,
+    vault_address: str,
+    depositor_address: str,
+) -> Optional[PositionState]:
+    path = checkpoint_path(cache_dir, chain_id, vault_address, depositor_address)
+    try:
+        with open(path, encoding='utf-8') as handle:
+            data = json.load(handle)
+        if data.get('version') != CHECKPOINT_VERSION:
+            return None
+        values = {name: int(value) if value is not None else None for name, value in data['state'].items()}
+        return PositionState(**values)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as exc:
+        logger.warning('Ignoring unreadable checkpoint %s: %s', path, exc)
+        return None
+
+
+def save_position_checkpoint(
+    cache_dir: str,
+    chain_id: int,
+    vault_address: str,
+    depositor_address: str,
+    state: PositionState,
+) -> None:
+    # Amounts are stored as decimal strings so they survive any JSON reader.
+    path = checkpoint_path(cache_dir, chain_id, vault_address, depositor_address)
+    payload = {
+        'version': CHECKPOINT_VERSION,
+        'chain_id': chain_id,
+        'vault': vault_address.lower(),
+        'depositor': depositor_address.lower(),
+        'state': {name: str(value) if value is not None else None for name, value in vars(state).items()},
+    }
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(payload, handle)
+        os.replace(temp_path, path)
+    except OSError as exc:
+        logger.warning('Could not save checkpoint %s: %s', path, exc)
+
+
+def create_vault_context(
+    vault_address: str,
+    chain_id: int,
+    *,
+    rpc_batch_size: int = DEFAULT_RPC_BATCH_SIZE,
+    max_concurrency: int = DEFAULT_ENDPOINT_CONCURRENCY,
+    rpc_retries: int = DEFAULT_RPC_RETRIES,
+    rpc_hedge_delay: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_mb: int = DEFAULT_CHAIN_CACHE_MAX_MB,
+) -> Tuple[VaultContext, int]:
+    endpoints = select_rpc_endpoints(chain_id, cache_dir)
+    rpc_url = endpoints[0].url
+    register_rpc_pool(
+        rpc_url,
+        build_rpc_pool(chain_id, endpoints, retries=rpc_retries, hedge_delay=rpc_hedge_delay),
+    )
+
+    logger.info('Validating vault contract and fetching current state...')
+    state = read_vault_state(rpc_url, chain_id, vault_address)
+    price_per_share = state.price_per_share
+    decimals = state.decimals
+    asset_address = state.asset_address
+    symbol = 'TOKEN'
+    try:
+        symbol = get_token_symbol(rpc_url, asset_address) or symbol
+    except Exception as exc:
+        logger.warning('Could not fetch token symbol: %s', exc)
+    ctx = VaultContext(
+        address=vault_address,
+        chain_id=chain_id,
+        rpc_url=rpc_url,
+        decimals=decimals,
+        symbol=symbol,
+        asset_address=asset_address,
+        cache_dir=cache_dir,
+        rpc_batch_size=rpc_batch_size,
+        max_concurrency=max_concurrency,
+        accountant_hint=state.accountant,
+    )
+    if cache_dir is not None:
+        ctx.chain_cache = open_chain_read_cache(cache_dir, cache_max_mb)
+        if ctx.chain_cache is not None:
+            ctx.safe_block = get_safe_block(rpc_url, chain_id)
+        ctx.pps_index = load_pps_index(cache_dir, chain_id, vault_address)
+        ctx.block_time_index = load_block_time_index(cache_dir, chain_id)
+    return ctx, price_per_share
+
+
+@dataclass
+class DepositorAnalysis:
+    depositor_address: str
+    position: PositionResult
+    current_value: int
+    weighted_avg_entry_pps: int
+    profit_and_fees: Dict[str, int]
+    performance_fee_bps: int
+    current_pps: int
+    first_interaction_block: Optional[int]
+    first_interaction_date: Optional[datetime.datetime]
+    peak_value: Optional[int]
+    peak_date: Optional[datetime.datetime]
+    fee_segments: List[FeeSegmentProfit] = field(default_factory=list)
+
+
+def analyze_depositor(
+    ctx: VaultContext,
+    depositor_address: str,
+    current_pps: int,
+    performance_fee_bps: int,
+    *,
+    check_stable_fees: bool = False,
+    fee_history: bool = False,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    checkpoint_dir: Optional[str] = None,
+) -> DepositorAnalysis:
+    vault_address = ctx.address
+    decimals = ctx.decimals
+
+    start_state = None
+    checkpoint_block = None
+    if checkpoint_dir is not None:
+        start_state = load_position_checkpoint(checkpoint_dir, ctx.chain_id, vault_address, depositor_address)
+        if start_state is not None:
+            logger.info('Resuming from checkpoint after block %d (%d events)', start_state.last_block, start_state.events)
+        # Only finalized events go into the checkpoint, so a reorg can never invalidate it.
+        checkpoint_block = ctx.safe_block if ctx.safe_block is not None else get_safe_block(ctx.rpc_url, ctx.chain_id)
+    after = (start_state.last_block, start_state.last_log_index) if start_state is not None else (-1, -1)
+
+    logger.info('Fetching data from Envio indexer...')
+    deposits, withdrawals, transfers = fetch_depositor_event_streams(
+        depositor_address,
+        vault_address,
+        chain_id=ctx.chain_id,
+        page_size=page_size,
+        max_concurrency=ctx.max_concurrency,
+        after=after,
+    )
+
+    logger.info('Building position timeline...')
+    timeline = build_event_timeline(deposits, withdrawals, transfers, depositor_address)
+
+    # The indexer already knows every event's block timestamp, so dates for
+    # event blocks (first interaction, peak) never need an RPC round trip.
+    for block_number, timestamp in zip(timeline.blocks, timeline.timestamps):
+        remember_block_timestamp(ctx, block_number, timestamp)
+
+    first_event_block = start_state.first_block if start_state is not None else None
+    last_event_block = start_state.last_block if start_state is not None else None
+    if timeline:
+        if first_event_block is None:
+            first_event_block = timeline.blocks[0]
+        last_event_block = timeline.blocks[-1]
+
+    fee_segments: List[FeeSegment] = []
+    if (check_stable_fees or fee_history) and first_event_block is not None and last_event_block is not None:
+        # Piecewise profit runs up to the current PPS, so its history ends at the head.
+        history_end = read_head_block(ctx) if fee_history else last_event_block
+        logger.info('Building fee history from accountant change events...')
+        fee_segments = build_fee_history(ctx, first_event_block, history_end, page_size, strict=check_stable_fees)
+
+    if ctx.skip_static_pps and ctx.pps_model is None and timeline:
+        logger.info('Locating blocks where pricePerShare can change...')
+        ensure_pps_change_plan(ctx, timeline.blocks[0], timeline.blocks[-1], page_size)
+
+    # All historical reads are independent of each other, so fetch them
+    # concurrently up front; the calculations below then hit warm caches.
+    snapshot_blocks = list(timeline.blocks)
+    if fee_history:
+        snapshot_blocks.extend(segment.end_block for segment in fee_segments[:-1])
+    if snapshot_blocks:
+        logger.info('Fetching historical chain state (%d PPS blocks)...', len(set(snapshot_blocks)))
+        prefetch_chain_reads(ctx, pps_blocks=snapshot_blocks)
+
+    if check_stable_fees and fee_segments:
+        logger.info('Verifying fees stayed constant throughout depositor history (%d fee segments)...', len(fee_segments))
+        verify_fee_history(
+            [segment for segment in fee_segments if segment.start_block <= last_event_block],
+            performance_fee_bps,
+        )
+
+    position = calculate_position(
+        ctx,
+        timeline,
+        current_pps,
+        decimals,
+        start=start_state,
+        checkpoint_block=checkpoint_block,
+    )
+    checkpoint = position.checkpoint
+    if (
+        checkpoint_dir is not None
+        and checkpoint is not None
+        and checkpoint.last_block >= 0
+        and (start_state is None or checkpoint.last_block != start_state.last_block or checkpoint.last_log_index != start_state.last_log_index)
+    ):
+        save_position_checkpoint(checkpoint_dir, ctx.chain_id, vault_address, depositor_address, checkpoint)
+    state = position.state
+    current_value = state.current_shares * current_pps // (10 ** decimals)
+    segment_profits: List[FeeSegmentProfit] = []
+    if fee_history and fee_segments:
+        profit_and_fees, segment_profits = calculate_fee_weighted_profit(
+            ctx,
+            position,
+            fee_segments,
+            current_pps,
+            decimals,
+        )
+    else:
+        profit_and_fees = calculate_incremental_profit_and_fees(position, performance_fee_bps)
+
+    first_block = state.first_block
+    first_date = None
+    if first_block is not None:
+        remember_block_timestamp(ctx, first_block, state.first_timestamp)
+        first_date = get_block_timestamp(ctx, first_block, exact=True)
+
+    peak_value = None
+    peak_date = None
+    if state.peak_pps is not None and state.peak_shares_block > 0:
+        peak_value = state.peak_shares * state.peak_pps // (10 ** decimals)
+        remember_block_timestamp(ctx, state.peak_shares_block, state.peak_timestamp)
+        peak_date = get_block_timestamp(ctx, state.peak_shares_block, exact=True)
+
+    if ctx.chain_cache is not None:
+        ctx.chain_cache.flush()
+
+    return DepositorAnalysis(
+        depositor_address=depositor_address,
+        position=position,
+        current_value=current_value,
+        weighted_avg_entry_pps=position.weighted_avg_entry_pps,
+        profit_and_fees=profit_and_fees,
+        performance_fee_bps=performance_fee_bps,
+        current_pps=current_pps,
+        first_interaction_block=first_block,
+        first_interaction_date=first_date,
+        peak_value=peak_value,
+        peak_date=peak_date,
+        fee_segments=segment_profits,
+    )
+
+
+def depositor_analysis_to_dict(
+    ctx: VaultContext,
+    analysis: DepositorAnalysis,
+    *,
+    detail: bool = False,
+) -> Dict[str, Any]:
+    # detail adds one row per event and the sampled plot series.
+    position = analysis.position
+    state = position.state
+    profit_and_fees = analysis.profit_and_fees
+    first_date = analysis.first_interaction_date
+    result = _summary_record(
+        ctx,
+        analysis.depositor_address,
+        current_shares=state.current_shares,
+        current_value=analysis.current_value,
+        total_deposited=state.total_deposited,
+        total_withdrawn=state.total_withdrawn,
+        net_transfer_value=state.net_transfer_value,
+        weighted_avg_entry_pps=analysis.weighted_avg_entry_pps,
+        current_pps=analysis.current_pps,
+        net_profit=profit_and_fees['net_profit'],
+        gross_profit=profit_and_fees['gross_profit'],
+        total_fees=profit_and_fees['total_fees'],
+        performance_fee_bps=analysis.performance_fee_bps,
+        peak_shares=state.peak_shares,
+        peak_shares_block=state.peak_shares_block,
+        peak_value=analysis.peak_value,
+        first_interaction_block=analysis.first_interaction_block,
+        first_interaction_timestamp=int(first_date.timestamp()) if first_date else None,
+        deposits=state.deposits,
+        withdrawals=state.withdrawals,
+        transfers=state.transfers_in + state.transfers_out,
+    )
+    if analysis.fee_segments:
+        result['fee_segments'] = [
+            {
+                'start_block': item.segment.start_block,
+                'end_block': item.segment.end_block,
+                'performance_fee_bps': item.segment.performance_fee_bps,
+                'net_profit': str(item.net_profit),
+                'gross_profit': str(item.gross_profit),
+                'total_fees': str(item.total_fees),
+            }
+            for item in analysis.fee_segments
+        ]
+    if detail:
+        result['event_rows'] = position_event_rows(position, ctx.decimals)
+        result['plot_series'] = [
+            {'block': point['block'], 'shares': str(point['shares']), 'profit': str(point['profit'])}
+            for point in sample_series(prepare_balance_profit_series(ctx, position), 300)
+        ]
+    return result
+
+
+def position_event_rows(position: PositionResult, decimals: int) -> List[Dict[str, Any]]:
+    # Transfers are valued at the PPS the position pass already read for their block.
+    scale = 10 ** decimals
+    timeline = position.timeline
+    rows: List[Dict[str, Any]] = []
+    columns = zip(
+        timeline.types,
+        timeline.blocks,
+        timeline.log_indexes,
+        timeline.timestamps,
+        timeline.shares,
+        timeline.assets,
+        position.event_pps,
+        position.balances,
+        position.cumulative_profit,
+    )
+    for event_type, block_number, log_index, timestamp, shares, assets, pps, balance, profit in columns:
+        if event_type == EVENT_TRANSFER_IN or event_type == EVENT_TRANSFER_OUT:
+            assets = shares * pps // scale
+        rows.append({
+            'type': EVENT_TYPE_NAMES[event_type],
+            'block': block_number,
+            'log_index': log_index,
+            'timestamp': timestamp,
+            'shares': str(shares),
+            'assets': str(assets),
+            'pps': str(pps),
+            'balance': str(balance),
+            'cumulative_profit': str(profit),
+        })
+    return rows
+
+
+class ResultWriter:
+    # Streams result records as JSON, JSON Lines, CSV or Parquet. JSON is one
+    # object for a single record and an array otherwise; CSV and Parquet keep
+    # the flat SUMMARY_FIELDS columns and buffer Parquet rows into row groups.
+    def __init__(self, output_format: str, path: Optional[str] = None, *, single: bool = False) -> None:
+        if output_format not in OUTPUT_FORMATS or output_format == 'text':
+            raise RuntimeError(f'Unsupported output format: {output_format}')
+        if output_format == 'parquet':
+            if not HAS_PYARROW:
+                raise RuntimeError('Parquet output requires pyarrow (`pip install pyarrow`)')
+            if path is None:
+                raise RuntimeError('Parquet output needs a file path')
+        self.output_format = output_format
+        self.single = single
+        self.count = 0
+        self._path = path
+        self._handle: Any = None
+        self._csv: Optional[csv.DictWriter] = None
+        self._parquet: Any = None
+        self._rows: List[Dict[str, Any]] = []
+        if output_format != 'parquet':
+            self._handle = open(path, 'w', encoding='utf-8', newline='') if path is not None else sys.stdout
+        if output_format == 'csv':
+            self._csv = csv.DictWriter(
+                self._handle,
+                fieldnames=[name for name, _ in SUMMARY_FIELDS],
+                extrasaction='ignore',
+            )
+            self._csv.writeheader()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if self.output_format == 'jsonl':
+            self._handle.write(json.dumps(record) + '\n')
+            self._handle.flush()
+        elif self.output_format == 'json':
+            if self.single:
+                self._handle.write(json.dumps(record, indent=2) + '\n')
+            else:
+                self._handle.write(('[\n' if self.count == 0 else ',\n') + json.dumps(record))
+        elif self.output_format == 'csv':
+            assert self._csv is not None
+            self._csv.writerow(record)
+        else:
+            self._rows.append({name: record.get(name) for name, _ in SUMMARY_FIELDS})
+            if len(self._rows) >= PARQUET_ROW_GROUP_SIZE:
+                self._flush_parquet()
+        self.count += 1
+
+    def _flush_parquet(self) -> None:
+        schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in SUMMARY_FIELDS])
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self._path, schema)
+        self._parquet.write_table(pa.Table.from_pylist(self._rows, schema=schema))
+        self._rows = []
+
+    def close(self) -> None:
+        if self.output_format == 'parquet':
+            if self._rows or self._parquet is None:
+                self._flush_parquet()
+            self._parquet.close()
+            return
+        if self.output_format == 'json' and not self.single:
+            self._handle.write('[]\n' if self.count == 0 else '\n]\n')
+        self._handle.flush()
+        if self._handle is not sys.stdout:
+            self._handle.close()
+
+
+def read_depositor_addresses(source: str) -> List[str]:
+    # One address per line; blank lines and # comments are ignored.
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, 'r', encoding='utf-8') as file:
+            lines = file.read().splitlines()
+    addresses: List[str] = []
+    for line in lines:
+        trimmed = line.split('#', 1)[0].strip()
+        if trimmed:
+            addresses.append(trimmed)
+    return addresses
+
+
+def run_depositor_batch(
+    ctx: VaultContext,
+    depositor_addresses: List[str],
+    current_pps: int,
+    performance_fee_bps: int,
+    *,
+    check_stable_fees: bool = False,
+    fee_history: bool = False,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    checkpoint_dir: Optional[str] = None,
+    writer: Optional[ResultWriter] = None,
+) -> int:
+    writer = writer or ResultWriter('jsonl')
+    failures = 0
+    for index, depositor_address in enumerate(depositor_addresses, start=1):
+        logger.info('[%d/%d] Analyzing depositor %s', index, len(depositor_addresses), depositor_address)
+        try:
+            if not is_valid_address(depositor_address):
+                raise RuntimeError('Invalid Ethereum address format for depositor')
+            analysis = analyze_depositor(
+                ctx,
+                depositor_address,
+                current_pps,
+                performance_fee_bps,
+                check_stable_fees=check_stable_fees,
+                fee_history=fee_history,
+                page_size=page_size,
+                checkpoint_dir=checkpoint_dir,
+            )
+            result = depositor_analysis_to_dict(ctx, analysis, detail=writer.output_format == 'json')
+        except Exception as exc:
+            failures += 1
+            logger.error('Depositor %s failed: %s', depositor_address, exc)
+            result = {
+                'depositor': depositor_address,
+                'vault': ctx.address,
+                'chain_id': ctx.chain_id,
+                'error': str(exc),
+            }
+        writer.write(result)
+    return failures
+
+
+def run_vault_holder_report(
+    ctx: VaultContext,
+    current_pps: int,
+    performance_fee_bps: int,
+    *,
+    page_size: int = DEFAULT_GRAPHQL_PAGE_SIZE,
+    check_stable_fees: bool = False,
+    writer: Optional[ResultWriter] = None,
+) -> int:
+    writer = writer or ResultWriter('jsonl')
+    logger.info('Replaying all share events of vault %s...', ctx.address)
+    holders = replay_vault_holders(ctx, iter_vault_share_events(ctx.address, ctx.chain_id, page_size))
+    logger.info('Replayed history of %d holders', len(holders))
+
+    first_blocks = [holder.first_block for holder in holders.values() if holder.first_block is not None]
+    last_blocks = [holder.last_block for holder in holders.values() if holder.last_block is not None]
+    if check_stable_fees and first_blocks:
+        first_event_block = min(first_blocks)
+        last_event_block = max(last_blocks)
+        fee_segments = build_fee_history(ctx, first_event_block, last_event_block, page_size, strict=True)
+        logger.info('Verifying fees stayed constant throughout vault history (%d fee segments)...', len(fee_segments))
+        verify_fee_history(fee_segments, performance_fee_bps)
+
+    for address, holder in holders.items():
+        writer.write(holder_state_to_dict(ctx, address, holder, current_pps, performance_fee_bps))
+    return len(holders)
 
 
 def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(message)s',
+    )
+    _ensure_local_env()
+
     parser = argparse.ArgumentParser(
         description='Calculate Yearn V3 depositor fees and profit/loss analysis'
     )
     parser.add_argument(
         'depositor_address',
+        nargs='?',
         help='Ethereum address of the depositor (must start with 0x)'
     )
+    parser.add_argument(
+        '--depositors-file', '-f',
+        help='Batch mode: file with one depositor address per line ("-" reads stdin); writes one record per depositor (JSON Lines unless --format is given)'
+    )
+    parser.add_argument(
+        '--all-depositors',
+        action='store_true',
+        help='Report every holder of the vault from a single scan of its share events; writes one record per holder (JSON Lines unless --format is given)'
+    )
+    parser.add_argument(
+        '--page-size',
+        type=int,
+        default=DEFAULT_GRAPHQL_PAGE_SIZE,
+        help=f'Rows per Envio GraphQL page when fetching events (default: {DEFAULT_GRAPHQL_PAGE_SIZE})'
+    )
     parser.add_argument(
         '--vault', '-v',
         default=DEFAULT_VAULT_ADDRESS,
@@ -1228,6 +5011,92 @@ def main() -> None:
         action='store_true',
         help='Verify that performance fee remained stable throughout depositor history'
     )
+    parser.add_argument(
+        '--format',
+        choices=OUTPUT_FORMATS,
+        help='Output format: the text report, JSON with per-event rows and the plot series, or one flat summary '
+             'record per depositor as JSON Lines, CSV or Parquet (default: text for one depositor, jsonl otherwise)'
+    )
+    parser.add_argument(
+        '--output', '-o',
+        help='Write structured output to this file instead of stdout (required for parquet)'
+    )
+    parser.add_argument(
+        '--no-plot',
+        action='store_true',
+        help='Skip the balance/profit plot (and the matplotlib import) in single-depositor mode'
+    )
+    parser.add_argument(
+        '--fee-history',
+        action='store_true',
+        help='Apply the fee rate in force over each part of the depositor history, located from indexed '
+             'accountant changes and sampled fee config reads, and report profit per fee segment'
+    )
+    parser.add_argument(
+        '--rpc-batch-size',
+        type=int,
+        default=DEFAULT_RPC_BATCH_SIZE,
+        help=f'eth_call requests per JSON-RPC batch for historical PPS lookups (default: {DEFAULT_RPC_BATCH_SIZE}, 0 disables batching)'
+    )
+    parser.add_argument(
+        '--pps-source',
+        choices=PPS_SOURCES,
+        default=DEFAULT_PPS_SOURCE,
+        help='Historical pricePerShare from archive RPC reads, from indexed vault events (archive node needed only '
+             'for vaults that reported before their first unlock time change), or events when they match '
+             'on-chain state (default: rpc)'
+    )
+    parser.add_argument(
+        '--skip-static-pps',
+        action='store_true',
+        help='Use indexed vault events to skip pricePerShare reads at blocks where it provably equals an earlier read'
+    )
+    parser.add_argument(
+        '--checkpoint',
+        action='store_true',
+        help='Resume each depositor from its saved checkpoint in the cache directory and save the new one, '
+             'so only events since the last finalized checkpoint are fetched and replayed'
+    )
+    parser.add_argument(
+        '--build-pps-index',
+        action='store_true',
+        help='Build or extend the on-disk pricePerShare index of the vault (every finalized event block) '
+             'so later runs for any depositor skip those reads; may be used without a depositor'
+    )
+    parser.add_argument(
+        '--max-concurrency',
+        type=int,
+        default=DEFAULT_ENDPOINT_CONCURRENCY,
+        help=f'Maximum in-flight requests per RPC/GraphQL endpoint (default: {DEFAULT_ENDPOINT_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--rpc-retries',
+        type=int,
+        default=DEFAULT_RPC_RETRIES,
+        help=f'Retries per RPC call on rate limits, 5xx and network errors, failing over between endpoints (default: {DEFAULT_RPC_RETRIES})'
+    )
+    parser.add_argument(
+        '--rpc-hedge-ms',
+        type=int,
+        default=0,
+        help='Duplicate RPC calls still pending after this many milliseconds to a second endpoint (default: off)'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=os.environ.get('CALC_FEES_CACHE_DIR', DEFAULT_CACHE_DIR),
+        help=f'Directory for the persistent chain read cache (default: $CALC_FEES_CACHE_DIR or {DEFAULT_CACHE_DIR})'
+    )
+    parser.add_argument(
+        '--cache-max-mb',
+        type=int,
+        default=DEFAULT_CHAIN_CACHE_MAX_MB,
+        help=f'Size limit of the persistent chain read cache before old entries are evicted (default: {DEFAULT_CHAIN_CACHE_MAX_MB})'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not read or write the persistent chain read cache'
+    )
     args = parser.parse_args()
 
     depositor_address = args.depositor_address
@@ -1235,119 +5104,129 @@ def main() -> None:
     chain_id = args.chain
     check_stable_fees = args.stable_fees
 
-    if not depositor_address.startswith('0x') or len(depositor_address) != 42:
+    modes = sum(map(bool, (depositor_address, args.depositors_file, args.all_depositors)))
+    if modes > 1 or (modes == 0 and not args.build_pps_index):
+        parser.error('pass exactly one of a depositor address, --depositors-file or --all-depositors')
+    if args.build_pps_index and args.no_cache:
+        parser.error('--build-pps-index stores the index in the cache directory; drop --no-cache')
+    if args.page_size <= 0:
+        parser.error('--page-size must be positive')
+    if args.fee_history and args.all_depositors:
+        parser.error('--fee-history is not supported with --all-depositors')
+    if args.checkpoint and args.no_cache:
+        parser.error('--checkpoint stores its state in the cache directory; drop --no-cache')
+    if args.checkpoint and args.all_depositors:
+        parser.error('--checkpoint is not supported with --all-depositors')
+    if args.checkpoint and args.fee_history:
+        parser.error('--fee-history needs the full depositor history; drop --checkpoint')
+    output_format = args.format or ('text' if depositor_address else 'jsonl')
+    if output_format == 'text' and (args.depositors_file or args.all_depositors):
+        parser.error('--format text is only available for a single depositor')
+    if output_format == 'text' and args.output:
+        parser.error('--output needs a structured --format')
+    if output_format == 'parquet' and not args.output:
+        parser.error('--format parquet needs --output')
+    if output_format == 'parquet' and not HAS_PYARROW:
+        parser.error('--format parquet requires pyarrow (`pip install pyarrow`)')
+    if depositor_address and not is_valid_address(depositor_address):
         logger.error('Invalid Ethereum address format for depositor')
         sys.exit(1)
-    if not (vault_address.startswith('0x') and len(vault_address) == 42):
+    if not is_valid_address(vault_address):
         logger.error('Invalid vault address format')
         sys.exit(1)
+    depositor_addresses = read_depositor_addresses(args.depositors_file) if args.depositors_file else []
+
+    ctx, price_per_share = create_vault_context(
+        vault_address,
+        chain_id,
+        rpc_batch_size=args.rpc_batch_size,
+        max_concurrency=args.max_concurrency,
+        rpc_retries=args.rpc_retries,
+        rpc_hedge_delay=args.rpc_hedge_ms / 1000 if args.rpc_hedge_ms > 0 else None,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_mb=args.cache_max_mb,
+    )
 
-    rpc_url = select_rpc_url(chain_id)
-
-    logger.info('Validating vault contract...')
-    validate_vault_address(rpc_url, vault_address)
+    logger.info('Fetching performance fee rate...')
+    performance_fee_bps = get_performance_fee_rate(ctx, vault_address)
 
-    logger.info('Fetching data from Envio indexer...')
-    deposits = get_deposit_events(depositor_address, vault_address)
-    withdrawals = get_withdraw_events(depositor_address, vault_address)
-    transfers = get_transfer_events(depositor_address, vault_address)
+    ctx.skip_static_pps = args.skip_static_pps
+    checkpoint_dir = args.cache_dir if args.checkpoint else None
+    writer = None
+    if output_format != 'text' and modes:
+        writer = ResultWriter(output_format, args.output, single=bool(depositor_address))
 
-    logger.info('Building position timeline...')
-    position = calculate_position(
-        build_event_timeline(deposits, withdrawals, transfers, depositor_address),
-        depositor_address,
-    )
-
-    if position.snapshots:
-        first_event_block = position.snapshots[0].block_number
-        last_event_block = position.snapshots[-1].block_number
-    else:
-        first_event_block = None
-        last_event_block = None
-
-    logger.info('Fetching current vault state...')
-    price_per_share_hex = contract_call(rpc_url, vault_address, PRICE_PER_SHARE_SELECTOR)
-    decimals_hex = contract_call(rpc_url, vault_address, DECIMALS_SELECTOR)
-    price_per_share = int(price_per_share_hex, 16)
-    decimals = int(decimals_hex, 16)
-    symbol = 'TOKEN'
-    asset_address = ''
     try:
-        asset_address = get_asset_address(rpc_url, vault_address)
-        symbol = get_token_symbol(rpc_url, asset_address) or symbol
-    except Exception as exc:
-        logger.warning('Could not fetch token symbol: %s', exc)
-    ctx = VaultContext(
-        address=vault_address,
-        chain_id=chain_id,
-        rpc_url=rpc_url,
-        decimals=decimals,
-        symbol=symbol,
-        asset_address=asset_address,
-    )
-    current_value = position.current_shares * price_per_share // (10 ** decimals)
+        attach_event_pps_model(ctx, args.pps_source, page_size=args.page_size)
+        if args.build_pps_index:
+            build_pps_index(ctx, args.cache_dir, page_size=args.page_size)
+            if modes == 0:
+                return
+        if args.all_depositors:
+            run_vault_holder_report(
+                ctx,
+                price_per_share,
+                performance_fee_bps,
+                page_size=args.page_size,
+                check_stable_fees=check_stable_fees,
+                writer=writer,
+            )
+            return
+
+        if args.depositors_file:
+            failures = run_depositor_batch(
+                ctx,
+                depositor_addresses,
+                price_per_share,
+                performance_fee_bps,
+                check_stable_fees=check_stable_fees,
+                fee_history=args.fee_history,
+                page_size=args.page_size,
+                checkpoint_dir=checkpoint_dir,
+                writer=writer,
+            )
+            logger.info('Analyzed %d depositors (%d failed)', len(depositor_addresses), failures)
+            return
 
-    logger.info('Fetching performance fee rate...')
-    performance_fee_bps = get_performance_fee_rate(ctx, vault_address)
-    if check_stable_fees and first_event_block is not None and last_event_block is not None:
-        blocks_to_check = sample_fee_check_blocks(first_event_block, last_event_block)
-        logger.info('Verifying performance fee stability throughout depositor history (%d datapoints)...', len(blocks_to_check))
-        verify_performance_fee_stability(
+        analysis = analyze_depositor(
             ctx,
-            vault_address,
-            first_event_block,
-            last_event_block,
+            depositor_address,
+            price_per_share,
             performance_fee_bps,
-            blocks_to_check=blocks_to_check,
+            check_stable_fees=check_stable_fees,
+            fee_history=args.fee_history,
+            page_size=args.page_size,
+            checkpoint_dir=checkpoint_dir,
         )
-        logger.info('Verifying management fee remains zero throughout depositor history (%d datapoints)...', len(blocks_to_check))
-        verify_management_fee_zero(ctx, vault_address, blocks_to_check)
-    weighted_avg_entry_pps = calculate_weighted_average_entry_pps(ctx, position.user_events, decimals)
-    profit_and_fees = calculate_incremental_profit_and_fees(
-        ctx,
-        position.snapshots,
-        performance_fee_bps,
-        price_per_share,
-        position.current_shares,
-        decimals,
-    )
-
-    all_user_blocks = [
-        *map(lambda d: parse_event_id(d.id)[0], deposits),
-        *map(lambda w: parse_event_id(w.id)[0], withdrawals),
-        *map(lambda t: parse_event_id(t.id)[0], transfers),
-    ]
-    first_block = min(all_user_blocks) if all_user_blocks else None
-    first_date = get_block_timestamp(ctx, first_block) if first_block is not None else None
-
-    peak_value = None
-    peak_date = None
-    if position.peak_shares > 0 and position.peak_shares_block > 0:
-        logger.info('Calculating peak position value...')
-        try:
-            peak_price = get_price_per_share_at_block(ctx, position.peak_shares_block)
-            peak_value = position.peak_shares * peak_price // (10 ** decimals)
-            peak_date = get_block_timestamp(ctx, position.peak_shares_block)
-        except Exception as exc:
-            logger.warning('Could not fetch peak position value: %s', exc)
-
-    format_output(
-        ctx,
-        depositor_address,
-        deposits,
-        withdrawals,
-        transfers,
-        position,
-        current_value,
-        weighted_avg_entry_pps,
-        profit_and_fees,
-        performance_fee_bps,
-        price_per_share,
-        first_date,
-        first_block,
-        peak_value,
-        peak_date,
-    )
+        if writer is not None:
+            writer.write(depositor_analysis_to_dict(ctx, analysis, detail=output_format == 'json'))
+            return
+        format_output(
+            ctx,
+            depositor_address,
+            analysis.position,
+            analysis.current_value,
+            analysis.weighted_avg_entry_pps,
+            analysis.profit_and_fees,
+            analysis.performance_fee_bps,
+            analysis.current_pps,
+            analysis.first_interaction_date,
+            analysis.first_interaction_block,
+            analysis.peak_value,
+            analysis.peak_date,
+            fee_segments=analysis.fee_segments,
+            plot=not args.no_plot,
+        )
+    finally:
+        if writer is not None:
+            writer.close()
+        if not args.no_cache and ctx.block_time_index is not None and ctx.block_time_index.dirty:
+            save_block_time_index(args.cache_dir, ctx.block_time_index, ctx.safe_block)
+        if ctx.chain_cache is not None:
+            ctx.chain_cache.close()
+        close_chain_clients()
+        close_rpc_pools()
+        close_http_pools()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,1227 @@
+#!/usr/bin/env python3
+"""Unit tests for the depositor fee calculator; run with `python -m pytest scripts`."""
+
+import contextlib
+import csv
+import gzip
+import http.server
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import unittest
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import calc_depositor_fees as calc  # noqa: E402
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
+VAULT = '0x' + 'be' * 20
+DEPOSITOR = '0x' + 'a1' * 20
+OTHER = '0x' + 'b2' * 20
+
+
+def vault_context(**overrides: Any) -> calc.VaultContext:
+    values = dict(
+        address=VAULT,
+        chain_id=calc.DEFAULT_CHAIN_ID,
+        rpc_url='test://unused',
+        decimals=6,
+        symbol='TEST',
+        asset_address=VAULT,
+    )
+    values.update(overrides)
+    return calc.VaultContext(**values)
+
+
+def pps_at(block: int) -> str:
+    # A distinct pricePerShare per block, as eth_call returns it.
+    return f'0x{10 ** 6 + block:064x}'
+
+
+def block_time(block: int) -> int:
+    return 1_700_000_000 + 12 * block
+
+
+def event_id(block: int, log_index: int) -> str:
+    return f'{calc.DEFAULT_CHAIN_ID}_{block}_{log_index}'
+
+
+def indexed_at(block: int, log_index: int) -> Tuple[int, int, int]:
+    # The block number, log index and block timestamp fields of an indexed event.
+    return block, log_index, block_time(block)
+
+
+def position(event: Any) -> Tuple[int, int]:
+    return event.block_number, event.log_index
+
+
+class FakeVaultHistory:
+    # Two holders of one vault: DEPOSITOR deposits, sends part of its shares to
+    # OTHER and withdraws the rest; OTHER deposits in between. Indexer queries
+    # and RPC reads are answered from memory, and pricePerShare reads counted.
+    PATCHED = (
+        'fetch_depositor_events',
+        'contract_call',
+        'rpc_batch_call',
+        'rpc_call',
+    )
+
+    def __init__(self) -> None:
+        self.deposits = [
+            calc.DepositEvent(event_id(100, 1), DEPOSITOR, DEPOSITOR, '1000000000', '990000000', *indexed_at(100, 1)),
+            calc.DepositEvent(event_id(120, 0), OTHER, OTHER, '500000000', '494000000', *indexed_at(120, 0)),
+        ]
+        self.transfers = [calc.TransferEvent(event_id(150, 2), DEPOSITOR, OTHER, '300000000', *indexed_at(150, 2))]
+        self.withdrawals = [
+            calc.WithdrawEvent(event_id(200, 3), DEPOSITOR, DEPOSITOR, DEPOSITOR, '700000000', '690000000', *indexed_at(200, 3)),
+        ]
+        self.pps_reads: List[int] = []
+
+    def iter_deposit_events(self, depositor_address: str, *args: Any, **kwargs: Any) -> Iterator[calc.DepositEvent]:
+        return iter([event for event in self.deposits if event.owner == depositor_address.lower()])
+
+    def iter_withdraw_events(self, depositor_address: str, *args: Any, **kwargs: Any) -> Iterator[calc.WithdrawEvent]:
+        return iter([event for event in self.withdrawals if event.owner == depositor_address.lower()])
+
+    def iter_transfer_events(self, depositor_address: str, *args: Any, **kwargs: Any) -> Iterator[calc.TransferEvent]:
+        # Like the indexer's outgoing and incoming pages merged, so a self-transfer is listed twice.
+        holder = depositor_address.lower()
+        sides = [
+            *(event for event in self.transfers if event.sender == holder),
+            *(event for event in self.transfers if event.receiver == holder),
+        ]
+        return iter(sorted(sides, key=position))
+
+    def fetch_depositor_events(self, depositor_address: str, *args: Any, **kwargs: Any) -> Tuple[Iterator[calc.DepositEvent], Iterator[calc.WithdrawEvent], Iterator[calc.TransferEvent]]:
+        return (
+            self.iter_deposit_events(depositor_address),
+            self.iter_withdraw_events(depositor_address),
+            self.iter_transfer_events(depositor_address),
+        )
+
+    def share_events(self, *args: Any, **kwargs: Any) -> Iterator[Tuple[int, int, str, Dict[str, Any]]]:
+        # The vault-wide stream the indexer would return, in (block, log) order.
+        rows = [
+            *(('deposit', event, {'owner': event.owner, 'assets': event.assets, 'shares': event.shares})
+              for event in self.deposits),
+            *(('withdraw', event, {'owner': event.owner, 'assets': event.assets, 'shares': event.shares})
+              for event in self.withdrawals),
+            *(('transfer', event, {'sender': event.sender, 'receiver': event.receiver, 'value': event.value})
+              for event in self.transfers),
+        ]
+        for kind, event, row in sorted(rows, key=lambda item: position(item[1])):
+            yield event.block_number, event.log_index, kind, {**row, 'blockTimestamp': event.block_timestamp}
+
+    def contract_call(self, rpc_url: str, address: str, data: str, block_number: Optional[int] = None) -> str:
+        assert data == calc.PRICE_PER_SHARE_SELECTOR, data
+        self.pps_reads.append(block_number)
+        return pps_at(block_number)
+
+    def rpc_batch_call(
+        self,
+        rpc_url: str,
+        calls: List[Tuple[str, List[Any]]],
+        return_exceptions: bool = False,
+    ) -> List[Any]:
+        return [self.contract_call(rpc_url, call['to'], call['data'], int(block, 16)) for _, (call, block) in calls]
+
+    def rpc_call(self, rpc_url: str, method: str, params: List[Any]) -> Any:
+        if method == 'eth_getBlockByNumber':
+            return {'timestamp': hex(block_time(int(params[0], 16)))}
+        if method == 'eth_blockNumber':
+            return hex(1000)
+        raise AssertionError(method)
+
+    def patch(self) -> contextlib.ExitStack:
+        stack = contextlib.ExitStack()
+        for name in self.PATCHED:
+            stack.enter_context(mock.patch.object(calc, name, getattr(self, name)))
+        return stack
+
+
+class PricePerShareBatchTest(unittest.TestCase):
+    def test_rejected_batches_are_halved(self) -> None:
+        sizes: List[int] = []
+
+        def batch_call(rpc_url: str, calls: List[Tuple[str, List[Any]]], return_exceptions: bool = False) -> List[Any]:
+            sizes.append(len(calls))
+            if len(calls) > 25:
+                raise calc.RpcError('RPC batch error: batch too large')
+            return [pps_at(int(params[1], 16)) for _, params in calls]
+
+        ctx = vault_context(rpc_batch_size=100)
+        with mock.patch.object(calc, 'rpc_batch_call', batch_call):
+            fetched = calc.prefetch_price_per_share(ctx, range(1, 101))
+        self.assertEqual(fetched, 100)
+        self.assertEqual(sizes, [100, 50, 25, 25, 25, 25])
+        # The smaller size sticks for later lookups on this vault.
+        self.assertEqual(ctx.rpc_batch_size, 25)
+        self.assertEqual(ctx.price_per_share_cache[42], int(pps_at(42), 16))
+
+    def test_unsupported_batches_fall_back_to_single_calls(self) -> None:
+        def batch_call(rpc_url: str, calls: List[Tuple[str, List[Any]]], return_exceptions: bool = False) -> List[Any]:
+            raise calc.RpcError('RPC batch error: batch requests are not supported')
+
+        ctx = vault_context(rpc_batch_size=8)
+        with mock.patch.object(calc, 'rpc_batch_call', batch_call), self.assertLogs(calc.logger, 'WARNING'):
+            fetched = calc.prefetch_price_per_share(ctx, range(1, 11))
+        self.assertEqual(fetched, 0)
+        self.assertEqual(ctx.price_per_share_cache, {})
+
+    def test_failed_entries_are_left_uncached(self) -> None:
+        def batch_call(rpc_url: str, calls: List[Tuple[str, List[Any]]], return_exceptions: bool = False) -> List[Any]:
+            self.assertTrue(return_exceptions)
+            return [
+                calc.RpcError('RPC error: header not found') if index == 1 else pps_at(int(params[1], 16))
+                for index, (_, params) in enumerate(calls)
+            ]
+
+        ctx = vault_context()
+        with mock.patch.object(calc, 'rpc_batch_call', batch_call):
+            fetched = calc.prefetch_price_per_share(ctx, [5, 6, 7])
+        self.assertEqual(fetched, 2)
+        self.assertEqual(sorted(ctx.price_per_share_cache), [5, 7])
+
+
+class ChainReadCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'chain_reads.sqlite3')
+
+    def test_only_finalized_reads_are_stored(self) -> None:
+        cache = calc.ChainReadCache(self.path)
+        values = {block: pps_at(block) for block in (90, 100, 110)}
+        self.assertEqual(cache.put_many(1, VAULT, calc.PRICE_PER_SHARE_SELECTOR, values, None), 0)
+        self.assertEqual(cache.put_many(1, VAULT, calc.PRICE_PER_SHARE_SELECTOR, values, 100), 2)
+        self.assertFalse(cache.put_block_timestamp(1, 110, 1_700_000_110, 100))
+        self.assertTrue(cache.put_block_timestamp(1, 100, 1_700_000_100, 100))
+        cache.close()
+
+        cache = calc.ChainReadCache(self.path)
+        self.addCleanup(cache.close)
+        found = cache.get_many(1, '0x' + 'BE' * 20, calc.PRICE_PER_SHARE_SELECTOR, values)
+        self.assertEqual(found, {90: pps_at(90), 100: pps_at(100)})
+        self.assertIsNone(cache.get(10, VAULT, calc.PRICE_PER_SHARE_SELECTOR, 90))
+        # Timestamps live in their own table, keyed by chain and block only.
+        self.assertEqual(cache.get_block_timestamp(1, 100), 1_700_000_100)
+        self.assertIsNone(cache.get_block_timestamp(1, 110))
+        self.assertIsNone(cache.get_block_timestamp(1, 90))
+
+    def test_oldest_entries_are_evicted_over_the_limit(self) -> None:
+        cache = calc.ChainReadCache(self.path, max_bytes=1)
+        self.addCleanup(cache.close)
+        with self.assertLogs(calc.logger, 'INFO'):
+            cache.put_many(1, VAULT, calc.PRICE_PER_SHARE_SELECTOR, {block: pps_at(block) for block in range(1, 101)}, 100)
+            cache.flush()
+        found = cache.get_many(1, VAULT, calc.PRICE_PER_SHARE_SELECTOR, range(1, 101))
+        self.assertEqual(sorted(found), list(range(26, 101)))
+
+    def test_price_per_share_reads_go_through_the_cache(self) -> None:
+        calls: List[int] = []
+
+        def contract_call(rpc_url: str, address: str, data: str, block_number: int) -> str:
+            calls.append(block_number)
+            return pps_at(block_number)
+
+        cache = calc.ChainReadCache(self.path)
+        self.addCleanup(cache.close)
+        with mock.patch.object(calc, 'contract_call', contract_call):
+            ctx = vault_context(chain_cache=cache, safe_block=50)
+            for block in (40, 60):
+                self.assertEqual(calc.get_price_per_share_at_block(ctx, block), int(pps_at(block), 16))
+            # A new run reuses the finalized read and asks the chain for the other one.
+            ctx = vault_context(chain_cache=cache, safe_block=50)
+            for block in (40, 60):
+                self.assertEqual(calc.get_price_per_share_at_block(ctx, block), int(pps_at(block), 16))
+        self.assertEqual(calls, [40, 60, 60])
+
+
+class DepositorBatchTest(unittest.TestCase):
+    CURRENT_PPS = int(pps_at(1000), 16)
+
+    def analyze(self, ctx: calc.VaultContext, depositor: str) -> Dict[str, Any]:
+        analysis = calc.analyze_depositor(ctx, depositor, self.CURRENT_PPS, 1000)
+        return calc.depositor_analysis_to_dict(ctx, analysis)
+
+    def test_batch_matches_single_runs_and_shares_reads(self) -> None:
+        history = FakeVaultHistory()
+        with history.patch():
+            single = [self.analyze(vault_context(rpc_batch_size=0), holder) for holder in (DEPOSITOR, OTHER)]
+            single_reads = len(history.pps_reads)
+            history.pps_reads.clear()
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output), self.assertLogs(calc.logger, 'INFO'):
+                failures = calc.run_depositor_batch(
+                    vault_context(rpc_batch_size=0), [DEPOSITOR, 'not-an-address', OTHER], self.CURRENT_PPS, 1000
+                )
+
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(failures, 1)
+        self.assertEqual([records[0], records[2]], single)
+        self.assertEqual(records[1]['depositor'], 'not-an-address')
+        self.assertIn('error', records[1])
+        self.assertEqual(single[0]['transfers'], 1)
+        self.assertEqual(single[1]['deposits'], 1)
+        # The shared context reads the transfer block's pricePerShare once for both holders.
+        self.assertLess(len(history.pps_reads), single_reads)
+        self.assertEqual(len(history.pps_reads), len(set(history.pps_reads)))
+
+
+class VaultHolderReportTest(unittest.TestCase):
+    def test_replay_matches_per_depositor_analysis(self) -> None:
+        history = FakeVaultHistory()
+        current_pps = DepositorBatchTest.CURRENT_PPS
+        output = io.StringIO()
+        with history.patch(), mock.patch.object(calc, 'iter_vault_share_events', history.share_events):
+            single = {
+                holder: calc.depositor_analysis_to_dict(
+                    ctx, calc.analyze_depositor(ctx, holder, current_pps, 1000)
+                )
+                for holder, ctx in ((DEPOSITOR, vault_context()), (OTHER, vault_context()))
+            }
+            with contextlib.redirect_stdout(output), self.assertLogs(calc.logger, 'INFO'):
+                count = calc.run_vault_holder_report(vault_context(), current_pps, 1000)
+
+        self.assertEqual(count, 2)
+        records = {record['depositor']: record for record in map(json.loads, output.getvalue().splitlines())}
+        self.assertEqual(records, single)
+
+
+class SelfTransferTest(unittest.TestCase):
+    POSITION_FIELDS = ('current_shares', 'net_profit', 'weighted_avg_entry_pps', 'peak_shares', 'peak_value')
+
+    def analyze(self, history: FakeVaultHistory) -> Dict[str, Any]:
+        ctx = vault_context()
+        with history.patch():
+            analysis = calc.analyze_depositor(ctx, OTHER, DepositorBatchTest.CURRENT_PPS, 1000)
+        record = calc.depositor_analysis_to_dict(ctx, analysis)
+        return {key: record[key] for key in self.POSITION_FIELDS}
+
+    def test_self_transfer_leaves_the_position_unchanged(self) -> None:
+        history = FakeVaultHistory()
+        expected = self.analyze(history)
+        history.transfers.append(calc.TransferEvent(event_id(170, 0), OTHER, OTHER, '400000000', *indexed_at(170, 0)))
+        transfers = list(history.iter_transfer_events(OTHER))
+        self.assertEqual(len(transfers), 3)
+
+        # Both listed copies used to become transfer_out events, taking
+        # twice the value off the balance from block 170 on.
+        timeline = calc.build_event_timeline([], [], transfers, OTHER)
+        self.assertEqual(list(timeline.blocks), [150])
+        self.assertEqual(self.analyze(history), expected)
+        self.assertEqual(expected['current_shares'], '794000000')
+
+
+class FakeIndexer:
+    # Answers depositor event queries from in-memory rows the way the indexer
+    # does: every selection gets the rows of the queried chain for the holder,
+    # after the (blockNumber, logIndex) cursor when the query has one.
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]], reject_combined: bool = False) -> None:
+        self.tables = tables
+        self.reject_combined = reject_combined
+        self.queries: List[Tuple[str, Dict[str, Any]]] = []
+
+    def __call__(self, query: str, variables: Dict[str, Any], *args: Any) -> Dict[str, Any]:
+        self.queries.append((query, variables))
+        if self.reject_combined and 'deposits: Deposit(' in query:
+            raise calc.GraphQLError([{'message': 'field not found', 'extensions': {'code': 'validation-failed'}}])
+        cursor = (variables.get('afterBlock', -1), variables.get('afterLog', -1))
+        selections = list(re.finditer(r'(?:(\w+): )?([A-Z]\w*)\(\s*where:', query))
+        data = {}
+        for index, selection in enumerate(selections):
+            end = selections[index + 1].start() if index + 1 < len(selections) else len(query)
+            holder_field = re.search(r'(\w+): \{ _eq: \$depositorAddress \}', query[selection.start():end]).group(1)
+            rows = sorted(
+                (
+                    row for row in self.tables.get(selection.group(2), [])
+                    if row['chainId'] == variables['chainId']
+                    and row[holder_field] == variables['depositorAddress']
+                    and (row['blockNumber'], row['logIndex']) > cursor
+                ),
+                key=lambda row: (row['blockNumber'], row['logIndex']),
+            )
+            data[selection.group(1) or selection.group(2)] = rows[:variables['limit']]
+        return data
+
+
+def deposit_row(block: int, log_index: int, owner: str = DEPOSITOR, chain_id: int = 1) -> Dict[str, Any]:
+    return {
+        'id': f'{chain_id}_{block}_{log_index}',
+        'sender': owner,
+        'owner': owner,
+        'assets': '1000',
+        'shares': '990',
+        'blockNumber': block,
+        'logIndex': log_index,
+        'blockTimestamp': block_time(block),
+        'chainId': chain_id,
+    }
+
+
+def withdraw_row(block: int, log_index: int, owner: str = DEPOSITOR) -> Dict[str, Any]:
+    return {**deposit_row(block, log_index, owner), 'receiver': owner}
+
+
+def transfer_row(block: int, log_index: int, sender: str, receiver: str) -> Dict[str, Any]:
+    return {
+        'id': event_id(block, log_index),
+        'sender': sender,
+        'receiver': receiver,
+        'value': '5',
+        'blockNumber': block,
+        'logIndex': log_index,
+        'blockTimestamp': block_time(block),
+        'chainId': 1,
+    }
+
+
+class KeysetPagingTest(unittest.TestCase):
+    def test_pages_follow_the_block_and_log_cursor(self) -> None:
+        # Several events share block 100, so a page boundary falls inside it.
+        mine = [(100, 1), (100, 2), (100, 5), (101, 0), (130, 4)]
+        rows = [deposit_row(block, log_index) for block, log_index in mine]
+        rows += [deposit_row(100, 3, owner=OTHER), deposit_row(100, 4, chain_id=10)]
+        indexer = FakeIndexer({'Deposit': rows})
+        with mock.patch.object(calc, 'query_envio_graphql', indexer):
+            events = list(calc.iter_deposit_events(DEPOSITOR, VAULT, chain_id=1, page_size=2))
+            self.assertEqual([position(event) for event in events], mine)
+            self.assertEqual(len(indexer.queries), 3)
+            for query, variables in indexer.queries:
+                self.assertIn('chainId: { _eq: $chainId }', query)
+                self.assertEqual(variables['chainId'], 1)
+                self.assertEqual(variables['vaultAddress'], VAULT)
+
+            resumed = list(calc.iter_deposit_events(DEPOSITOR, VAULT, chain_id=1, page_size=2, after=(100, 5)))
+            self.assertEqual([position(event) for event in resumed], mine[3:])
+
+    def test_transfer_sides_merge_in_chain_order(self) -> None:
+        rows = [
+            transfer_row(100, 0, DEPOSITOR, OTHER),
+            transfer_row(100, 7, OTHER, DEPOSITOR),
+            transfer_row(120, 1, DEPOSITOR, OTHER),
+            transfer_row(90, 2, OTHER, DEPOSITOR),
+        ]
+        with mock.patch.object(calc, 'query_envio_graphql', FakeIndexer({'Transfer': rows})):
+            transfers = list(calc.iter_transfer_events(DEPOSITOR, VAULT, chain_id=1, page_size=1))
+        self.assertEqual([position(event) for event in transfers], [(90, 2), (100, 0), (100, 7), (120, 1)])
+
+
+class CombinedEventQueryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.object(calc, '_COMBINED_EVENTS_QUERY_FAILED', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tables = {
+            'Deposit': [deposit_row(100, 1), deposit_row(110, 0), deposit_row(130, 2), deposit_row(105, 0, owner=OTHER)],
+            'Withdraw': [withdraw_row(200, 3)],
+            'Transfer': [transfer_row(150, 2, DEPOSITOR, OTHER), transfer_row(160, 1, OTHER, DEPOSITOR)],
+        }
+
+    @staticmethod
+    def event_ids(streams: Tuple[Iterator[Any], ...]) -> List[List[Tuple[int, int]]]:
+        return [[position(event) for event in stream] for stream in streams]
+
+    def split_event_ids(self) -> List[List[Tuple[int, int]]]:
+        with mock.patch.object(calc, 'query_envio_graphql', FakeIndexer(self.tables)):
+            return self.event_ids((
+                calc.iter_deposit_events(DEPOSITOR, VAULT, chain_id=1, page_size=2),
+                calc.iter_withdraw_events(DEPOSITOR, VAULT, chain_id=1, page_size=2),
+                calc.iter_transfer_events(DEPOSITOR, VAULT, chain_id=1, page_size=2),
+            ))
+
+    def test_first_pages_share_one_request(self) -> None:
+        indexer = FakeIndexer(self.tables)
+        with mock.patch.object(calc, 'query_envio_graphql', indexer):
+            combined = self.event_ids(calc.fetch_depositor_events(DEPOSITOR, VAULT, chain_id=1, page_size=2))
+        self.assertEqual(combined, self.split_event_ids())
+        self.assertEqual(combined[0], [(100, 1), (110, 0), (130, 2)])
+        # Only the full deposit page needed a follow-up, resumed after its last row.
+        self.assertEqual(len(indexer.queries), 2)
+        self.assertEqual(indexer.queries[1][1]['afterBlock'], 110)
+
+    def test_rejected_query_falls_back_to_separate_queries(self) -> None:
+        indexer = FakeIndexer(self.tables, reject_combined=True)
+        with mock.patch.object(calc, 'query_envio_graphql', indexer):
+            with self.assertLogs(calc.logger, 'WARNING'):
+                first = self.event_ids(calc.fetch_depositor_events(DEPOSITOR, VAULT, chain_id=1, page_size=2))
+            second = self.event_ids(calc.fetch_depositor_events(DEPOSITOR, VAULT, chain_id=1, page_size=2))
+        self.assertEqual(first, self.split_event_ids())
+        self.assertEqual(second, first)
+        self.assertTrue(calc._COMBINED_EVENTS_QUERY_FAILED)
+        # The combined query is not retried once the indexer has rejected it.
+        self.assertEqual(sum('deposits: Deposit(' in query for query, _ in indexer.queries), 1)
+
+    def test_other_indexer_errors_are_raised(self) -> None:
+        def failing_query(*args: Any) -> Dict[str, Any]:
+            raise calc.GraphQLError([{'message': 'database query error', 'extensions': {'code': 'unexpected'}}])
+
+        with mock.patch.object(calc, 'query_envio_graphql', failing_query):
+            with self.assertRaises(calc.GraphQLError):
+                calc.fetch_depositor_events(DEPOSITOR, VAULT, chain_id=1, page_size=2)
+        self.assertFalse(calc._COMBINED_EVENTS_QUERY_FAILED)
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    # Echoes the JSON body back; the server counts the connections it accepted
+    # and can be told to drop each one after answering, like an idle timeout.
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == '/limited':
+            self.send_response(429)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = self.server.drop_after_response
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class HTTPConnectionPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.connections = 0
+        self.server.drop_after_response = False
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(calc.close_http_pools)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/rpc'
+        patcher = mock.patch.object(calc, '_uses_proxy', return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_reuse_one_connection(self) -> None:
+        for index in range(3):
+            self.assertEqual(calc.http_request_json(self.url, {'id': index}), {'id': index})
+        self.assertEqual(self.server.connections, 1)
+
+    def test_closed_idle_connection_is_replaced(self) -> None:
+        self.server.drop_after_response = True
+        self.assertEqual(calc.http_request_json(self.url, {'id': 1}), {'id': 1})
+        # The pooled socket was closed by the server; the retry opens a new one.
+        self.assertEqual(calc.http_request_json(self.url, {'id': 2}), {'id': 2})
+        self.assertEqual(self.server.connections, 2)
+
+    def test_http_errors_keep_their_status(self) -> None:
+        with self.assertRaises(calc.HTTPRequestError) as raised:
+            calc.http_request_json(self.url.replace('/rpc', '/limited'), {'id': 1})
+        self.assertEqual(raised.exception.status, 429)
+
+
+class RpcRankingTest(unittest.TestCase):
+    FALLBACKS = ['https://slow-archive.test', 'https://fast-pruned.test', 'https://fast-archive.test', 'https://down.test']
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.probes = {
+            'https://slow-archive.test': calc.RpcProbeResult('https://slow-archive.test', 0.9, True),
+            'https://fast-pruned.test': calc.RpcProbeResult('https://fast-pruned.test', 0.1, False),
+            'https://fast-archive.test': calc.RpcProbeResult('https://fast-archive.test', 0.2, True),
+            'https://down.test': calc.RpcProbeResult('https://down.test', error=RuntimeError('timed out')),
+            'https://mine.test': calc.RpcProbeResult('https://mine.test', 1.5, False),
+        }
+        self.probed: List[str] = []
+        config = {**calc.CHAIN_CONFIG[1], 'fallback_rpcs': self.FALLBACKS}
+        environ = {key: value for key, value in os.environ.items() if key not in ('RPC_URL', config['rpc_env'])}
+        for patcher in (
+            mock.patch.dict(calc.CHAIN_CONFIG, {1: config}),
+            mock.patch.dict(os.environ, environ, clear=True),
+            mock.patch.object(calc, 'probe_rpc_endpoint', self.probe),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def probe(self, rpc_url: str, timeout: float = calc.RPC_PROBE_TIMEOUT) -> calc.RpcProbeResult:
+        self.probed.append(rpc_url)
+        return self.probes[rpc_url]
+
+    def test_configured_endpoint_first_then_archive_then_latency(self) -> None:
+        os.environ['RPC_URL_ETHEREUM'] = 'https://mine.test'
+        self.assertEqual(
+            [probe.url for probe in calc.rank_rpc_endpoints(1)],
+            ['https://mine.test', 'https://fast-archive.test', 'https://slow-archive.test', 'https://fast-pruned.test'],
+        )
+
+    def test_ranking_is_reused_until_the_candidates_change(self) -> None:
+        ranked = calc.rank_rpc_endpoints(1, self.tmp.name)
+        self.probed.clear()
+        self.assertEqual(calc.rank_rpc_endpoints(1, self.tmp.name), ranked)
+        self.assertEqual(self.probed, [])
+
+        os.environ['RPC_URL'] = 'https://mine.test'
+        self.assertEqual(calc.rank_rpc_endpoints(1, self.tmp.name)[0].url, 'https://mine.test')
+        self.assertEqual(len(self.probed), 5)
+
+    def test_unreachable_favourite_triggers_a_new_probe(self) -> None:
+        calc.rank_rpc_endpoints(1, self.tmp.name)
+        self.probes['https://fast-archive.test'] = calc.RpcProbeResult('https://fast-archive.test', error=RuntimeError('gone'))
+
+        def rpc_call_with_url(rpc_url: str, method: str, params: List[Any], timeout: float = 0) -> str:
+            raise RuntimeError('RPC call failed: connection refused')
+
+        with mock.patch.object(calc, 'rpc_call_with_url', rpc_call_with_url):
+            self.assertEqual(calc.select_rpc_url(1, self.tmp.name), 'https://slow-archive.test')
+
+    def test_all_endpoints_down(self) -> None:
+        for url in self.FALLBACKS:
+            self.probes[url] = calc.RpcProbeResult(url, error=RuntimeError('timed out'))
+        with self.assertRaisesRegex(RuntimeError, 'All RPC endpoints failed for Ethereum'):
+            calc.rank_rpc_endpoints(1)
+
+
+class RpcFailoverTest(unittest.TestCase):
+    ARCHIVE = 'https://archive.test'
+    BACKUP = 'https://backup-archive.test'
+    PRUNED = 'https://pruned.test'
+
+    def setUp(self) -> None:
+        # Keep the backoff short enough to wait out in a test.
+        patcher = mock.patch.object(calc, 'RPC_BACKOFF_BASE_SECONDS', 0.001)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sent: List[str] = []
+
+    def sender(self, answers: Dict[str, List[Any]]) -> Any:
+        # Each endpoint replays its list of answers; exceptions are raised.
+        def send(url: str) -> Any:
+            self.sent.append(url)
+            answer = answers[url].pop(0) if len(answers[url]) > 1 else answers[url][0]
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        return send
+
+    def test_rate_limited_endpoint_fails_over(self) -> None:
+        pool = calc.RpcEndpointPool([self.ARCHIVE, self.BACKUP])
+        send = self.sender({
+            self.ARCHIVE: [calc.RpcError('RPC error: rate limit exceeded', True)],
+            self.BACKUP: ['0x1'],
+        })
+        # A long cooldown so the check below cannot race its expiry.
+        with mock.patch.object(calc, 'RPC_BACKOFF_BASE_SECONDS', 60.0):
+            self.assertEqual(pool.call(send), '0x1')
+        self.assertEqual(self.sent, [self.ARCHIVE, self.BACKUP])
+        # The failed endpoint stays out of rotation while it cools down.
+        self.assertEqual(pool._choose(), (self.BACKUP, 0.0))
+
+    def test_revert_is_raised_without_failover(self) -> None:
+        pool = calc.RpcEndpointPool([self.ARCHIVE, self.BACKUP])
+        send = self.sender({self.ARCHIVE: [calc.RpcError('RPC error: execution reverted')], self.BACKUP: ['0x1']})
+        with self.assertRaisesRegex(calc.RpcError, 'execution reverted'):
+            pool.call(send)
+        self.assertEqual(self.sent, [self.ARCHIVE])
+
+    def test_historical_reads_wait_for_archive_endpoints(self) -> None:
+        pool = calc.RpcEndpointPool([self.ARCHIVE, self.PRUNED], spread=2, archive_urls=[self.ARCHIVE])
+        send = self.sender({
+            self.ARCHIVE: [calc.RpcError('RPC call failed: HTTP Error 503', True), '0x2'],
+            self.PRUNED: ['0x0'],
+        })
+        self.assertEqual(pool.call(send, historical=True), '0x2')
+        self.assertEqual(self.sent, [self.ARCHIVE, self.ARCHIVE])
+        for _ in range(3):
+            pool.call(send)
+        self.assertIn(self.PRUNED, self.sent)
+
+    def test_historical_reads_give_up_after_the_retries(self) -> None:
+        pool = calc.RpcEndpointPool([self.ARCHIVE, self.PRUNED], retries=2, archive_urls=[self.ARCHIVE])
+        send = self.sender({self.ARCHIVE: [calc.RpcError('RPC error: header not found', True)], self.PRUNED: ['0x0']})
+        with self.assertRaisesRegex(calc.RpcError, 'header not found'):
+            pool.call(send, historical=True)
+        self.assertEqual(self.sent, [self.ARCHIVE] * 3)
+
+    def test_rpc_call_routes_through_the_registered_pool(self) -> None:
+        endpoints = [
+            calc.RpcProbeResult(self.PRUNED, 0.1, False),
+            calc.RpcProbeResult(self.ARCHIVE, 0.2, True),
+        ]
+        with mock.patch.dict(os.environ, {'RPC_URL': '', 'RPC_URL_ETHEREUM': ''}):
+            pool = calc.build_rpc_pool(1, endpoints)
+        self.assertEqual(pool.archive_urls, [self.ARCHIVE])
+        seen: List[Tuple[str, str]] = []
+
+        def rpc_call_with_url(url: str, method: str, params: List[Any]) -> str:
+            seen.append((url, method))
+            return '0x1'
+
+        with mock.patch.dict(calc._RPC_POOLS), mock.patch.object(calc, 'rpc_call_with_url', rpc_call_with_url):
+            calc.register_rpc_pool(self.PRUNED, pool)
+            calc.rpc_call(self.PRUNED, 'eth_call', calc.eth_call_params(VAULT, calc.PRICE_PER_SHARE_SELECTOR, 100))
+            calc.rpc_call(self.PRUNED, 'eth_call', calc.eth_call_params(VAULT, calc.PRICE_PER_SHARE_SELECTOR))
+        self.assertEqual(seen[0], (self.ARCHIVE, 'eth_call'))
+        self.assertEqual(len(seen), 2)
+
+    def test_graphql_retries_transport_errors(self) -> None:
+        replies: List[Any] = [calc.HTTPRequestError('HTTP Error 503: Service Unavailable', 503), {'data': {'ok': True}}]
+
+        def http_request_json(*args: Any, **kwargs: Any) -> Any:
+            reply = replies.pop(0)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+
+        with mock.patch.object(calc, 'http_request_json', http_request_json):
+            self.assertEqual(calc.query_envio_graphql('{ ok }', {}), {'ok': True})
+            replies.append(calc.HTTPRequestError('HTTP Error 400: Bad Request', 400))
+            with self.assertRaisesRegex(RuntimeError, 'GraphQL query failed'):
+                calc.query_envio_graphql('{ ok }', {})
+
+
+
+def decode_aggregate3_calls(calldata: str) -> List[Tuple[str, bool, str]]:
+    # Independent decoder for aggregate3((address,bool,bytes)[]) calldata.
+    assert calldata.startswith(calc.AGGREGATE3_SELECTOR)
+    payload = bytes.fromhex(calldata[len(calc.AGGREGATE3_SELECTOR):])
+
+    def word(offset: int) -> int:
+        return int.from_bytes(payload[offset:offset + 32], 'big')
+
+    array_start = word(0)
+    count = word(array_start)
+    base = array_start + 32
+    calls = []
+    for index in range(count):
+        element = base + word(base + 32 * index)
+        target = '0x' + payload[element + 12:element + 32].hex()
+        allow_failure = word(element + 32) != 0
+        data_start = element + word(element + 64)
+        length = word(data_start)
+        calls.append((target, allow_failure, '0x' + payload[data_start + 32:data_start + 32 + length].hex()))
+    return calls
+
+
+def encode_aggregate3_results(results: List[Tuple[bool, bytes]]) -> str:
+    # (bool success, bytes returnData)[] as Multicall3 returns it.
+    def word(value: int) -> bytes:
+        return value.to_bytes(32, 'big')
+
+    elements = []
+    for success, data in results:
+        padded = data + b'\0' * (-len(data) % 32)
+        elements.append(word(int(success)) + word(64) + word(len(data)) + padded)
+    offsets = []
+    position = 32 * len(results)
+    for element in elements:
+        offsets.append(word(position))
+        position += len(element)
+    return '0x' + (word(32) + word(len(results)) + b''.join(offsets) + b''.join(elements)).hex()
+
+
+class Aggregate3Test(unittest.TestCase):
+    def test_encode_round_trip(self) -> None:
+        calls = [
+            ('0x' + '11' * 20, calc.PRICE_PER_SHARE_SELECTOR),
+            ('0x' + 'AB' * 20, calc.GET_VAULT_CONFIG_SELECTOR + calc._abi_address(VAULT)),
+            ('0x' + '22' * 20, '0x' + 'ff' * 33),
+            ('0x' + '33' * 20, '0x'),
+        ]
+        decoded = decode_aggregate3_calls(calc.encode_aggregate3(calls))
+        self.assertEqual(decoded, [(target.lower(), True, data) for target, data in calls])
+
+    def test_decode_results(self) -> None:
+        results = [(True, (12345).to_bytes(32, 'big')), (False, b'\x08\xc3\x79\xa0'), (True, b'\x01' * 33), (True, b'')]
+        decoded = calc.decode_aggregate3(encode_aggregate3_results(results), len(results))
+        self.assertEqual(decoded, [f'0x{12345:064x}', None, '0x' + '01' * 33, '0x'])
+
+    def test_decode_rejects_bad_responses(self) -> None:
+        response = encode_aggregate3_results([(True, b'\x01' * 32)] * 2)
+        with self.assertRaises(ValueError):
+            calc.decode_aggregate3(response, 3)
+        with self.assertRaises(ValueError):
+            calc.decode_aggregate3(response[:-64], 2)
+
+
+class VaultAccountingReplayTest(unittest.TestCase):
+    # Accounting events of a vault with reports, locked-profit unlocking and
+    # profitMaxUnlockTime updates, with pricePerShare read over RPC at every
+    # event block and between them.
+    @classmethod
+    def setUpClass(cls) -> None:
+        with open(os.path.join(TESTDATA_DIR, 'vault_accounting_replay.json'), encoding='utf-8') as handle:
+            cls.fixture: Dict = json.load(handle)
+
+    def test_replay_matches_recorded_price_per_share(self) -> None:
+        fixture = self.fixture
+        events = [(block, log_index, kind, row) for block, log_index, kind, row in fixture['events']]
+        model = calc.replay_vault_accounting(
+            events, fixture['vault'], fixture['initial_profit_max_unlock_time'], fixture['decimals']
+        )
+        self.assertTrue(any(kind == 'report' for _, _, kind, _ in events))
+        for block_number, timestamp, expected in fixture['price_per_share']:
+            with self.subTest(block=block_number):
+                state = model.state_at(block_number)
+                self.assertEqual(state.price_per_share(timestamp, fixture['decimals']), int(expected))
+
+
+class PpsSeriesIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def build(self, points: List[Tuple[int, int]]) -> calc.PpsSeriesIndex:
+        index = calc.PpsSeriesIndex(1, VAULT, 'events')
+        index.extend(points, 500)
+        return index
+
+    def test_round_trip(self) -> None:
+        for values in ([10**6 + 1, 10**6 + 2, 10**6 + 3], [10**6, 2**64, 10**30]):
+            with self.subTest(typed=values[1] < 2**64):
+                saved = self.build(list(zip([300, 100, 200], values)))
+                self.assertIsNotNone(calc.save_pps_index(self.tmp.name, saved))
+                loaded = calc.load_pps_index(self.tmp.name, 1, VAULT)
+                self.assertEqual(list(loaded.blocks), [100, 200, 300])
+                self.assertEqual(list(loaded.values), [values[1], values[2], values[0]])
+                self.assertEqual((loaded.through_block, loaded.source), (500, 'events'))
+                self.assertEqual(loaded.get(200), values[2])
+                # Only exact event blocks are answered; PPS drifts in between.
+                self.assertIsNone(loaded.get(150))
+                self.assertIsNone(calc.load_pps_index(self.tmp.name, 10, VAULT))
+
+    def test_extend_only_adds_later_blocks(self) -> None:
+        index = self.build([(100, 1), (200, 2)])
+        index.extend([(150, 9), (600, 6)], 700)
+        self.assertEqual(list(index.blocks), [100, 200, 600])
+        self.assertEqual(index.through_block, 700)
+
+    def test_unwritable_cache_dir_is_not_fatal(self) -> None:
+        not_a_dir = os.path.join(self.tmp.name, 'file')
+        open(not_a_dir, 'w').close()
+        with self.assertLogs(calc.logger, 'WARNING'):
+            self.assertIsNone(calc.save_pps_index(not_a_dir, self.build([(100, 1)])))
+
+    def test_lookups_use_the_index_before_rpc(self) -> None:
+        ctx = vault_context(pps_index=self.build([(100, 7), (200, 8)]))
+        with mock.patch.object(calc, 'contract_call', side_effect=AssertionError('unexpected RPC read')):
+            self.assertEqual(calc.get_price_per_share_at_block(ctx, 100), 7)
+            self.assertEqual(calc.prefetch_price_per_share(ctx, [100, 200]), 0)
+        self.assertEqual(ctx.price_per_share_cache, {100: 7, 200: 8})
+
+
+class StaticPricePerShareTest(unittest.TestCase):
+    # A report at block 120 locks profit for 50 blocks' worth of seconds, and a
+    # deposit at block 200 changes pricePerShare again.
+    UNLOCK_TIME = 12 * 50
+
+    def event_pages(
+        self,
+        name: str,
+        entity: str,
+        filters: str,
+        variable_definitions: str,
+        variables: Dict[str, Any],
+        fields: List[str],
+        chain_id: int,
+        page_size: int = calc.DEFAULT_GRAPHQL_PAGE_SIZE,
+        after: Tuple[int, int] = (-1, -1),
+    ) -> Iterator[List[Dict[str, Any]]]:
+        rows = {
+            'StrategyReported': [{'blockNumber': 120, 'logIndex': 4, 'blockTimestamp': block_time(120)}],
+            'Deposit': [{'blockNumber': 200, 'logIndex': 1}, {'blockNumber': 90, 'logIndex': 0}],
+        }.get(entity, [])
+        yield [row for row in rows if (row['blockNumber'], row['logIndex']) > after]
+
+    def contract_call(self, rpc_url: str, address: str, data: str, block_number: Optional[int] = None) -> str:
+        self.assertEqual(data, calc.PROFIT_MAX_UNLOCK_TIME_SELECTOR)
+        return hex(self.UNLOCK_TIME)
+
+    def build_plan(self, ctx: calc.VaultContext) -> None:
+        with mock.patch.object(calc, 'iter_envio_event_pages', self.event_pages), \
+                mock.patch.object(calc, 'contract_call', self.contract_call):
+            calc.ensure_pps_change_plan(ctx, 100, 300)
+
+    def test_plan_splits_at_changes_and_unlock_windows(self) -> None:
+        ctx = vault_context()
+        self.build_plan(ctx)
+        plan = ctx.pps_change_plan
+        self.assertEqual(plan.change_blocks, [100, 120, 200])
+        self.assertEqual(plan.unlock_ends, [0, block_time(170), block_time(170)])
+        self.assertEqual(plan.segment(110, block_time(110)), 0)
+        # Profit from the block 120 report is still unlocking until block 170.
+        self.assertIsNone(plan.segment(150, block_time(150)))
+        self.assertEqual(plan.segment(180, block_time(180)), 1)
+        self.assertEqual(plan.segment(250, block_time(250)), 2)
+        self.assertIsNone(plan.segment(250, None))
+        self.assertIsNone(plan.segment(400, block_time(400)))
+
+    def test_one_read_per_static_segment(self) -> None:
+        ctx = vault_context()
+        blocks = [105, 110, 130, 160, 180, 190, 210, 250]
+        for block in blocks:
+            calc.remember_block_timestamp(ctx, block, block_time(block))
+        self.build_plan(ctx)
+        read: List[int] = []
+
+        def batch_call(rpc_url: str, calls: List[Tuple[str, List[Any]]], return_exceptions: bool = False) -> List[Any]:
+            read.extend(int(params[1], 16) for _, params in calls)
+            return [pps_at(int(params[1], 16)) for _, params in calls]
+
+        with mock.patch.object(calc, 'rpc_batch_call', batch_call):
+            calc.prefetch_price_per_share(ctx, blocks)
+        self.assertEqual(read, [105, 130, 160, 180, 210])
+        self.assertEqual(ctx.price_per_share_cache[110], int(pps_at(105), 16))
+        self.assertEqual(ctx.price_per_share_cache[190], int(pps_at(180), 16))
+        self.assertEqual(ctx.price_per_share_cache[250], int(pps_at(210), 16))
+        self.assertEqual(calc.get_price_per_share_at_block(ctx, 160), int(pps_at(160), 16))
+
+
+
+class FeeHistoryTest(unittest.TestCase):
+    def test_locates_change_and_revert(self) -> None:
+        # performanceFee 10% until block 1300, 20% until 1600, then 10% again.
+        reads: List[int] = []
+
+        def fee_config(ctx: calc.VaultContext, vault_address: str, block_number: int) -> Tuple[int, int, int, int]:
+            reads.append(block_number)
+            performance_fee = 2000 if 1300 <= block_number < 1600 else 1000
+            return 0, performance_fee, 0, 10000
+
+        with mock.patch.object(calc, 'read_accountant_fee_config', fee_config):
+            changes = calc._locate_fee_changes(vault_context(), 1000, 2000)
+        self.assertEqual(changes, [(1300, (0, 2000)), (1600, (0, 1000))])
+        # Sampling plus two bisections, not a read per block.
+        self.assertLess(len(reads), 60)
+
+    def test_unchanged_config_reads_only_samples(self) -> None:
+        reads: List[int] = []
+
+        def fee_config(ctx: calc.VaultContext, vault_address: str, block_number: int) -> Tuple[int, int, int, int]:
+            reads.append(block_number)
+            return 0, 1000, 0, 10000
+
+        with mock.patch.object(calc, 'read_accountant_fee_config', fee_config):
+            changes = calc._locate_fee_changes(vault_context(), 1000, 2000)
+        self.assertEqual(changes, [])
+        self.assertEqual(sorted(set(reads)), calc._fee_sample_blocks(1000, 2000))
+
+    def test_missing_config_uses_default_rate(self) -> None:
+        ctx = vault_context()
+
+        def fee_config(ctx: calc.VaultContext, vault_address: str, block_number: int) -> Tuple[int, int, int, int]:
+            raise calc.FeeConfigUnavailable(f'Vault has no accountant at block {block_number}')
+
+        with mock.patch.object(calc, 'read_accountant_fee_config', fee_config), self.assertLogs(calc.logger, 'WARNING'):
+            rates = calc._fee_rates_at(ctx, 1500)
+        self.assertEqual(rates, (0, calc.DEFAULT_PERFORMANCE_FEE_BPS))
+        self.assertIn((VAULT, 1500), ctx.fee_config_cache)
+        with mock.patch.object(calc, 'read_accountant_fee_config', fee_config), self.assertRaises(RuntimeError):
+            calc._fee_rates_at(vault_context(), 1500, strict=True)
+
+    def test_rpc_failure_is_not_defaulted(self) -> None:
+        def fee_config(ctx: calc.VaultContext, vault_address: str, block_number: int) -> Tuple[int, int, int, int]:
+            raise calc.RpcError('RPC error: VM Exception while processing transaction')
+
+        with mock.patch.object(calc, 'read_accountant_fee_config', fee_config), self.assertRaises(calc.RpcError):
+            calc._fee_rates_at(vault_context(), 1500)
+
+    def test_revert_is_classified_from_error_code(self) -> None:
+        self.assertTrue(calc._rpc_error({'code': 3, 'message': 'execution reverted', 'data': '0x'}).reverted)
+        self.assertTrue(calc._rpc_error({'code': -32000, 'message': 'VM Exception', 'data': '0x08c379a0'}).reverted)
+        self.assertFalse(calc._rpc_error({'code': -32000, 'message': 'execution reverted: missing trie node'}).reverted)
+        self.assertFalse(calc._rpc_error({'code': -32000, 'message': 'header not found'}).reverted)
+
+
+class CumulativeProfitTest(unittest.TestCase):
+    @unittest.skipUnless(calc.HAS_NUMPY, 'NumPy is not installed')
+    def test_numpy_matches_python(self) -> None:
+        rng = random.Random(1)
+        count = calc.VECTORIZE_MIN_EVENTS * 2
+        cases = {
+            # Small amounts take the int64 path; 18-decimal ones the object path.
+            'int64': (6, [rng.randint(0, 10 ** 12) for _ in range(count)]),
+            'wide': (18, [rng.randint(0, 10 ** 30) for _ in range(count)]),
+            'limbs': (18, [rng.choice((0, 2 ** 64 + rng.randint(0, 10 ** 20), 2 ** 130)) for _ in range(count)]),
+        }
+        for name, (decimals, values) in cases.items():
+            scale = 10 ** decimals
+            balances = calc.LimbColumn()
+            for value in values:
+                balances.append(value)
+            pps = [scale + rng.randint(-scale // 100, scale // 10) for _ in range(count)]
+            for initial in (0, -7, 10 ** 25):
+                with self.subTest(case=name, initial=initial):
+                    with mock.patch.object(calc, 'HAS_NUMPY', True):
+                        vectorized = calc.cumulative_incremental_profit(balances, pps, scale, initial)
+                    with mock.patch.object(calc, 'HAS_NUMPY', False):
+                        plain = calc.cumulative_incremental_profit(balances, pps, scale, initial)
+                    self.assertEqual(vectorized, plain)
+
+
+def history_pps(block: int) -> int:
+    # Slow growth with a hashed wobble, so a history has gains and small losses.
+    return 10 ** 18 + 10 ** 18 * block // 20_000_000 - (block * 2_654_435_761) % 1_009 * 10 ** 11
+
+
+def random_history(
+    events: int,
+    seed: int,
+) -> Tuple[List[calc.DepositEvent], List[calc.WithdrawEvent], List[calc.TransferEvent]]:
+    # One 18-decimal depositor history in (block, log) order whose balance
+    # never goes negative.
+    rng = random.Random(seed)
+    deposits: List[calc.DepositEvent] = []
+    withdrawals: List[calc.WithdrawEvent] = []
+    transfers: List[calc.TransferEvent] = []
+    block = 1_000
+    balance = 0
+    for _ in range(events):
+        block += rng.randint(1, 50)
+        log_index = rng.randint(0, 5)
+        position_fields = indexed_at(block, log_index)
+        if balance and rng.random() < 0.3:
+            shares = rng.randint(1, balance)
+            balance -= shares
+            if rng.random() < 0.5:
+                transfers.append(calc.TransferEvent(event_id(block, log_index), DEPOSITOR, OTHER, str(shares), *position_fields))
+                continue
+            assets = str(shares * history_pps(block) // 10 ** 18)
+            withdrawals.append(calc.WithdrawEvent(
+                event_id(block, log_index), DEPOSITOR, DEPOSITOR, DEPOSITOR, assets, str(shares), *position_fields
+            ))
+            continue
+        shares = rng.randint(1, 1_000 * 10 ** 18)
+        balance += shares
+        assets = str(shares * history_pps(block) // 10 ** 18)
+        deposits.append(calc.DepositEvent(event_id(block, log_index), DEPOSITOR, DEPOSITOR, assets, str(shares), *position_fields))
+    return deposits, withdrawals, transfers
+
+
+class CheckpointResumeTest(unittest.TestCase):
+    def run_position(self, events: int) -> None:
+        deposits, withdrawals, transfers = random_history(events, 7)
+        index = calc.PpsSeriesIndex(calc.DEFAULT_CHAIN_ID, VAULT)
+        all_blocks = sorted({event.block_number for event in [*deposits, *withdrawals, *transfers]})
+        index.extend(((block, history_pps(block)) for block in all_blocks), all_blocks[-1])
+        current_pps = history_pps(all_blocks[-1] + 1_000)
+        checkpoint_block = all_blocks[len(all_blocks) // 2]
+
+        def position(
+            start: Optional[calc.PositionState] = None,
+            checkpoint: Optional[int] = None,
+            after: Tuple[int, int] = (-1, -1),
+        ) -> calc.PositionResult:
+            def later(items: List[Any]) -> List[Any]:
+                return [item for item in items if (item.block_number, item.log_index) > after]
+
+            timeline = calc.build_event_timeline(later(deposits), later(withdrawals), later(transfers), DEPOSITOR)
+            ctx = vault_context(decimals=18, pps_index=index)
+            return calc.calculate_position(ctx, timeline, current_pps, 18, start=start, checkpoint_block=checkpoint)
+
+        with mock.patch.object(calc, 'contract_call', side_effect=AssertionError('unexpected RPC read')), \
+                tempfile.TemporaryDirectory() as cache_dir:
+            full = position(checkpoint=checkpoint_block)
+            self.assertLessEqual(full.checkpoint.last_block, checkpoint_block)
+            calc.save_position_checkpoint(cache_dir, calc.DEFAULT_CHAIN_ID, VAULT, DEPOSITOR, full.checkpoint)
+            restored = calc.load_position_checkpoint(cache_dir, calc.DEFAULT_CHAIN_ID, VAULT, DEPOSITOR)
+            self.assertEqual(restored, full.checkpoint)
+            resumed = position(start=restored, after=(restored.last_block, restored.last_log_index))
+
+        self.assertEqual(resumed.state, full.state)
+        self.assertEqual(resumed.net_profit, full.net_profit)
+        self.assertEqual(resumed.weighted_avg_entry_pps, full.weighted_avg_entry_pps)
+        self.assertEqual(resumed.cumulative_profit, full.cumulative_profit[-len(resumed.cumulative_profit):])
+
+    def test_resume_matches_full_run(self) -> None:
+        self.run_position(200)
+
+    def test_resume_matches_full_run_vectorized(self) -> None:
+        # Long enough for the NumPy path when it is installed.
+        self.run_position(calc.VECTORIZE_MIN_EVENTS * 3)
+
+    def test_unreadable_checkpoint_is_ignored(self) -> None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = calc.checkpoint_path(cache_dir, 1, VAULT, DEPOSITOR)
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'w', encoding='utf-8') as handle:
+                handle.write('{"version": ')
+            self.assertIsNone(calc.load_position_checkpoint(cache_dir, 1, VAULT, DEPOSITOR))
+
+
+class BlockTimeIndexTest(unittest.TestCase):
+    @staticmethod
+    def chain_time(block: int) -> int:
+        # 12 second blocks until block 50,000, then 2 second blocks.
+        return 1_600_000_000 + 12 * min(block, 50_000) + 2 * max(block - 50_000, 0)
+
+    def test_estimates_are_bounded_by_the_anchors(self) -> None:
+        index = calc.BlockTimeIndex(1, max_error=60)
+        index.add(200, 2_400)
+        index.add(100, 1_200)
+        self.assertEqual(index.estimate(100), (1_200, 0))
+        self.assertEqual(index.estimate(150), (1_800, 600))
+        self.assertIsNone(index.estimate(250))
+        index.mark_linear(100, 200)
+        self.assertEqual(index.estimate(150), (1_800, 60))
+        self.assertEqual(index.block_at(1_500), 125.0)
+
+    def test_refined_index_dates_blocks_without_reads(self) -> None:
+        reads: List[int] = []
+
+        def rpc_call(rpc_url: str, method: str, params: List[Any]) -> Dict[str, str]:
+            self.assertEqual(method, 'eth_getBlockByNumber')
+            block = int(params[0], 16)
+            reads.append(block)
+            return {'timestamp': hex(self.chain_time(block))}
+
+        ctx = vault_context()
+        blocks = range(1_000, 100_000, 1_000)
+        with mock.patch.object(calc, 'rpc_call', rpc_call):
+            calc.refine_block_time_index(ctx, blocks)
+            refine_reads = len(reads)
+            for block in blocks:
+                estimate = calc.get_block_timestamp(ctx, block)
+                self.assertLessEqual(abs(estimate.timestamp() - self.chain_time(block)), calc.BLOCK_TIME_MAX_ERROR_SECONDS)
+        # Both ends plus a few midpoint checks around the block time change.
+        self.assertLess(refine_reads, 10)
+        self.assertEqual(len(reads), refine_reads)
+
+    def test_only_finalized_anchors_are_saved(self) -> None:
+        index = calc.BlockTimeIndex(1)
+        for block in (100, 200, 300, 400):
+            index.add(block, self.chain_time(block))
+        index.mark_linear(100, 400)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            calc.save_block_time_index(cache_dir, index, 300)
+            loaded = calc.load_block_time_index(cache_dir, 1)
+        self.assertEqual(list(loaded.blocks), [100, 200, 300])
+        self.assertEqual(list(loaded.timestamps), [self.chain_time(block) for block in (100, 200, 300)])
+        # The last saved segment continued past the finalized block, so it is rechecked.
+        self.assertEqual(list(loaded.linear), [1, 1, 0])
+
+
+class ChainlistSnapshotTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.dict(calc._CHAIN_BLOCK_TIME_CACHE, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refresh_keeps_a_few_rpcs_and_the_median_block_time(self) -> None:
+        listed = [f'https://eth-{index}.test' for index in range(10)]
+        chainlist = [
+            {'chainId': 1, 'rpc': ['wss://eth.test', *({'url': url} for url in listed)]},
+            {'chainId': 8453, 'rpc': ['https://base-down.test']},
+        ]
+        block_times = {listed[0]: 12.5, listed[1]: 11.0, listed[2]: 12.0}
+        fetches: List[Any] = []
+
+        def http_request_json(url: str, *args: Any, **kwargs: Any) -> Any:
+            fetches.append((url, kwargs.get('timeout')))
+            return chainlist
+
+        with mock.patch.object(calc, 'http_request_json', http_request_json), \
+                mock.patch.object(calc, '_estimate_block_time_seconds', lambda url: block_times.get(url)):
+            calc.refresh_chainlist_snapshot(self.tmp.name)
+        self.assertEqual(fetches, [(calc.CHAINLIST_URL, calc.CHAINLIST_FETCH_TIMEOUT)])
+        chains = calc._load_chainlist_snapshot(self.tmp.name)['chains']
+        self.assertEqual(chains['1'], {'rpcs': listed[:calc.CHAINLIST_SNAPSHOT_MAX_RPCS], 'block_time': 12.0})
+        # Neither the listed nor the configured Base endpoints answered.
+        self.assertEqual(chains['8453'], {'rpcs': ['https://base-down.test'], 'block_time': None})
+
+    def test_fallback_block_time_never_waits_for_a_refresh(self) -> None:
+        ctx = vault_context(cache_dir=self.tmp.name)
+        with mock.patch.object(calc, '_start_chainlist_refresh') as start_refresh:
+            self.assertEqual(calc.get_chain_fallback_block_time_seconds(ctx), calc.CHAIN_CONFIG[1]['block_time'])
+        start_refresh.assert_called_once_with(self.tmp.name)
+
+        calc._CHAIN_BLOCK_TIME_CACHE.clear()
+        calc._save_chainlist_snapshot(self.tmp.name, {'1': {'rpcs': [], 'block_time': 12.1}})
+        with mock.patch.object(calc, '_start_chainlist_refresh') as start_refresh:
+            self.assertEqual(calc.get_chain_fallback_block_time_seconds(ctx), 12.1)
+        start_refresh.assert_not_called()
+
+    def test_exit_waits_briefly_for_a_running_refresh(self) -> None:
+        release = threading.Event()
+        thread = threading.Thread(target=release.wait, daemon=True)
+        thread.start()
+        self.addCleanup(release.set)
+        with mock.patch.object(calc, '_CHAINLIST_REFRESH', thread), \
+                mock.patch.object(calc, 'CHAINLIST_REFRESH_EXIT_TIMEOUT', 0.05):
+            calc._join_chainlist_refresh()
+        self.assertTrue(thread.is_alive())
+
+
+class ResultWriterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        history = FakeVaultHistory()
+        with history.patch():
+            self.records = [DepositorBatchTest().analyze(vault_context(), holder) for holder in (DEPOSITOR, OTHER)]
+        self.records.append({'depositor': 'bad', 'vault': VAULT, 'chain_id': 1, 'error': 'Invalid address'})
+
+    def write(self, output_format: str, records: List[Dict[str, Any]], single: bool = False) -> str:
+        path = os.path.join(self.tmp.name, f'out.{output_format}')
+        writer = calc.ResultWriter(output_format, path, single=single)
+        for record in records:
+            writer.write(record)
+        writer.close()
+        return path
+
+    def test_records_share_the_summary_schema(self) -> None:
+        names = [name for name, _ in calc.SUMMARY_FIELDS]
+        self.assertEqual(list(self.records[0]), [name for name in names if name != 'error'])
+
+    def test_json_and_jsonl(self) -> None:
+        with open(self.write('jsonl', self.records), encoding='utf-8') as handle:
+            self.assertEqual([json.loads(line) for line in handle], self.records)
+        with open(self.write('json', self.records), encoding='utf-8') as handle:
+            self.assertEqual(json.load(handle), self.records)
+        with open(self.write('json', self.records[:1], single=True), encoding='utf-8') as handle:
+            self.assertEqual(json.load(handle), self.records[0])
+        with open(self.write('json', []), encoding='utf-8') as handle:
+            self.assertEqual(json.load(handle), [])
+
+    def test_csv_keeps_the_flat_columns(self) -> None:
+        detailed = [{**self.records[0], 'events_detail': [{'block': 100}]}, self.records[2]]
+        with open(self.write('csv', detailed), encoding='utf-8', newline='') as handle:
+            rows = list(csv.DictReader(handle))
+        self.assertEqual(list(rows[0]), [name for name, _ in calc.SUMMARY_FIELDS])
+        self.assertEqual(rows[0]['current_shares'], self.records[0]['current_shares'])
+        self.assertEqual((rows[1]['error'], rows[1]['current_shares']), ('Invalid address', ''))
+
+    @unittest.skipUnless(calc.HAS_PYARROW, 'pyarrow is not installed')
+    def test_parquet_round_trip(self) -> None:
+        with mock.patch.object(calc, 'PARQUET_ROW_GROUP_SIZE', 2):
+            path = self.write('parquet', self.records)
+        table = calc.pq.read_table(path)
+        self.assertEqual(table.column_names, [name for name, _ in calc.SUMMARY_FIELDS])
+        self.assertEqual(calc.pq.ParquetFile(path).num_row_groups, 2)
+        rows = table.to_pylist()
+        self.assertEqual(rows[1]['net_profit'], self.records[1]['net_profit'])
+        self.assertEqual(rows[2]['error'], 'Invalid address')
+
+    def test_parquet_needs_pyarrow_and_a_path(self) -> None:
+        with mock.patch.object(calc, 'HAS_PYARROW', False), self.assertRaisesRegex(RuntimeError, 'pyarrow'):
+            calc.ResultWriter('parquet', os.path.join(self.tmp.name, 'out.parquet'))
+        with mock.patch.object(calc, 'HAS_PYARROW', True), self.assertRaisesRegex(RuntimeError, 'file path'):
+            calc.ResultWriter('parquet')
+
+
+if __name__ == '__main__':
+    unittest.main()